@@ -0,0 +1,45 @@
+"""Utilities for working with python services."""
+from importlib import import_module
+from typing import Any
+
+_LAZY_ATTRIBUTES = {
+    "Timing": "servicetools.timer",
+    "LogFormat": "servicetools.logging_config",
+    "Verbosity": "servicetools.logging_config",
+    "default_logging": "servicetools.logging_config",
+    "RequestMetrics": "servicetools.metrics",
+    "StructlogRequestMiddleware": "servicetools.middleware",
+    "LazyActor": "servicetools.lazyactor",
+    "init_all": "servicetools.lazyactor",
+}
+# The extra each integration needs, and the top-level packages that extra installs.
+_EXTRAS = {
+    "servicetools.middleware": ("starlette", {"starlette"}),
+    "servicetools.lazyactor": ("dramatiq", {"dramatiq", "pika"}),
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name: str) -> Any:
+    """
+    Import the module an attribute is defined in when the attribute is first used.
+
+    Integrations with optional dependencies, such as starlette and dramatiq, are only imported
+    by applications that use them.
+    """
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    try:
+        module = import_module(module_name)
+    except ModuleNotFoundError as e:
+        extra, packages = _EXTRAS.get(module_name, (None, set()))
+        if (e.name or "").partition(".")[0] not in packages:
+            raise
+        raise ImportError(
+            f"{name} requires the {extra!r} extra: pip install python-service-tools[{extra}]"
+        ) from e
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
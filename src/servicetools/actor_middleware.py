@@ -0,0 +1,232 @@
+"""Dramatiq middleware for services."""
+import logging
+import threading
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Optional
+
+from dramatiq.broker import Broker, MessageProxy
+from dramatiq.common import current_millis
+from dramatiq.middleware import Middleware
+from structlog import get_logger
+from structlog.contextvars import bind_contextvars, clear_contextvars
+
+from servicetools.histogram import DEFAULT_PERCENTILES, LatencyHistogram
+from servicetools.metrics import (
+    Labels,
+    prometheus_counter,
+    prometheus_summary,
+    send_prometheus_text,
+)
+
+if TYPE_CHECKING:
+    from starlette.types import Receive, Scope, Send
+
+LOGGER = get_logger(__name__)
+LOG_CONTEXT_OPTION = "log_context"
+
+
+class LogContextMiddleware(Middleware):
+    """
+    Restore the structlog context a message was sent with while it is processed.
+
+    `LazyActor` adds the structlog context variables bound when a message is sent (for example
+    the request ID bound by `StructlogRequestMiddleware`) to the message options. This middleware
+    binds them again on the worker, so logs written by the actor include them:
+
+        broker.add_middleware(LogContextMiddleware())
+    """
+
+    def before_process_message(self, broker: Broker, message: MessageProxy) -> None:
+        """Bind the context the message was sent with."""
+        context = message.options.get(LOG_CONTEXT_OPTION)
+        if context:
+            bind_contextvars(**context)
+
+    def after_process_message(
+        self,
+        broker: Broker,
+        message: MessageProxy,
+        *,
+        result: Optional[Any] = None,
+        exception: Optional[BaseException] = None,
+    ) -> None:
+        """Clear the context once the message has been processed."""
+        clear_contextvars()
+
+    def after_skip_message(self, broker: Broker, message: MessageProxy) -> None:
+        """Clear the context of a skipped message."""
+        clear_contextvars()
+
+
+class ActorMetrics(Middleware):
+    """
+    Aggregate metrics about the messages processed by each actor in memory.
+
+    For each actor, messages are counted along with the errors they raised and how many of them
+    were retries. The queue latency (from when a message was enqueued, or when its delay ended,
+    until a worker started processing it) and the processing time are recorded in latency
+    histograms, so memory is bounded by the number of actors.
+
+    The metrics can be logged as a summary per actor every `summary_interval` seconds, rendered
+    in the Prometheus text format, or served as an ASGI application:
+
+        metrics = ActorMetrics(summary_interval=60)
+        broker.add_middleware(metrics)
+    """
+
+    def __init__(
+        self,
+        prefix: str = "dramatiq",
+        percentiles: Iterable[float] = DEFAULT_PERCENTILES,
+        logger: Any = LOGGER,
+        log_level: int = logging.INFO,
+        summary_interval: Optional[float] = None,
+    ) -> None:
+        """
+        Create actor metrics.
+
+        :param prefix: Prefix for the names of the metrics.
+        :param percentiles: Percentiles to report for queue latencies and processing times.
+        :param logger: structlog logger to write summaries to.
+        :param log_level: logging level to write summaries at.
+        :param summary_interval: Seconds between summary logs, or None to not log summaries.
+        """
+        self.prefix = prefix
+        self.percentiles = tuple(percentiles)
+        self.logger = logger
+        self.log_level = log_level
+        self.summary_interval = summary_interval
+        self._lock = threading.Lock()
+        self._messages: Dict[Labels, float] = {}
+        self._errors: Dict[Labels, float] = {}
+        self._retries: Dict[Labels, float] = {}
+        self._queue_latencies: Dict[Labels, LatencyHistogram] = {}
+        self._durations: Dict[Labels, LatencyHistogram] = {}
+        self._start_times: Dict[str, float] = {}
+        self._next_summary = perf_counter() + (summary_interval or 0)
+
+    def _histogram(
+        self, histograms: Dict[Labels, LatencyHistogram], labels: Labels
+    ) -> LatencyHistogram:
+        """Get the histogram for the given labels. Must be called with the lock."""
+        histogram = histograms.get(labels)
+        if histogram is None:
+            histogram = histograms[labels] = LatencyHistogram()
+        return histogram
+
+    def before_process_message(self, broker: Broker, message: MessageProxy) -> None:
+        """Record the queue latency of the message and start timing it."""
+        labels = (("actor_name", message.actor_name),)
+        enqueued_at = message.options.get("eta") or message.message_timestamp
+        queue_latency = max(current_millis() - enqueued_at, 0) / 1000
+        with self._lock:
+            if message.options.get("retries"):
+                self._retries[labels] = self._retries.get(labels, 0) + 1
+            histogram = self._histogram(self._queue_latencies, labels)
+            self._start_times[message.message_id] = perf_counter()
+        histogram.record(queue_latency)
+
+    def after_process_message(
+        self,
+        broker: Broker,
+        message: MessageProxy,
+        *,
+        result: Optional[Any] = None,
+        exception: Optional[BaseException] = None,
+    ) -> None:
+        """Record the processing time and outcome of the message."""
+        labels = (("actor_name", message.actor_name),)
+        with self._lock:
+            start_time = self._start_times.pop(message.message_id, None)
+            self._messages[labels] = self._messages.get(labels, 0) + 1
+            if exception is not None:
+                self._errors[labels] = self._errors.get(labels, 0) + 1
+            histogram = self._histogram(self._durations, labels)
+        if start_time is not None:
+            histogram.record(perf_counter() - start_time)
+        self._log_summaries()
+
+    def after_skip_message(self, broker: Broker, message: MessageProxy) -> None:
+        """Stop timing a skipped message."""
+        with self._lock:
+            self._start_times.pop(message.message_id, None)
+
+    def _log_summaries(self) -> None:
+        """Log a summary for each actor if the summary interval has elapsed."""
+        if self.summary_interval is None:
+            return
+        now = perf_counter()
+        with self._lock:
+            if now < self._next_summary:
+                return
+            self._next_summary = now + self.summary_interval
+        for actor_name, summary in self.summaries().items():
+            self.logger.log(self.log_level, "actor summary", actor_name=actor_name, **summary)
+
+    def summaries(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Summarize the metrics of each actor.
+
+        :return: Dictionary of actor name to its message, error and retry counts, and summaries
+            of its queue latencies and processing times.
+        """
+        with self._lock:
+            messages = dict(self._messages)
+            errors = dict(self._errors)
+            retries = dict(self._retries)
+            queue_latencies = dict(self._queue_latencies)
+            durations = dict(self._durations)
+        return {
+            labels[0][1]: {
+                "messages": messages.get(labels, 0),
+                "errors": errors.get(labels, 0),
+                "retries": retries.get(labels, 0),
+                "queue_latency": queue_latencies[labels].summary(self.percentiles),
+                "duration": durations[labels].summary(self.percentiles),
+            }
+            for labels in durations
+            if labels in queue_latencies
+        }
+
+    def render(self) -> str:
+        """
+        Render the metrics in the Prometheus text format.
+
+        :return: Rendered metrics.
+        """
+        with self._lock:
+            messages = dict(self._messages)
+            errors = dict(self._errors)
+            retries = dict(self._retries)
+            queue_latencies = dict(self._queue_latencies)
+            durations = dict(self._durations)
+        lines = prometheus_counter(
+            f"{self.prefix}_messages_total", "Total number of messages processed.", messages
+        )
+        lines += prometheus_counter(
+            f"{self.prefix}_message_errors_total",
+            "Total number of messages that raised an exception.",
+            errors,
+        )
+        lines += prometheus_counter(
+            f"{self.prefix}_message_retries_total",
+            "Total number of retried messages processed.",
+            retries,
+        )
+        lines += prometheus_summary(
+            f"{self.prefix}_message_queue_latency_seconds",
+            "Seconds messages waited in the queue before being processed.",
+            queue_latencies,
+            self.percentiles,
+        )
+        lines += prometheus_summary(
+            f"{self.prefix}_message_duration_seconds",
+            "Seconds spent processing messages.",
+            durations,
+            self.percentiles,
+        )
+        return "\n".join(lines) + "\n"
+
+    async def __call__(self, scope: "Scope", receive: "Receive", send: "Send") -> None:
+        """Serve the metrics in the Prometheus text format."""
+        await send_prometheus_text(self.render(), send)
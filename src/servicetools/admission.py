@@ -0,0 +1,198 @@
+"""Track requests in flight and shed load when a service is overloaded."""
+import asyncio
+from typing import TYPE_CHECKING, Dict, Optional
+
+from servicetools.metrics import Labels, prometheus_counter, prometheus_gauge, send_prometheus_text
+
+if TYPE_CHECKING:
+    from starlette.types import Receive, Scope, Send
+
+DEFAULT_LAG_INTERVAL = 0.1
+
+SHED_IN_FLIGHT = "in_flight"
+SHED_ROUTE_IN_FLIGHT = "route_in_flight"
+SHED_LOOP_LAG = "loop_lag"
+
+
+class EventLoopLagMonitor:
+    """
+    Measure how late the event loop runs callbacks.
+
+    A task sleeps `interval` seconds at a time, and the time it wakes up late by is the lag: how
+    long callbacks wait for the loop, typically because a coroutine ran blocking code or the loop
+    has more work than it can keep up with. `lag` is the lag of the last measurement.
+    """
+
+    def __init__(self, interval: float = DEFAULT_LAG_INTERVAL) -> None:
+        """
+        Create an event loop lag monitor.
+
+        :param interval: Seconds between measurements.
+        """
+        self.interval = interval
+        self.lag = 0.0
+        self._task: "Optional[asyncio.Task[None]]" = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self) -> None:
+        """Start measuring the lag of the running event loop, if it is not already measured."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task is not None and not self._task.done():
+            return
+        self.lag = 0.0
+        self._loop = loop
+        self._task = loop.create_task(self._measure())
+
+    def stop(self) -> None:
+        """Stop measuring the lag."""
+        if self._task is not None and self._loop is not None and not self._loop.is_closed():
+            self._task.cancel()
+        self._task = None
+        self._loop = None
+
+    async def _measure(self) -> None:
+        """Measure the lag until cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            start_time = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(loop.time() - start_time - self.interval, 0.0)
+
+
+class AdmissionControl:
+    """
+    Track the requests in flight and shed new requests when the service is overloaded.
+
+    Requests are counted globally while they are handled, and per route template when their route
+    is known before they are routed. A new request is shed when admitting it would take the
+    requests in flight above `max_in_flight`, or those of its route above its limit in
+    `max_route_in_flight`, or when the event loop lag is above `max_loop_lag` seconds. Shedding a request with a fast 503 response is far cheaper than
+    queueing it until it times out, and lets a load balancer retry it elsewhere.
+
+    Use it with `StructlogRequestMiddleware`. Instances are ASGI applications serving the requests
+    in flight (by route and globally), the event loop lag and the number of requests shed in the
+    Prometheus text format:
+
+        admission = AdmissionControl(max_in_flight=100, max_loop_lag=0.5)
+        app.add_middleware(StructlogRequestMiddleware, admission=admission)
+        app.mount("/admission", admission)
+    """
+
+    def __init__(
+        self,
+        max_in_flight: Optional[int] = None,
+        max_route_in_flight: Optional[Dict[str, int]] = None,
+        max_loop_lag: Optional[float] = None,
+        monitor_loop_lag: bool = False,
+        lag_interval: float = DEFAULT_LAG_INTERVAL,
+        prefix: str = "http",
+    ) -> None:
+        """
+        Create admission control.
+
+        :param max_in_flight: Maximum number of requests handled at once.
+        :param max_route_in_flight: Maximum number of requests handled at once for specific
+            routes, keyed by route template (for example `/users/{user_id}`).
+        :param max_loop_lag: Shed requests while the event loop lag is above this many seconds.
+        :param monitor_loop_lag: Measure the event loop lag even if `max_loop_lag` is not set.
+        :param lag_interval: Seconds between event loop lag measurements.
+        :param prefix: Prefix for the names of the metrics.
+        """
+        self.max_in_flight = max_in_flight
+        self.max_route_in_flight = max_route_in_flight or {}
+        self.max_loop_lag = max_loop_lag
+        self.prefix = prefix
+        self.in_flight = 0
+        self.route_in_flight: Dict[str, int] = {}
+        self.shed = {SHED_IN_FLIGHT: 0, SHED_ROUTE_IN_FLIGHT: 0, SHED_LOOP_LAG: 0}
+        self.lag_monitor = (
+            EventLoopLagMonitor(lag_interval)
+            if max_loop_lag is not None or monitor_loop_lag
+            else None
+        )
+
+    @property
+    def loop_lag(self) -> Optional[float]:
+        """Get the last measured event loop lag, or None if it is not measured."""
+        return self.lag_monitor.lag if self.lag_monitor is not None else None
+
+    def _shed_reason(self, route: Optional[str]) -> Optional[str]:
+        """Get the reason to shed a new request for the given route, if it should be shed."""
+        if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            return SHED_IN_FLIGHT
+        if route is not None and route in self.max_route_in_flight:
+            if self.route_in_flight.get(route, 0) >= self.max_route_in_flight[route]:
+                return SHED_ROUTE_IN_FLIGHT
+        if self.max_loop_lag is not None and self.lag_monitor is not None:
+            if self.lag_monitor.lag > self.max_loop_lag:
+                return SHED_LOOP_LAG
+        return None
+
+    def admit(self, route: Optional[str]) -> Optional[str]:
+        """
+        Admit a new request, unless it should be shed.
+
+        Must be called from the event loop handling the request. Admitted requests must be
+        released with `release` once they have been handled.
+
+        :param route: Route template the request matched, or None if it is not known yet. Requests
+            without a route are only counted globally.
+        :return: None if the request was admitted, otherwise the reason it should be shed.
+        """
+        if self.lag_monitor is not None:
+            self.lag_monitor.start()
+        reason = self._shed_reason(route)
+        if reason is not None:
+            self.shed[reason] += 1
+            return reason
+        self.in_flight += 1
+        if route is not None:
+            self.route_in_flight[route] = self.route_in_flight.get(route, 0) + 1
+        return None
+
+    def release(self, route: Optional[str]) -> None:
+        """
+        Record that an admitted request has been handled.
+
+        :param route: Route template the request was admitted with.
+        """
+        self.in_flight -= 1
+        if route is not None:
+            self.route_in_flight[route] -= 1
+
+    def render(self) -> str:
+        """
+        Render the metrics in the Prometheus text format.
+
+        :return: Rendered metrics.
+        """
+        route_in_flight: Dict[Labels, float] = {
+            (("route", route),): count for route, count in self.route_in_flight.items()
+        }
+        lines = prometheus_gauge(
+            f"{self.prefix}_requests_in_flight",
+            "Number of HTTP requests being handled, by route.",
+            route_in_flight,
+        )
+        # A separate metric, so summing the series by route does not count requests twice.
+        lines += prometheus_gauge(
+            f"{self.prefix}_requests_in_flight_global",
+            "Number of HTTP requests being handled across all routes.",
+            {(): self.in_flight},
+        )
+        lines += prometheus_counter(
+            f"{self.prefix}_requests_shed_total",
+            "Total number of HTTP requests shed.",
+            {(("reason", reason),): count for reason, count in self.shed.items()},
+        )
+        if self.lag_monitor is not None:
+            lines += prometheus_gauge(
+                f"{self.prefix}_event_loop_lag_seconds",
+                "Seconds the event loop last ran callbacks late by.",
+                {(): self.lag_monitor.lag},
+            )
+        return "\n".join(lines) + "\n"
+
+    async def __call__(self, scope: "Scope", receive: "Receive", send: "Send") -> None:
+        """Serve the metrics in the Prometheus text format."""
+        await send_prometheus_text(self.render(), send)
@@ -0,0 +1,84 @@
+"""Log fields that are only computed when the log is rendered."""
+import reprlib
+from typing import Any, Callable
+
+DEFAULT_REPR_LIMIT = 1024
+
+
+class Deferred:
+    """
+    Log field whose value is computed when the log is rendered.
+
+    Expensive fields can be attached to a log call without paying for them when the event is
+    dropped, for example because it is below the log level. The value is computed at most once,
+    when the formatters configured by `default_logging` (or `resolve_deferred`) render it, so it
+    reflects the state of mutable objects at that time, which is later when logs are queued:
+
+        logger.debug("cache state", entries=Deferred(cache.describe))
+    """
+
+    __slots__ = ("fn", "args", "_value", "_resolved")
+
+    def __init__(self, fn: Callable[..., Any], *args: Any) -> None:
+        """
+        Create a deferred value.
+
+        :param fn: Function computing the value.
+        :param args: Arguments to call the function with.
+        """
+        self.fn = fn
+        self.args = args
+        self._value: Any = None
+        self._resolved = False
+
+    def resolve(self) -> Any:
+        """
+        Compute the value, if it has not been already.
+
+        :return: The value.
+        """
+        if not self._resolved:
+            self._value = self.fn(*self.args)
+            self._resolved = True
+        return self._value
+
+    def __str__(self) -> str:
+        """Render the value."""
+        return str(self.resolve())
+
+    def __repr__(self) -> str:
+        """Render the value, without quotes if it is already a representation."""
+        value = self.resolve()
+        return value if isinstance(value, str) else repr(value)
+
+
+def truncated_repr(value: Any, limit: int = DEFAULT_REPR_LIMIT) -> str:
+    """
+    Get a representation of a value that is at most `limit` characters long.
+
+    Large strings and bytes are cut before they are represented, and containers only have their
+    first few items represented, so the cost is bounded however large the value is.
+
+    :param value: Value to represent.
+    :param limit: Maximum number of characters in the representation.
+    :return: Representation of the value, with `...` where it was truncated.
+    """
+    if isinstance(value, (str, bytes, bytearray)) and len(value) > limit:
+        value = value[:limit]
+    truncating_repr = reprlib.Repr()
+    truncating_repr.maxstring = truncating_repr.maxother = truncating_repr.maxlong = limit
+    representation = truncating_repr.repr(value)
+    if len(representation) > limit:
+        representation = representation[: max(limit - 3, 0)] + "..."
+    return representation
+
+
+def deferred_repr(value: Any, limit: int = DEFAULT_REPR_LIMIT) -> Deferred:
+    """
+    Get a deferred, truncated representation of a value.
+
+    :param value: Value to represent when the log is rendered.
+    :param limit: Maximum number of characters in the representation.
+    :return: Deferred representation of the value.
+    """
+    return Deferred(truncated_repr, value, limit)
@@ -0,0 +1,102 @@
+"""Bound loggers that skip the levels their logger is not enabled for."""
+from functools import partial
+import logging
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import structlog
+from structlog.types import Context, Processor
+
+LEVEL_METHODS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "warn": logging.WARNING,
+    "error": logging.ERROR,
+    "exception": logging.ERROR,
+    "critical": logging.CRITICAL,
+    "fatal": logging.CRITICAL,
+}
+
+_generation = 0
+_disabled_methods: Dict[str, Tuple[str, ...]] = {}
+_lock = threading.Lock()
+
+
+def reset_level_cache() -> None:
+    """
+    Forget the cached levels of every logger.
+
+    Must be called when log levels change; `default_logging` calls it. Loggers created before
+    the reset check their levels again the next time a disabled method is called.
+    """
+    global _generation
+    with _lock:
+        _generation += 1
+        _disabled_methods.clear()
+
+
+def disabled_methods(logger: logging.Logger) -> Tuple[str, ...]:
+    """
+    Get the names of the logging methods the given logger is not enabled for.
+
+    :param logger: Standard library logger.
+    :return: Names of the disabled methods, cached until `reset_level_cache` is called.
+    """
+    methods = _disabled_methods.get(logger.name)
+    if methods is None:
+        methods = tuple(
+            name for name, level in LEVEL_METHODS.items() if not logger.isEnabledFor(level)
+        )
+        with _lock:
+            _disabled_methods[logger.name] = methods
+    return methods
+
+
+class LevelFilteringBoundLogger(structlog.stdlib.BoundLogger):
+    """
+    Standard library bound logger whose disabled levels are no-ops.
+
+    `structlog.stdlib.filter_by_level` checks the level of every event after it has been
+    created, costing a method call, a processor call and an `isEnabledFor` call. This logger
+    looks up which levels its standard library logger is enabled for (cached per logger name)
+    when it is created, and replaces the methods for the other levels with ones that return
+    immediately, so a filtered `debug` call costs little more than a function call:
+
+        structlog.configure(wrapper_class=LevelFilteringBoundLogger, ...)
+
+    Events at enabled levels still go through the processors, including `filter_by_level`, so
+    a logger created before levels were raised still drops the events it should.
+    """
+
+    def __init__(
+        self,
+        logger: Any,
+        processors: Iterable[Processor],
+        context: Context,
+    ) -> None:
+        """
+        Create a bound logger.
+
+        :param logger: Standard library logger to wrap.
+        :param processors: Processors to run events through.
+        :param context: Values bound to the logger.
+        """
+        super().__init__(logger, processors, context)
+        self._filter_levels()
+
+    def _filter_levels(self) -> None:
+        """Replace the methods of the levels the logger is not enabled for."""
+        self._generation = _generation
+        for name in LEVEL_METHODS:
+            self.__dict__.pop(name, None)
+        if isinstance(self._logger, logging.Logger):
+            for name in disabled_methods(self._logger):
+                setattr(self, name, partial(self._filtered, name))
+
+    def _filtered(self, name: str, event: Optional[str] = None, *args: Any, **kw: Any) -> Any:
+        """Drop an event at a disabled level, unless the levels have changed since."""
+        if self._generation == _generation:
+            return None
+        self._filter_levels()
+        return getattr(self, name)(event, *args, **kw)
@@ -0,0 +1,86 @@
+"""Log formatters for services."""
+from datetime import date, time
+import json
+import logging
+import traceback
+from types import TracebackType
+from typing import Any, Dict
+
+from servicetools.deferred import Deferred
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+_RESERVED_RECORD_ATTRS = frozenset(
+    vars(logging.LogRecord("", logging.NOTSET, "", 0, "", (), None)).keys()
+) | {"message", "asctime"}
+
+
+def _default(obj: Any) -> Any:
+    """Serialize objects the json encoder does not know about."""
+    if isinstance(obj, Deferred):
+        return obj.resolve()
+    if isinstance(obj, (date, time)):
+        return obj.isoformat()
+    if isinstance(obj, TracebackType):
+        return "".join(traceback.format_tb(obj)).strip()
+    return str(obj)
+
+
+def json_dumps(obj: Dict[str, Any]) -> str:
+    """
+    Serialize a log entry to json.
+
+    orjson is used when it is installed, falling back to the standard library for anything
+    orjson cannot serialize (for example, integers larger than 64 bits).
+
+    :param obj: Log entry to serialize.
+    :return: json string.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass
+    return json.dumps(obj, default=_default)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format log records as a single line of json.
+
+    Records from structlog carry their event dictionary as the message (see
+    `structlog.stdlib.ProcessorFormatter.wrap_for_formatter`); it is serialized in a single pass
+    with the event written as `message`, and any formatted `exception` also written as `exc_info`,
+    like `pythonjsonlogger` wrote it. Records from the standard library are written with their
+    message and any extra attributes, in the same layout as `pythonjsonlogger`.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Format the given record.
+
+        :param record: Record to format.
+        :return: json string.
+        """
+        if isinstance(record.msg, dict):
+            log_entry = {"message": record.msg.get("event")}
+            if "exception" in record.msg:
+                log_entry["exc_info"] = record.msg["exception"]
+            log_entry.update(record.msg)
+            log_entry.pop("event", None)
+            return json_dumps(log_entry)
+
+        log_entry = {"message": record.getMessage()}
+        if record.exc_info:
+            log_entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            log_entry["stack_info"] = self.formatStack(record.stack_info)
+        log_entry.update(
+            (key, value)
+            for key, value in record.__dict__.items()
+            if key not in _RESERVED_RECORD_ATTRS
+        )
+        return json_dumps(log_entry)
@@ -0,0 +1,116 @@
+"""Streaming histograms for latency measurements."""
+import math
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+SIGNIFICANT_BITS = 7
+DEFAULT_PERCENTILES = (50, 90, 99)
+MICROSECONDS = 1_000_000
+
+
+class LatencyHistogram:
+    """
+    Streaming histogram of durations.
+
+    Durations are recorded in microseconds into log-linear buckets (in the style of HDR
+    histograms): every power of two is split into equal width buckets, so percentiles are
+    accurate to within 1% with the default number of significant bits. Only buckets that have
+    been used are stored, and there are at most a few thousand of them for durations up to
+    several hours, so memory is bounded no matter how many durations are recorded.
+
+    Recording takes a lock and does not await, so a histogram can be shared between threads and
+    asyncio tasks.
+    """
+
+    def __init__(self, significant_bits: int = SIGNIFICANT_BITS) -> None:
+        """
+        Create a histogram.
+
+        :param significant_bits: Number of bits of precision to keep for each duration.
+        """
+        self._significant_bits = significant_bits
+        self._counts: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def _bucket(self, value: int) -> int:
+        """Get the index of the bucket the given number of microseconds belongs to."""
+        shift = value.bit_length() - self._significant_bits
+        if shift <= 0:
+            return value
+        return (shift << (self._significant_bits - 1)) + (value >> shift)
+
+    def _bucket_bounds(self, bucket: int) -> Tuple[int, int]:
+        """Get the lowest and highest number of microseconds stored in the given bucket."""
+        shift = (bucket >> (self._significant_bits - 1)) - 1
+        if shift <= 0:
+            return bucket, bucket
+        lowest = (bucket - (shift << (self._significant_bits - 1))) << shift
+        return lowest, lowest + (1 << shift) - 1
+
+    def record(self, seconds: float) -> None:
+        """
+        Record a duration.
+
+        :param seconds: Duration to record.
+        """
+        bucket = self._bucket(max(int(seconds * MICROSECONDS), 0))
+        with self._lock:
+            self._counts[bucket] = self._counts.get(bucket, 0) + 1
+            self.count += 1
+            self.total += seconds
+            if self.min is None or seconds < self.min:
+                self.min = seconds
+            if self.max is None or seconds > self.max:
+                self.max = seconds
+
+    def percentiles(self, percentiles: Iterable[float] = DEFAULT_PERCENTILES) -> Dict[float, float]:
+        """
+        Get the given percentiles of the recorded durations.
+
+        :param percentiles: Percentiles to calculate, between 0 and 100.
+        :return: Dictionary of percentile to duration in seconds.
+        """
+        with self._lock:
+            counts = sorted(self._counts.items())
+            count, lowest, highest = self.count, self.min, self.max
+
+        results: Dict[float, float] = {}
+        if not count or lowest is None or highest is None:
+            return results
+
+        for percentile in sorted(percentiles):
+            rank = max(math.ceil(percentile / 100 * count), 1)
+            seen = 0
+            for bucket, bucket_count in counts:
+                seen += bucket_count
+                if seen >= rank:
+                    low, high = self._bucket_bounds(bucket)
+                    value = (low + high) / 2 / MICROSECONDS
+                    results[percentile] = min(max(value, lowest), highest)
+                    break
+        return results
+
+    def summary(self, percentiles: Iterable[float] = DEFAULT_PERCENTILES) -> Dict[str, Any]:
+        """
+        Summarize the recorded durations.
+
+        :param percentiles: Percentiles to include in the summary.
+        :return: Dictionary with the count, min, max and percentiles (as `p50`, `p99`, ...).
+        """
+        summary: Dict[str, Any] = {"count": self.count, "min": self.min, "max": self.max}
+        for percentile, value in self.percentiles(percentiles).items():
+            summary[f"p{percentile:g}"] = value
+        return summary
+
+    def reset(self) -> None:
+        """Discard all recorded durations."""
+        with self._lock:
+            self._counts = {}
+            self.count = 0
+            self.total = 0.0
+            self.min = None
+            self.max = None
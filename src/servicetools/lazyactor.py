@@ -1,8 +1,239 @@
 """Custom actor specification for dramatiq actors."""
-from typing import Any, Callable, Dict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import sys
+from time import perf_counter
+from types import TracebackType
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
 
 from dramatiq.actor import Actor
-from dramatiq.brokers.rabbitmq import RabbitmqBroker
+from dramatiq.broker import Broker
+from dramatiq.common import current_millis, dq_name
+from dramatiq.errors import ConnectionClosed
+from dramatiq.message import Message
+from structlog.contextvars import get_contextvars
+
+from servicetools.actor_middleware import LOG_CONTEXT_OPTION
+from servicetools.memoize import MemoStore, call_key, default_store
+
+if TYPE_CHECKING:
+    from dramatiq.brokers.rabbitmq import RabbitmqBroker
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_FLUSH_INTERVAL = 1.0
+_MISSING = object()
+
+_PendingMessage = Tuple[Message, Optional[int]]
+
+_registry: Dict[str, "LazyActor"] = {}
+
+
+def _rabbitmq_broker(broker: Broker) -> Optional["RabbitmqBroker"]:
+    """
+    Get the given broker if it is a rabbitmq broker.
+
+    The rabbitmq broker module (and pika) is only imported by applications that use it, so a
+    broker cannot be a rabbitmq broker if the module has not been imported.
+
+    :param broker: Broker to check.
+    :return: The broker if it is a rabbitmq broker, otherwise None.
+    """
+    rabbitmq = sys.modules.get("dramatiq.brokers.rabbitmq")
+    if rabbitmq is not None and isinstance(broker, rabbitmq.RabbitmqBroker):
+        return broker
+    return None
+
+
+def _publish_rabbitmq(
+    broker: "RabbitmqBroker", channel: Any, pending: Sequence[_PendingMessage]
+) -> None:
+    """
+    Publish messages to rabbitmq in a single transaction.
+
+    :param broker: The rabbitmq broker the messages are for.
+    :param channel: Channel in transaction mode to publish on.
+    :param pending: Messages to publish, with their delay in milliseconds.
+    """
+    import pika
+
+    for queue_name in {message.queue_name for message, _ in pending}:
+        broker.declare_queue(queue_name, ensure=True)
+
+    published = []
+    for message, delay in pending:
+        routing_key = message.queue_name
+        if delay is not None:
+            routing_key = dq_name(routing_key)
+            message = message.copy(
+                queue_name=routing_key, options={"eta": current_millis() + delay}
+            )
+        broker.emit_before("enqueue", message, delay)
+        channel.basic_publish(
+            exchange="",
+            routing_key=routing_key,
+            body=message.encode(),
+            properties=pika.BasicProperties(
+                delivery_mode=2, priority=message.options.get("broker_priority")
+            ),
+        )
+        published.append((message, delay))
+    channel.tx_commit()
+
+    for message, delay in published:
+        broker.emit_after("enqueue", message, delay)
+
+
+class MessageBatch:
+    """
+    Batch of messages to send to an actor.
+
+    Messages are buffered and published together once `batch_size` messages are pending, or
+    when a message is added more than `flush_interval` seconds after the oldest pending message.
+    Any pending messages are published when the batch is closed.
+
+    With a rabbitmq broker, each batch is published over one channel in a single transaction,
+    so the broker is waited on once per batch rather than once per message. Other brokers
+    enqueue the messages one at a time.
+
+        with actor.batch() as batch:
+            for item in items:
+                batch.send(item)
+    """
+
+    def __init__(
+        self,
+        actor: Actor,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ) -> None:
+        """
+        Create a batch of messages. This typically should not be called directly.
+
+        :param actor: The actor to send messages to.
+        :param batch_size: Number of messages to publish at once.
+        :param flush_interval: Maximum seconds a message is held before it is published.
+        """
+        self.actor = actor
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.messages: List[Message] = []
+        self._pending: List[_PendingMessage] = []
+        self._flush_deadline: Optional[float] = None
+        self._channel: Any = None
+
+    def send(self, *args: Any, **kwargs: Any) -> Message:
+        """
+        Add a message to the batch.
+
+        :param args: Positional arguments for the actor.
+        :param kwargs: Keyword arguments for the actor.
+        :return: The message, which is published when the batch is flushed.
+        """
+        return self.send_with_options(args=args, kwargs=kwargs)
+
+    def send_with_options(
+        self,
+        *,
+        args: Tuple = (),
+        kwargs: Optional[Dict[str, Any]] = None,
+        delay: Optional[int] = None,
+        **options: Any,
+    ) -> Message:
+        """
+        Add a message to the batch, along with processing options.
+
+        :param args: Positional arguments for the actor.
+        :param kwargs: Keyword arguments for the actor.
+        :param delay: Minimum number of milliseconds to delay the message by.
+        :param options: Options for the broker and middleware.
+        :return: The message, which is published when the batch is flushed.
+        """
+        message = self.actor.message_with_options(args=args, kwargs=kwargs, **options)
+        if isinstance(self.actor, LazyActor):
+            sent = self.actor.sent_duplicate(message)
+            if sent is not None:
+                return sent
+        self._pending.append((message, delay))
+        self.messages.append(message)
+
+        now = perf_counter()
+        if self._flush_deadline is None:
+            self._flush_deadline = now + self.flush_interval
+        if len(self._pending) >= self.batch_size or now >= self._flush_deadline:
+            self.flush()
+        return message
+
+    def flush(self) -> None:
+        """Publish all pending messages."""
+        pending, self._pending = self._pending, []
+        self._flush_deadline = None
+        if not pending:
+            return
+
+        broker = _rabbitmq_broker(self.actor.broker)
+        if broker is None:
+            for index, (message, delay) in enumerate(pending):
+                try:
+                    self.actor.broker.enqueue(message, delay=delay)
+                except Exception:
+                    self._forget_sent(pending[index:])
+                    raise
+            return
+
+        import pika
+
+        try:
+            if self._channel is None:
+                self._channel = broker.connection.channel()
+                self._channel.tx_select()
+            _publish_rabbitmq(broker, self._channel, pending)
+        except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError) as e:
+            self._channel = None
+            self._forget_sent(pending)
+            raise ConnectionClosed(e) from None  # type: ignore
+        except Exception:
+            self._forget_sent(pending)
+            raise
+
+    def _forget_sent(self, pending: List[_PendingMessage]) -> None:
+        """Forget the deduplication records of messages that were not published."""
+        if isinstance(self.actor, LazyActor):
+            for message, _ in pending:
+                self.actor.forget_sent(message)
+
+    def close(self) -> None:
+        """Publish all pending messages and release the channel used to publish them."""
+        try:
+            self.flush()
+        finally:
+            if self._channel is not None and self._channel.is_open:
+                self._channel.close()
+            self._channel = None
+
+    def __enter__(self) -> "MessageBatch":
+        """Start a batch."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        trace: Optional[TracebackType],
+    ) -> None:
+        """Publish any pending messages."""
+        self.close()
 
 
 class LazyActor(Actor):
@@ -13,13 +244,23 @@ class LazyActor(Actor):
     This means that if you have not yet done your broker configuration, your actors will be
     trying to connect to a non-existent broker and will not work. This class makes your actors
     not try to connect to a broker until they have been explicitly called with init_broker.
+
+    Every lazy actor is registered when it is created, so they can all be connected to a broker
+    at once with `init_all`.
+
+    The structlog context variables bound when a message is sent are added to its options, so
+    they can be bound again on the worker with `LogContextMiddleware`. They must be serializable
+    by the broker's encoder.
+
+    Idempotent actors can opt in to deduplicating the messages sent to them and memoizing their
+    results with `memoized`.
     """
 
     def __init__(  # type: ignore
         self,
         fn: Callable,
         *args,
-        broker: RabbitmqBroker,
+        broker: "RabbitmqBroker",
         actor_name: str,
         queue_name: str,
         priority: int,
@@ -38,8 +279,12 @@ class LazyActor(Actor):
         self._queue_name = queue_name
         self._priority = priority
         self._options = options
+        self._dedup_window: Optional[float] = None
+        self._result_ttl: Optional[float] = None
+        self._memo_store: Optional[MemoStore] = None
+        _registry[actor_name] = self
 
-    def init_actor(self, broker: RabbitmqBroker) -> None:
+    def init_actor(self, broker: Broker) -> None:
         """
         Connect the actor with the broker that is being given to it.
 
@@ -53,3 +298,232 @@ class LazyActor(Actor):
             priority=self._priority,
             options=self._options,
         )
+
+    def message_with_options(
+        self, *, args: Tuple = (), kwargs: Optional[Dict[str, Any]] = None, **options: Any
+    ) -> Message:
+        """
+        Build a message for this actor, including the current structlog context.
+
+        :param args: Positional arguments for the actor.
+        :param kwargs: Keyword arguments for the actor.
+        :param options: Options for the broker and middleware.
+        :return: A message that can be enqueued on a broker.
+        """
+        if LOG_CONTEXT_OPTION not in options:
+            context = get_contextvars()
+            if context:
+                options[LOG_CONTEXT_OPTION] = context
+        return super().message_with_options(args=args, kwargs=kwargs, **options)
+
+    def memoize(
+        self,
+        dedup_window: Optional[float] = None,
+        result_ttl: Optional[float] = None,
+        store: Optional[MemoStore] = None,
+    ) -> None:
+        """
+        Deduplicate the messages sent to this actor and memoize its results.
+
+        Messages and results are keyed on the name of the actor and its arguments.
+
+        :param dedup_window: Seconds during which sending a message with the same arguments as
+            one already sent is suppressed, returning the message already sent instead.
+        :param result_ttl: Seconds the results of the actor are cached for, so that duplicate
+            messages that are processed return the cached result without running the actor.
+        :param store: Store to keep sent messages and results in, defaults to the store from
+            `servicetools.memoize.default_store`.
+        """
+        self._dedup_window = dedup_window
+        self._result_ttl = result_ttl
+        self._memo_store = store
+
+    @property
+    def memo_store(self) -> MemoStore:
+        """Store sent messages and results are kept in."""
+        return self._memo_store if self._memo_store is not None else default_store()
+
+    def sent_duplicate(self, message: Message) -> Optional[Message]:
+        """
+        Check if a message with the same arguments was sent within the deduplication window.
+
+        Messages that are not duplicates are recorded, so later messages with the same arguments
+        are duplicates of them until the window ends.
+
+        :param message: Message about to be sent.
+        :return: The message already sent, or None if the message should be sent.
+        """
+        if self._dedup_window is None:
+            return None
+        key = self._sent_key(message)
+        if self.memo_store.add(key, message.asdict(), self._dedup_window):
+            return None
+        sent = self.memo_store.get(key)
+        return Message(**sent) if sent is not None else None
+
+    def forget_sent(self, message: Message) -> None:
+        """
+        Forget a message recorded by `sent_duplicate`, for example because it failed to enqueue.
+
+        Later messages with the same arguments are sent instead of being treated as duplicates.
+
+        :param message: Message that was not sent.
+        """
+        if self._dedup_window is not None:
+            self.memo_store.delete(self._sent_key(message))
+
+    def _sent_key(self, message: Message) -> str:
+        """Get the key a message is recorded under for deduplication."""
+        return "sent:" + call_key(self.actor_name, message.args, message.kwargs)
+
+    def send_with_options(
+        self,
+        *,
+        args: Tuple = (),
+        kwargs: Optional[Dict[str, Any]] = None,
+        delay: Optional[Union[timedelta, int]] = None,
+        **options: Any,
+    ) -> Message:
+        """
+        Send a message to this actor, unless a duplicate was sent within the deduplication window.
+
+        :param args: Positional arguments for the actor.
+        :param kwargs: Keyword arguments for the actor.
+        :param delay: Minimum number of milliseconds (or a timedelta) to delay the message by.
+        :param options: Options for the broker and middleware.
+        :return: The enqueued message, or the duplicate sent before it.
+        """
+        if isinstance(delay, timedelta):
+            delay = int(delay.total_seconds() * 1000)
+        message = self.message_with_options(args=args, kwargs=kwargs, **options)
+        sent = self.sent_duplicate(message)
+        if sent is not None:
+            return sent
+        try:
+            return self.broker.enqueue(message, delay=delay)
+        except Exception:
+            self.forget_sent(message)
+            raise
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        """
+        Run the actor synchronously, returning a cached result when it is memoized.
+
+        :param args: Positional arguments for the actor.
+        :param kwargs: Keyword arguments for the actor.
+        :return: The result of the actor.
+        """
+        if self._result_ttl is None:
+            return super().__call__(*args, **kwargs)
+        key = "result:" + call_key(self.actor_name, args, kwargs)
+        result = self.memo_store.get(key, _MISSING)
+        if result is _MISSING:
+            result = super().__call__(*args, **kwargs)
+            self.memo_store.set(key, result, self._result_ttl)
+        return result
+
+    def batch(
+        self, batch_size: int = DEFAULT_BATCH_SIZE, flush_interval: float = DEFAULT_FLUSH_INTERVAL
+    ) -> MessageBatch:
+        """
+        Start a batch of messages to send to this actor.
+
+        :param batch_size: Number of messages to publish at once.
+        :param flush_interval: Maximum seconds a message is held before it is published.
+        :return: Batch to add messages to, to use as a context manager.
+        """
+        return MessageBatch(self, batch_size, flush_interval)
+
+    def send_many(
+        self, args: Iterable[Sequence[Any]], batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> List[Message]:
+        """
+        Send a message to this actor for each set of positional arguments, in batches.
+
+        :param args: Positional arguments for each message.
+        :param batch_size: Number of messages to publish at once.
+        :return: The enqueued messages.
+        """
+        with self.batch(batch_size, flush_interval=float("inf")) as batch:
+            for message_args in args:
+                batch.send(*message_args)
+        return batch.messages
+
+
+def memoized(
+    dedup_window: Optional[float] = None,
+    result_ttl: Optional[float] = None,
+    store: Optional[MemoStore] = None,
+) -> Callable[[LazyActor], LazyActor]:
+    """
+    Decorate a lazy actor to deduplicate the messages sent to it and memoize its results.
+
+        @memoized(dedup_window=60, result_ttl=300)
+        @dramatiq.actor(actor_class=LazyActor)
+        def recompute(account_id: str) -> None:
+            ...
+
+    :param dedup_window: Seconds during which sending a message with the same arguments as one
+        already sent is suppressed.
+    :param result_ttl: Seconds the results of the actor are cached for.
+    :param store: Store to keep sent messages and results in.
+    :return: Decorator configuring the actor.
+    """
+
+    def decorator(actor: LazyActor) -> LazyActor:
+        actor.memoize(dedup_window, result_ttl, store)
+        return actor
+
+    return decorator
+
+
+def registered_actors() -> List[LazyActor]:
+    """
+    Get every LazyActor that has been created.
+
+    :return: The registered actors.
+    """
+    return list(_registry.values())
+
+
+def init_all(
+    broker: Broker,
+    actors: Optional[Iterable[LazyActor]] = None,
+    declare_queues: bool = False,
+    concurrency: int = 1,
+) -> None:
+    """
+    Connect all registered actors with the broker being given to them.
+
+    Actors already connected to the broker are skipped. Queues are declared on the broker once
+    per queue rather than once per actor. By default a rabbitmq broker creates its queues lazily,
+    the first time a message is sent to them or a worker consumes them. With `declare_queues`,
+    they are created on the server now instead, so that a worker does not pay for it on its first
+    messages.
+
+    :param broker: The broker to connect to.
+    :param actors: Actors to connect, defaults to every registered actor.
+    :param declare_queues: Create the actors' queues on a rabbitmq server now.
+    :param concurrency: Number of queues to declare at the same time. Each thread declaring
+        queues opens its own connection to the server.
+    """
+    queue_names = set()
+    for actor in registered_actors() if actors is None else actors:
+        if getattr(actor, "broker", None) is not broker:
+            actor.init_actor(broker)
+        queue_names.add(actor.queue_name)
+
+    rabbitmq_broker = _rabbitmq_broker(broker)
+    if not declare_queues or rabbitmq_broker is None:
+        return
+
+    def declare(queue_name: str) -> None:
+        rabbitmq_broker.declare_queue(queue_name, ensure=True)
+
+    if concurrency <= 1:
+        for queue_name in sorted(queue_names):
+            declare(queue_name)
+        return
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(declare, sorted(queue_names)))
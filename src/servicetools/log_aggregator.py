@@ -0,0 +1,287 @@
+"""Aggregate the logs of several processes into one output."""
+import logging
+import os
+import selectors
+import socket
+import struct
+import sys
+import threading
+from types import TracebackType
+from typing import IO, Any, Dict, List, Optional, Type
+
+DEFAULT_SEND_TIMEOUT = 1.0
+DEFAULT_FLUSH_INTERVAL = 0.1
+RECEIVE_SIZE = 256 * 1024
+
+# Every record is sent as a frame: the pid of the sending process, the number of records that
+# process has dropped so far and the length of the formatted record, followed by the record.
+FRAME_HEADER = struct.Struct("!III")
+
+
+class AggregatorHandler(logging.Handler):
+    """
+    Send formatted records to a `LogAggregator` over a Unix socket.
+
+    Each record is sent whole, in a single length-prefixed frame, so the aggregator never splits
+    or interleaves lines from different processes. Records that cannot be sent within `timeout`
+    seconds, or while the aggregator is unavailable, are dropped and counted in `dropped`, which
+    is reported to the aggregator with the next record sent.
+
+    The connection is made on first use and again after a fork, so a handler created before
+    worker processes are forked is safe to use in each of them.
+    """
+
+    def __init__(self, path: str, timeout: float = DEFAULT_SEND_TIMEOUT) -> None:
+        """
+        Create a handler sending records to an aggregator.
+
+        :param path: Path of the Unix socket the aggregator listens on.
+        :param timeout: Seconds to wait for the aggregator to accept a record before dropping it.
+        """
+        super().__init__()
+        self.path = path
+        self.timeout = timeout
+        self.dropped = 0
+        self._socket: Optional[socket.socket] = None
+        self._pid: Optional[int] = None
+
+    def _connect(self) -> socket.socket:
+        """Get a connection to the aggregator for the current process."""
+        pid = os.getpid()
+        if self._pid != pid:
+            # Records dropped before a fork are reported by the parent, not by each child.
+            self._socket = None
+            self._pid = pid
+            self.dropped = 0
+        if self._socket is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                connection.settimeout(self.timeout)
+                connection.connect(self.path)
+            except OSError:
+                connection.close()
+                raise
+            self._socket = connection
+        return self._socket
+
+    def _disconnect(self) -> None:
+        """Close the connection to the aggregator, if this process opened it."""
+        if self._socket is not None and self._pid == os.getpid():
+            self._socket.close()
+        self._socket = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """
+        Send a record to the aggregator.
+
+        :param record: Record to send.
+        """
+        try:
+            payload = (self.format(record) + "\n").encode("utf-8", "replace")
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+            return
+
+        try:
+            connection = self._connect()
+            header = FRAME_HEADER.pack(os.getpid(), self.dropped, len(payload))
+            connection.sendall(header + payload)
+        except OSError:
+            # A partly sent frame is discarded by the aggregator when the connection closes.
+            self.dropped += 1
+            self._disconnect()
+
+    def close(self) -> None:
+        """Close the connection to the aggregator."""
+        self.acquire()
+        try:
+            self._disconnect()
+        finally:
+            self.release()
+        super().close()
+
+
+class _Connection:
+    """Frames being received from one process."""
+
+    __slots__ = ("socket", "buffer")
+
+    def __init__(self, connection: socket.socket) -> None:
+        self.socket = connection
+        self.buffer = bytearray()
+
+
+class LogAggregator:
+    """
+    Receive the logs of several processes over a Unix socket and write them to one stream.
+
+    Processes send their records with an `AggregatorHandler` (for example by calling
+    `default_logging` with `log_socket`). Every record is written whole, records from the same
+    process are written in the order they were logged, and the records received together are
+    written to the stream in a single write. The number of records received from and dropped
+    by each process is available from `metrics`.
+
+        with LogAggregator("/tmp/worker-logs.sock"):
+            run_worker_processes()
+    """
+
+    def __init__(
+        self,
+        path: str,
+        stream: Optional[IO[str]] = None,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ) -> None:
+        """
+        Create a log aggregator.
+
+        :param path: Path of the Unix socket to listen on. Any file at that path is replaced.
+        :param stream: Stream to write the logs to, defaults to `sys.stdout`.
+        :param flush_interval: Maximum seconds to wait for records before checking for a stop.
+        """
+        self.path = path
+        self.stream = stream or sys.stdout
+        self.flush_interval = flush_interval
+        self._records: Dict[int, int] = {}
+        self._dropped: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._listener: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Listen for processes and write their logs from a background thread."""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.path)
+        self._listener.listen()
+        self._listener.setblocking(False)
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._serve, name="servicetools-log-aggregator", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Write the logs already received, then stop listening."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def metrics(self) -> Dict[int, Dict[str, int]]:
+        """
+        Get the number of records received from and dropped by each process.
+
+        :return: Dictionary of pid to its `records` and `dropped` counts.
+        """
+        with self._lock:
+            return {
+                pid: {"records": records, "dropped": self._dropped.get(pid, 0)}
+                for pid, records in self._records.items()
+            }
+
+    def _serve(self) -> None:
+        """Receive and write records until the aggregator is stopped."""
+        assert self._listener is not None
+        selector = selectors.DefaultSelector()
+        selector.register(self._listener, selectors.EVENT_READ)
+        try:
+            while not self._stopping.is_set():
+                ready = selector.select(self.flush_interval)
+                self._write(self._receive(selector, [key.fileobj for key, _ in ready]))
+            # Write whatever is left before stopping.
+            self._accept(selector)
+            connections = [
+                key.fileobj for key in selector.get_map().values() if key.data is not None
+            ]
+            self._write(self._receive(selector, connections))
+        finally:
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()  # type: ignore
+            selector.close()
+
+    def _receive(self, selector: selectors.BaseSelector, ready: List[Any]) -> List[bytes]:
+        """Accept new processes and read the records available from the ready connections."""
+        records: List[bytes] = []
+        for fileobj in ready:
+            if fileobj is self._listener:
+                self._accept(selector)
+                continue
+            connection: _Connection = selector.get_key(fileobj).data
+            while True:
+                try:
+                    data = connection.socket.recv(RECEIVE_SIZE)
+                except BlockingIOError:
+                    break
+                except OSError:
+                    data = b""
+                if not data:
+                    selector.unregister(connection.socket)
+                    connection.socket.close()
+                    break
+                connection.buffer += data
+                self._read_frames(connection.buffer, records)
+        return records
+
+    def _accept(self, selector: selectors.BaseSelector) -> None:
+        """Accept connections from new processes."""
+        assert self._listener is not None
+        while True:
+            try:
+                accepted, _ = self._listener.accept()
+            except BlockingIOError:
+                return
+            accepted.setblocking(False)
+            selector.register(accepted, selectors.EVENT_READ, _Connection(accepted))
+
+    def _read_frames(self, buffer: bytearray, records: List[bytes]) -> None:
+        """Take the complete frames out of a connection's buffer."""
+        offset = 0
+        counts: Dict[int, int] = {}
+        dropped: Dict[int, int] = {}
+        while len(buffer) - offset >= FRAME_HEADER.size:
+            pid, process_dropped, length = FRAME_HEADER.unpack_from(buffer, offset)
+            end = offset + FRAME_HEADER.size + length
+            if end > len(buffer):
+                break
+            records.append(bytes(buffer[offset + FRAME_HEADER.size : end]))
+            counts[pid] = counts.get(pid, 0) + 1
+            dropped[pid] = process_dropped
+            offset = end
+        del buffer[:offset]
+
+        with self._lock:
+            for pid, count in counts.items():
+                self._records[pid] = self._records.get(pid, 0) + count
+                self._dropped[pid] = max(self._dropped.get(pid, 0), dropped[pid])
+
+    def _write(self, records: List[bytes]) -> None:
+        """Write records to the stream in one write."""
+        if not records:
+            return
+        try:
+            self.stream.write(b"".join(records).decode("utf-8", "replace"))
+            self.stream.flush()
+        except (OSError, ValueError):
+            # The stream is broken or closed, there is nowhere left to write to.
+            pass
+
+    def __enter__(self) -> "LogAggregator":
+        """Start the aggregator."""
+        self.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        trace: Optional[TracebackType],
+    ) -> None:
+        """Stop the aggregator."""
+        self.stop()
@@ -0,0 +1,291 @@
+"""Logging handlers for services."""
+from collections import deque
+from enum import Enum, auto
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import threading
+from time import monotonic
+from typing import IO, Deque, Dict, Iterable, List, Optional
+
+DEFAULT_LOG_QUEUE_SIZE = 10000
+DEFAULT_BUFFER_SIZE = 64 * 1024
+DEFAULT_MAX_BUFFER_SIZE = 16 * 1024 * 1024
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+
+class OverflowPolicy(Enum):
+    """What to do with a new log record when the log queue is full."""
+
+    BLOCK = auto()
+    DROP_NEWEST = auto()
+    DROP_OLDEST = auto()
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Queue handler that writes to a bounded queue.
+
+    When the queue is full, records are handled according to the overflow policy. Every record
+    that is dropped is counted.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = DEFAULT_LOG_QUEUE_SIZE,
+        overflow_policy: OverflowPolicy = OverflowPolicy.BLOCK,
+    ) -> None:
+        """
+        Create a bounded queue handler.
+
+        :param maxsize: Maximum number of records to hold in the queue.
+        :param overflow_policy: What to do with records when the queue is full.
+        """
+        self.bounded_queue: queue.Queue = queue.Queue(maxsize)
+        super().__init__(self.bounded_queue)
+        self.overflow_policy = overflow_policy
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Prepare a record for queuing.
+
+        The queue never leaves the process, so the record is queued as is and all formatting
+        is left to the handlers on the listener thread.
+
+        :param record: Record to prepare.
+        :return: The record to queue.
+        """
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """
+        Add a record to the queue, applying the overflow policy if it is full.
+
+        :param record: Record to add.
+        """
+        if self.overflow_policy == OverflowPolicy.BLOCK:
+            self.bounded_queue.put(record)
+            return
+
+        try:
+            self.bounded_queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+
+        if self.overflow_policy == OverflowPolicy.DROP_OLDEST:
+            try:
+                self.bounded_queue.get_nowait()
+                self.bounded_queue.put_nowait(record)
+            except (queue.Empty, queue.Full):
+                pass
+        with self._dropped_lock:
+            self.dropped += 1
+
+    def metrics(self) -> Dict[str, int]:
+        """
+        Get metrics about the queue.
+
+        :return: Dictionary of the current queue size, its capacity and records dropped.
+        """
+        return {
+            "queued": self.bounded_queue.qsize(),
+            "capacity": self.bounded_queue.maxsize,
+            "dropped": self.dropped,
+        }
+
+
+class LogQueue:
+    """
+    Route the records of a set of loggers through a bounded queue.
+
+    The handlers of the loggers are moved behind a `QueueListener` so that they are run on a
+    dedicated thread instead of the thread doing the logging.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = DEFAULT_LOG_QUEUE_SIZE,
+        overflow_policy: OverflowPolicy = OverflowPolicy.BLOCK,
+    ) -> None:
+        """
+        Create a log queue.
+
+        :param maxsize: Maximum number of records to hold in the queue.
+        :param overflow_policy: What to do with records when the queue is full.
+        """
+        self.handler = BoundedQueueHandler(maxsize, overflow_policy)
+        self._listener: Optional[QueueListener] = None
+        self._original_handlers: Dict[logging.Logger, List[logging.Handler]] = {}
+
+    def start(self, loggers: Iterable[logging.Logger]) -> None:
+        """
+        Move the handlers of the given loggers behind the queue and start processing records.
+
+        :param loggers: Loggers to route through the queue.
+        """
+        handlers: List[logging.Handler] = []
+        for logger in loggers:
+            self._original_handlers[logger] = logger.handlers
+            for handler in logger.handlers:
+                if handler not in handlers:
+                    handlers.append(handler)
+            logger.handlers = [self.handler]
+
+        self._listener = QueueListener(self.handler.queue, *handlers, respect_handler_level=True)
+        self._listener.start()
+
+    def stop(self) -> None:
+        """Restore the original handlers and flush any queued records to them."""
+        for logger, handlers in self._original_handlers.items():
+            logger.handlers = handlers
+        self._original_handlers = {}
+
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+
+    def metrics(self) -> Dict[str, int]:
+        """
+        Get metrics about the queue.
+
+        :return: Dictionary of the current queue size, its capacity and records dropped.
+        """
+        return self.handler.metrics()
+
+
+class BufferedStreamHandler(logging.StreamHandler):
+    """
+    Stream handler that coalesces records into larger writes.
+
+    Formatted records are buffered and written together once `buffer_size` characters are
+    buffered, `flush_interval` seconds after the oldest buffered record, or as soon as a record
+    at `flush_level` or above is logged. Everything buffered is written when the handler is
+    flushed or closed, which `logging` does at exit.
+
+    By default records are written by the thread that logged the one that filled the buffer,
+    and the flush interval is only checked when a record is logged. In background mode, records
+    are written by a dedicated thread instead, so logging never blocks on the stream. The
+    buffer is then bounded by `max_buffer_size`, and records logged while it is full are
+    dropped and counted in `dropped`.
+    """
+
+    def __init__(
+        self,
+        stream: Optional[IO[str]] = None,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        flush_level: int = logging.ERROR,
+        background: bool = False,
+        max_buffer_size: int = DEFAULT_MAX_BUFFER_SIZE,
+    ) -> None:
+        """
+        Create a buffered stream handler.
+
+        :param stream: Stream to write to, defaults to `sys.stderr`.
+        :param buffer_size: Number of characters to buffer before writing.
+        :param flush_interval: Maximum seconds a record is buffered for.
+        :param flush_level: Records at this level or above are written immediately.
+        :param background: Write records from a dedicated thread.
+        :param max_buffer_size: Maximum number of characters to buffer in background mode.
+        """
+        super().__init__(stream)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.flush_level = flush_level
+        self.background = background
+        self.max_buffer_size = max_buffer_size
+        self.dropped = 0
+        self._buffer: List[str] = []
+        self._buffered = 0
+        self._flush_deadline: Optional[float] = None
+        self._pending: Deque[str] = deque()
+        self._buffer_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closing = False
+        self._writer: Optional[threading.Thread] = None
+        if background:
+            self._writer = threading.Thread(
+                target=self._write_in_background, name="servicetools-log-writer", daemon=True
+            )
+            self._writer.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """
+        Buffer a record, writing the buffer if it is due.
+
+        :param record: Record to write.
+        """
+        try:
+            message = self.format(record) + self.terminator
+            with self._buffer_lock:
+                if self.background and self._buffered >= self.max_buffer_size:
+                    self.dropped += 1
+                    return
+
+                self._buffer.append(message)
+                self._buffered += len(message)
+                now = monotonic()
+                if self._flush_deadline is None:
+                    self._flush_deadline = now + self.flush_interval
+                due = (
+                    self._buffered >= self.buffer_size
+                    or record.levelno >= self.flush_level
+                    or now >= self._flush_deadline
+                )
+            if due and self.background:
+                self._wake.set()
+            elif due:
+                self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def flush(self) -> None:
+        """Write everything that is buffered and flush the stream."""
+        # The buffer has its own lock rather than the handler lock, which `logging` holds while
+        # closing the handler and so while waiting for the writer thread to stop.
+        with self._buffer_lock:
+            self._pending.append(self._take_buffer())
+        with self._write_lock:
+            while self._pending:
+                self._write(self._pending.popleft())
+
+    def close(self) -> None:
+        """Write everything that is buffered and stop the writer thread."""
+        if self._writer is not None:
+            self._closing = True
+            self._wake.set()
+            self._writer.join()
+            self._writer = None
+        self.flush()
+        super().close()
+
+    def _take_buffer(self) -> str:
+        """Empty the buffer, returning its contents. Must be called with the buffer lock."""
+        text = "".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        self._flush_deadline = None
+        return text
+
+    def _write(self, text: str) -> None:
+        """Write to the stream and flush it."""
+        if text:
+            self.stream.write(text)
+        self.stream.flush()
+
+    def _write_in_background(self) -> None:
+        """Write the buffer whenever it is due, until the handler is closed."""
+        while not self._closing:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except (OSError, ValueError):
+                # The stream is broken or closed, there is nowhere left to write to.
+                pass
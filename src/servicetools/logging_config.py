@@ -1,19 +1,34 @@
 """Default logging configuration for structlog."""
 
+import atexit
 from enum import IntEnum, Enum, auto
+from functools import lru_cache
 import logging
 import logging.config
 import sys
 import threading
 from types import TracebackType
-from typing import Any, Dict, Iterable, Optional, Type
+from typing import Any, Dict, Iterable, Optional, Tuple, Type
 from _thread import _ExceptHookArgs as ExceptHookArgs
 
 import structlog
+from structlog.types import Processor
+
+from servicetools.filtering import LevelFilteringBoundLogger, reset_level_cache
+from servicetools.log_aggregator import AggregatorHandler
+from servicetools.log_handlers import (
+    DEFAULT_LOG_QUEUE_SIZE,
+    BufferedStreamHandler,
+    LogQueue,
+    OverflowPolicy,
+)
+from servicetools.processors import format_stages
 
 TEXT_LOG_FORMAT = "[%(levelname)s %(filename)s:%(funcName)s:%(lineno)s] %(message)s"
 VERBOSE_LEVELS = [logging.WARNING, logging.INFO, logging.DEBUG]
 
+_log_queue: Optional[LogQueue] = None
+
 
 class LogFormat(Enum):
     """Format to write logs in."""
@@ -57,6 +72,63 @@ def _log_uncaught_exceptions(
         "Uncaught exception",
         exc_info=(exception_class, exception, trace),
     )
+    _flush_log_handlers()
+
+
+def _flush_log_handlers() -> None:
+    """Write out any logs buffered by the handlers of the root logger."""
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+
+
+def _stop_log_queue() -> None:
+    """Stop the log queue if one is running, flushing any queued records."""
+    global _log_queue
+    if _log_queue:
+        _log_queue.stop()
+        _log_queue = None
+
+
+def log_queue_metrics() -> Dict[str, int]:
+    """
+    Get metrics about the log queue.
+
+    :return: Dictionary of the current queue size, its capacity and records dropped. Empty if
+        logging is not queued.
+    """
+    if _log_queue:
+        return _log_queue.metrics()
+    return {}
+
+
+@lru_cache(maxsize=None)
+def processor_chain(log_format: LogFormat) -> Tuple[Processor, ...]:
+    """
+    Get the structlog processors used for the given log format.
+
+    The chain is built once per format. Events below the log level are dropped before any other
+    processing, and formatting stages that have nothing to do for an event are skipped.
+
+    :param log_format: Format logs are written in.
+    :return: Processors to configure structlog with.
+    """
+    if log_format == LogFormat.JSON:
+        return (
+            structlog.stdlib.filter_by_level,
+            structlog.contextvars.merge_contextvars,
+            structlog.stdlib.add_logger_name,
+            structlog.stdlib.add_log_level,
+            format_stages(),
+            structlog.processors.UnicodeDecoder(),
+            structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
+        )
+    return (
+        structlog.stdlib.filter_by_level,
+        structlog.contextvars.merge_contextvars,
+        format_stages(),
+        structlog.processors.UnicodeDecoder(),
+        structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
+    )
 
 
 def default_logging(
@@ -64,68 +136,91 @@ def default_logging(
     log_format: LogFormat = LogFormat.TEXT,
     external_logs: Optional[Iterable[str]] = None,
     loggers_to_configure: Optional[Iterable[str]] = None,
+    queue_logs: bool = False,
+    log_queue_size: int = DEFAULT_LOG_QUEUE_SIZE,
+    overflow_policy: OverflowPolicy = OverflowPolicy.BLOCK,
+    buffer_output: bool = False,
+    background_output: bool = False,
+    log_socket: Optional[str] = None,
+    cache_levels: bool = False,
 ) -> None:
     """
     Configure structlog based on the given parameters.
 
-    Logging will be done to stdout.
+    Logging will be done to stdout. Values bound with `structlog.contextvars.bind_contextvars`,
+    such as the request context bound by `StructlogRequestMiddleware`, are included in every log.
 
     :param verbosity: Amount of verbosity to use.
     :param log_format: Format to logs should be written in.
     :param external_logs: External modules that should have logging turned down unless verbosity is
         set to highest level.
     :param loggers_to_configure: Names of loggers to configure with the same configuration.
+    :param queue_logs: Write logs from a background thread fed by a bounded queue instead of
+        from the thread doing the logging.
+    :param log_queue_size: Maximum number of records to hold in the log queue.
+    :param overflow_policy: What to do with records when the log queue is full.
+    :param buffer_output: Coalesce logs into larger writes with a `BufferedStreamHandler`.
+        Errors are still written immediately.
+    :param background_output: Buffer logs and write them from a dedicated thread, so logging
+        never blocks on a slow stream.
+    :param log_socket: Send logs to the `LogAggregator` listening on this Unix socket instead of
+        writing them to stdout, so the logs of several processes are written by one.
+    :param cache_levels: Use a `LevelFilteringBoundLogger`, whose methods for levels that are not
+        enabled do nothing, instead of checking the level of every event.
     """
+    global _log_queue
+    _stop_log_queue()
+    loggers_to_configure = list(loggers_to_configure or [])
     level = Verbosity(verbosity).level()
 
+    buffer_output = buffer_output or background_output
+    wrapper_class = LevelFilteringBoundLogger if cache_levels else structlog.stdlib.BoundLogger
+
     if log_format == LogFormat.TEXT:
-        logging.basicConfig(level=level, stream=sys.stdout, format=TEXT_LOG_FORMAT)
+        handler: Optional[logging.Handler] = None
+        if log_socket is not None:
+            handler = AggregatorHandler(log_socket)
+        elif buffer_output:
+            handler = BufferedStreamHandler(sys.stdout, background=background_output)
+
+        if handler is None:
+            logging.basicConfig(level=level, stream=sys.stdout, format=TEXT_LOG_FORMAT)
+        else:
+            logging.basicConfig(level=level, handlers=[handler], format=TEXT_LOG_FORMAT)
+            if handler not in logging.getLogger().handlers:
+                # basicConfig does nothing once the root logger has handlers.
+                handler.close()
         structlog.configure(
             logger_factory=structlog.stdlib.LoggerFactory(),
-            wrapper_class=structlog.stdlib.BoundLogger,
+            wrapper_class=wrapper_class,
             cache_logger_on_first_use=True,
-            processors=[
-                structlog.stdlib.filter_by_level,
-                structlog.stdlib.PositionalArgumentsFormatter(),
-                structlog.processors.StackInfoRenderer(),
-                structlog.processors.format_exc_info,
-                structlog.processors.UnicodeDecoder(),
-                structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
-            ],
+            processors=list(processor_chain(log_format)),
         )
     elif log_format == LogFormat.JSON:
         # Setup json logging.
         logger_config = {"handlers": ["json"], "level": level}
+        json_handler: Dict[str, Any] = {"class": "logging.StreamHandler", "formatter": "json"}
+        if log_socket is not None:
+            json_handler["class"] = "servicetools.log_aggregator.AggregatorHandler"
+            json_handler["path"] = log_socket
+        elif buffer_output:
+            json_handler["class"] = "servicetools.log_handlers.BufferedStreamHandler"
+            json_handler["background"] = background_output
         loggers = build_loggers_dictionary(loggers_to_configure, logger_config)
         logging.config.dictConfig(
             {
                 "version": 1,
-                "formatters": {
-                    "json": {
-                        "format": "%(message)s $(lineno)d $(filename)s",
-                        "class": "pythonjsonlogger.jsonlogger.JsonFormatter",
-                    }
-                },
-                "handlers": {"json": {"class": "logging.StreamHandler", "formatter": "json"}},
+                "formatters": {"json": {"()": "servicetools.formatters.JsonFormatter"}},
+                "handlers": {"json": json_handler},
                 "loggers": loggers,
             }
         )
 
         structlog.configure(
-            context_class=structlog.threadlocal.wrap_dict(dict),
             logger_factory=structlog.stdlib.LoggerFactory(),
-            wrapper_class=structlog.stdlib.BoundLogger,
+            wrapper_class=wrapper_class,
             cache_logger_on_first_use=True,
-            processors=[
-                structlog.stdlib.filter_by_level,
-                structlog.stdlib.add_logger_name,
-                structlog.stdlib.add_log_level,
-                structlog.stdlib.PositionalArgumentsFormatter(),
-                structlog.processors.StackInfoRenderer(),
-                structlog.processors.format_exc_info,
-                structlog.processors.UnicodeDecoder(),
-                structlog.stdlib.render_to_log_kwargs,
-            ],
+            processors=list(processor_chain(log_format)),
         )
 
     # Unless the user specifies higher verbosity than we have levels, turn down the log level
@@ -135,6 +230,14 @@ def default_logging(
         for logger in external_logs:
             logging.getLogger(logger).setLevel(logging.WARNING)
 
+    # Levels may have changed, so loggers that cached them must look them up again.
+    reset_level_cache()
+
+    if queue_logs:
+        queued_loggers = [""] if log_format == LogFormat.TEXT else ["", *loggers_to_configure]
+        _log_queue = LogQueue(log_queue_size, overflow_policy)
+        _log_queue.start(logging.getLogger(name) for name in queued_loggers)
+
     # Log exceptions
     sys.excepthook = _log_uncaught_exceptions
     threading.excepthook = _log_uncaught_thread_exceptions
@@ -156,3 +259,6 @@ def build_loggers_dictionary(
     if loggers:
         logger_dict.update({logger: logger_config for logger in loggers})
     return logger_dict
+
+
+atexit.register(_stop_log_queue)
@@ -0,0 +1,186 @@
+"""Stores for deduplicating and memoizing work."""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+from time import monotonic
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+DEFAULT_MAX_SIZE = 10000
+
+
+def call_key(name: str, args: Sequence[Any], kwargs: Dict[str, Any]) -> str:
+    """
+    Build a key identifying a call by its name and arguments.
+
+    The arguments are canonicalized as JSON with sorted keys, so equal arguments give the same
+    key whatever the order keyword arguments were passed in, and tuples and lists are equal.
+    Values JSON cannot represent are converted with `str`.
+
+    :param name: Name of the function or actor called.
+    :param args: Positional arguments of the call.
+    :param kwargs: Keyword arguments of the call.
+    :return: Key for the call.
+    """
+    arguments = json.dumps([list(args), kwargs], sort_keys=True, separators=(",", ":"), default=str)
+    return f"{name}:{hashlib.sha256(arguments.encode()).hexdigest()}"
+
+
+class MemoStore(ABC):
+    """
+    Interface of the stores used to deduplicate messages and memoize results.
+
+    A store maps keys to values that expire after a number of seconds. Implementations backed by
+    a shared service (such as redis) deduplicate across processes, and must make `add` atomic.
+    """
+
+    @abstractmethod
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Get the value stored for a key.
+
+        :param key: Key to look up.
+        :param default: Value to return if the key is not stored or has expired.
+        :return: The stored value, or the default.
+        """
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Store a value for a key, replacing any value already stored.
+
+        :param key: Key to store the value for.
+        :param value: Value to store.
+        :param ttl: Seconds until the value expires, or None to keep it until it is evicted.
+        """
+
+    @abstractmethod
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """
+        Store a value for a key, only if no value is stored for it.
+
+        :param key: Key to store the value for.
+        :param value: Value to store.
+        :param ttl: Seconds until the value expires, or None to keep it until it is evicted.
+        :return: True if the value was stored.
+        """
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """
+        Remove the value stored for a key, if any.
+
+        :param key: Key to remove.
+        """
+
+
+class MemoryStore(MemoStore):
+    """
+    In-process store with LRU and TTL eviction.
+
+    At most `max_size` values are kept: storing a value beyond that evicts the least recently
+    used one. Expired values are evicted when they are next looked up.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        """
+        Create an in-memory store.
+
+        :param max_size: Maximum number of values to keep.
+        """
+        self.max_size = max_size
+        self._values: "OrderedDict[str, Tuple[Optional[float], Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key: str) -> Optional[Tuple[Optional[float], Any]]:
+        """Get the entry for a key if it has not expired. Must be called with the lock."""
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        expires_at, _ = entry
+        if expires_at is not None and monotonic() >= expires_at:
+            del self._values[key]
+            return None
+        self._values.move_to_end(key)
+        return entry
+
+    def _store(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        """Store a value, evicting the least recently used ones. Must be called with the lock."""
+        self._values[key] = (monotonic() + ttl if ttl is not None else None, value)
+        self._values.move_to_end(key)
+        while len(self._values) > self.max_size:
+            self._values.popitem(last=False)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Get the value stored for a key.
+
+        :param key: Key to look up.
+        :param default: Value to return if the key is not stored or has expired.
+        :return: The stored value, or the default.
+        """
+        with self._lock:
+            entry = self._lookup(key)
+        return default if entry is None else entry[1]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Store a value for a key, replacing any value already stored.
+
+        :param key: Key to store the value for.
+        :param value: Value to store.
+        :param ttl: Seconds until the value expires, or None to keep it until it is evicted.
+        """
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """
+        Store a value for a key, only if no value is stored for it.
+
+        :param key: Key to store the value for.
+        :param value: Value to store.
+        :param ttl: Seconds until the value expires, or None to keep it until it is evicted.
+        :return: True if the value was stored.
+        """
+        with self._lock:
+            if self._lookup(key) is not None:
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def delete(self, key: str) -> None:
+        """
+        Remove the value stored for a key, if any.
+
+        :param key: Key to remove.
+        """
+        with self._lock:
+            self._values.pop(key, None)
+
+    def __len__(self) -> int:
+        """Get the number of values stored, including expired values not yet evicted."""
+        return len(self._values)
+
+
+_default_store: MemoStore = MemoryStore()
+
+
+def default_store() -> MemoStore:
+    """
+    Get the store used by actors that are not given one.
+
+    :return: The default store.
+    """
+    return _default_store
+
+
+def set_default_store(store: MemoStore) -> None:
+    """
+    Set the store used by actors that are not given one.
+
+    :param store: Store to use by default, for example one shared between processes.
+    """
+    global _default_store
+    _default_store = store
@@ -0,0 +1,188 @@
+"""In-memory request metrics exposed in the Prometheus text format."""
+import threading
+from typing import TYPE_CHECKING, Dict, Iterable, List, Tuple
+
+from servicetools.histogram import DEFAULT_PERCENTILES, LatencyHistogram
+
+if TYPE_CHECKING:
+    from starlette.types import Receive, Scope, Send
+
+PROMETHEUS_CONTENT_TYPE = b"text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    """Escape a label value for the Prometheus text format."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Labels) -> str:
+    """
+    Format labels for the Prometheus text format.
+
+    :param labels: Label names and values.
+    :return: Formatted labels, for example `{method="GET",route="/"}`.
+    """
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def prometheus_counter(name: str, help_text: str, values: Dict[Labels, float]) -> List[str]:
+    """
+    Render a counter in the Prometheus text format.
+
+    :param name: Name of the metric.
+    :param help_text: Description of the metric.
+    :param values: Value of the counter for each set of labels.
+    :return: Lines of the rendered metric.
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+    lines.extend(f"{name}{format_labels(labels)} {value}" for labels, value in values.items())
+    return lines
+
+
+def prometheus_gauge(name: str, help_text: str, values: Dict[Labels, float]) -> List[str]:
+    """
+    Render a gauge in the Prometheus text format.
+
+    :param name: Name of the metric.
+    :param help_text: Description of the metric.
+    :param values: Current value of the gauge for each set of labels.
+    :return: Lines of the rendered metric.
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    lines.extend(f"{name}{format_labels(labels)} {value}" for labels, value in values.items())
+    return lines
+
+
+def prometheus_summary(
+    name: str,
+    help_text: str,
+    histograms: Dict[Labels, LatencyHistogram],
+    percentiles: Iterable[float] = DEFAULT_PERCENTILES,
+) -> List[str]:
+    """
+    Render latency histograms as a summary in the Prometheus text format.
+
+    :param name: Name of the metric.
+    :param help_text: Description of the metric.
+    :param histograms: Histogram for each set of labels.
+    :param percentiles: Percentiles to include as quantiles.
+    :return: Lines of the rendered metric.
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} summary"]
+    for labels, histogram in histograms.items():
+        for percentile, value in histogram.percentiles(percentiles).items():
+            quantile_labels = labels + (("quantile", f"{percentile / 100:g}"),)
+            lines.append(f"{name}{format_labels(quantile_labels)} {value}")
+        lines.append(f"{name}_sum{format_labels(labels)} {histogram.total}")
+        lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+    return lines
+
+
+async def send_prometheus_text(text: str, send: "Send") -> None:
+    """
+    Send rendered metrics as an ASGI response.
+
+    :param text: Rendered metrics.
+    :param send: ASGI send channel.
+    """
+    body = text.encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", PROMETHEUS_CONTENT_TYPE),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+class RequestMetrics:
+    """
+    Aggregate HTTP request metrics in memory.
+
+    Requests are counted by method, route template and status code, and their durations are
+    recorded in a latency histogram per method and route template. The bytes sent in response
+    bodies are counted per method and route template. Using the route template
+    (`/users/{user_id}`) rather than the path keeps the number of series bounded.
+
+    Instances are ASGI applications that serve the metrics in the Prometheus text format, so
+    they can be mounted as a scrape endpoint:
+
+        metrics = RequestMetrics()
+        app.add_middleware(StructlogRequestMiddleware, metrics=metrics)
+        app.mount("/metrics", metrics)
+    """
+
+    def __init__(self, prefix: str = "http", percentiles: Iterable[float] = DEFAULT_PERCENTILES):
+        """
+        Create request metrics.
+
+        :param prefix: Prefix for the names of the metrics.
+        :param percentiles: Percentiles to report for request durations.
+        """
+        self.prefix = prefix
+        self.percentiles = tuple(percentiles)
+        self._lock = threading.Lock()
+        self._requests: Dict[Labels, float] = {}
+        self._durations: Dict[Labels, LatencyHistogram] = {}
+        self._response_bytes: Dict[Labels, float] = {}
+
+    def observe(
+        self, method: str, route: str, status_code: int, seconds: float, response_bytes: int = 0
+    ) -> None:
+        """
+        Record a completed request.
+
+        :param method: HTTP method of the request.
+        :param route: Route template the request matched.
+        :param status_code: Status code of the response.
+        :param seconds: Duration of the request.
+        :param response_bytes: Number of bytes sent in the response body.
+        """
+        route_labels = (("method", method), ("route", route))
+        request_labels = route_labels + (("status_code", str(status_code)),)
+        with self._lock:
+            self._requests[request_labels] = self._requests.get(request_labels, 0) + 1
+            self._response_bytes[route_labels] = (
+                self._response_bytes.get(route_labels, 0) + response_bytes
+            )
+            histogram = self._durations.get(route_labels)
+            if histogram is None:
+                histogram = self._durations[route_labels] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def render(self) -> str:
+        """
+        Render the metrics in the Prometheus text format.
+
+        :return: Rendered metrics.
+        """
+        with self._lock:
+            requests = dict(self._requests)
+            durations = dict(self._durations)
+            response_bytes = dict(self._response_bytes)
+        lines = prometheus_counter(
+            f"{self.prefix}_requests_total", "Total number of HTTP requests.", requests
+        ) + prometheus_summary(
+            f"{self.prefix}_request_duration_seconds",
+            "Duration of HTTP requests in seconds.",
+            durations,
+            self.percentiles,
+        )
+        lines += prometheus_counter(
+            f"{self.prefix}_response_bytes_total",
+            "Total number of bytes sent in HTTP response bodies.",
+            response_bytes,
+        )
+        return "\n".join(lines) + "\n"
+
+    async def __call__(self, scope: "Scope", receive: "Receive", send: "Send") -> None:
+        """Serve the metrics in the Prometheus text format."""
+        await send_prometheus_text(self.render(), send)
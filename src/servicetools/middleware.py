@@ -1,118 +1,471 @@
 """Starlette middleware for services."""
 import logging
+import random
 from time import perf_counter
-from typing import Any, Callable, Awaitable, Set, Optional
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from uuid import uuid4
 
 from structlog import get_logger
-from starlette.middleware.base import BaseHTTPMiddleware, DispatchFunction
+from structlog.contextvars import bind_contextvars, reset_contextvars
 from starlette import status
-from starlette.requests import Request
-from starlette.responses import Response
-from starlette.types import ASGIApp, Message
+from starlette.routing import Match, Mount
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from servicetools.admission import AdmissionControl
+from servicetools.deferred import Deferred
+from servicetools.metrics import RequestMetrics
+from servicetools.profiling import ProfileWatch, SlowCallProfiler
+from servicetools.ratelimit import TokenBucket
 
 LOGGER = get_logger(__name__)
+DEFAULT_MAX_LOGGED_REQUEST_SIZE = 64 * 1024
+UNMATCHED_ROUTE = "<unmatched>"
+REQUEST_ID_HEADER = "x-request-id"
+SHED_RESPONSE_BODY = b"Service Unavailable"
+
+
+def _match_route(scope: Scope, routes: Iterable[Any]) -> Tuple[Any, Scope]:
+    """Find the route the router would pick, with its child scope, or None if none matches."""
+    partial: Tuple[Any, Scope] = (None, {})
+    for candidate in routes:
+        match, child_scope = candidate.matches(scope)
+        if match == Match.FULL:
+            return candidate, child_scope
+        if match == Match.PARTIAL and partial[0] is None:
+            partial = (candidate, child_scope)
+    return partial
+
+
+def route_template(scope: Scope) -> str:
+    """
+    Get the template of the route that handled a request, for example `/users/{user_id}`.
+
+    Starlette records the matched route in the scope once it has routed the request. Before that,
+    or for versions that do not record it, the routes of the application are matched against the
+    scope the way the router matches them: through `Mount` and `Host` routes down to the route
+    that handles the request, and falling back to a route only matching the path when no route
+    matches the method.
+
+    :param scope: ASGI scope of the request.
+    :return: Path template of the matched route, or `<unmatched>` if no route matched.
+    """
+    route = scope.get("route")
+    if route is None:
+        routes = getattr(scope.get("app"), "routes", None)
+        while routes:
+            candidate, child_scope = _match_route(scope, routes)
+            if candidate is None:
+                break
+            route = candidate
+            scope = {**scope, **child_scope}
+            routes = getattr(candidate, "routes", None)
+    path = getattr(route, "path", None)
+    if path is None:
+        return UNMATCHED_ROUTE
+
+    # Routes in mounted applications are relative to the mount point, which is recorded in the
+    # root path.
+    mount_path = ""
+    if "app_root_path" in scope:
+        mount_path = scope.get("root_path", "")[len(scope["app_root_path"]) :]
+        if isinstance(route, Mount):
+            # Matching stopped at a mounted application without routes of its own, whose path
+            # already ends the root path.
+            return mount_path
+    return mount_path + path
+
+
+def request_id(scope: Scope, header: str = REQUEST_ID_HEADER) -> str:
+    """
+    Get the ID of a request from its headers, or generate a new one.
+
+    :param scope: ASGI scope of the request.
+    :param header: Name of the header holding the request ID, in lower case.
+    :return: ID of the request.
+    """
+    header_name = header.encode("latin-1")
+    for name, value in scope.get("headers", []):
+        if name == header_name:
+            return value.decode("latin-1")
+    return uuid4().hex
+
+
+def _resolve_route(scope: Scope, route: Optional[str]) -> str:
+    """Get the route template looked up before the request was routed, or look it up now."""
+    return route if route is not None else route_template(scope)
+
+
+def _elapsed(start_time: float, end_time: Optional[float]) -> Optional[float]:
+    """Get the seconds between two times, or None if the end was never reached."""
+    return end_time - start_time if end_time is not None else None
+
+
+class _RequestBodyTee:
+    """
+    Record a size-capped copy of the request body as the application reads it.
+
+    Applications can respond without reading the body, so whether it was read to the end is
+    recorded in `complete`.
+    """
+
+    def __init__(self, receive: Receive, limit: int) -> None:
+        """
+        Create a tee over the given receive channel.
+
+        :param receive: ASGI receive channel to read from.
+        :param limit: Maximum number of body bytes to keep.
+        """
+        self.receive = receive
+        self.limit = limit
+        self.size = 0
+        self.truncated = False
+        self.complete = False
+        self.chunks: List[bytes] = []
+
+    async def __call__(self) -> Message:
+        """Receive the next message, keeping a copy of its body until the limit is reached."""
+        message = await self.receive()
+        if message["type"] == "http.request" and not message.get("more_body", False):
+            self.complete = True
+        if message["type"] == "http.request" and not self.truncated:
+            chunk = message.get("body", b"")
+            remaining = self.limit - self.size
+            if len(chunk) > remaining:
+                chunk = chunk[:remaining]
+                self.truncated = True
+            if chunk:
+                self.chunks.append(chunk)
+                self.size += len(chunk)
+        return message
+
+    def body(self) -> bytes:
+        """Get the recorded body."""
+        return b"".join(self.chunks)
 
 
-class StructlogRequestMiddleware(BaseHTTPMiddleware):
+class StructlogRequestMiddleware:
     """
     Logs information to a structlog logger about each HTTP request.
 
     Logging will occur at the start and completion of each request.
 
-    If a request throws an exception, it will be logged and converted to a 500
-    response.
+    If a request throws an exception, it will be logged and re-raised so that
+    the server error middleware can convert it to a 500 response.
 
     Any failures responses (400s and 500s) will be logged. A set of failure
     codes to ignore can be provided to not log certain error codes (for example,
     ignore all 404 errors).
+
+    For busy services, only a sample of requests can be logged. Failed requests and requests
+    slower than a threshold are always logged, but error logs can be rate limited so that an
+    incident does not flood the logs. Counts of suppressed logs are kept in `suppressed_logs`.
+    Requests slower than `profile_threshold` can also be profiled, to find what they spent their
+    time on.
+
+    The response is observed as it is sent, without buffering it: the end of request log includes
+    the number of response body bytes, the time until the response started and the time until
+    its last byte was sent. For streaming responses, the last byte can be sent long after the
+    response started.
+
+    With `admission`, the requests in flight are tracked, and new requests are shed with a 503
+    response, before the application is called, while the service is overloaded. Shed requests
+    are logged (subject to the error log rate limit) with the reason they were shed.
+
+    The request ID (from the `x-request-id` header, or generated) and method are bound to the
+    structlog context variables while the request is handled, so every log written during the
+    request includes them. The route template is read from the route Starlette records while
+    routing, once the application returns, for the metrics and the end of request log. Only
+    `endpoint_sample_rates`, the route limits of `admission` and `bind_route` need the template
+    before the application is called; it is then looked up once, by matching the path against
+    the application's routes like the router does, and shared with the rest of the middleware.
+
+    This is a pure ASGI middleware: it wraps `receive` and `send` directly rather
+    than running the application in a separate task, so streaming responses are
+    passed through untouched.
     """
 
     def __init__(
         self,
         app: ASGIApp,
-        dispatch: Optional[DispatchFunction] = None,
         logger: Any = LOGGER,
         log_level: int = logging.INFO,
         ignored_status_codes: Optional[Set[int]] = None,
         include_request_in_failed_requests: Optional[bool] = False,
+        max_logged_request_size: int = DEFAULT_MAX_LOGGED_REQUEST_SIZE,
+        metrics: Optional[RequestMetrics] = None,
+        sample_rate: float = 1.0,
+        endpoint_sample_rates: Optional[Dict[str, float]] = None,
+        slow_request_threshold: Optional[float] = None,
+        error_log_rate: Optional[float] = None,
+        error_log_burst: int = 10,
+        bind_context: bool = True,
+        bind_route: bool = False,
+        request_id_header: str = REQUEST_ID_HEADER,
+        profile_threshold: Optional[float] = None,
+        admission: Optional[AdmissionControl] = None,
     ) -> None:
         """
         Create structlog request middleware.
 
         :param app: Web application.
-        :param dispatch: Dispatch function.
         :param logger: Structlog logger to log to.
         :param log_level: Log level to write at.
         :param ignored_status_codes: Set of status codes to not report on.
-        :param include_request_in_failed_requests: Whether to ignore the request in failed calls.
+        :param include_request_in_failed_requests: Whether to include the request in failed calls.
+            Only the part of the body the application read is known; when it did not read it to
+            the end, `request_unread` is logged.
+        :param max_logged_request_size: Maximum number of request body bytes to keep for logging
+            failed calls. Larger bodies are truncated.
+        :param metrics: Request metrics to record the duration and status of requests in.
+        :param sample_rate: Fraction of successful requests to log.
+        :param endpoint_sample_rates: Fraction of successful requests to log for specific
+            endpoints, keyed by route template (for example `/users/{user_id}`) or path.
+        :param slow_request_threshold: Always log requests that take at least this many seconds.
+        :param error_log_rate: Maximum number of failed requests to log per second.
+        :param error_log_burst: Number of failed requests that can be logged in a burst above
+            `error_log_rate`.
+        :param bind_context: Bind the request ID and method to the structlog context variables
+            while the request is handled.
+        :param bind_route: Also bind the route template. This looks the route up before the
+            request is routed, matching it against the application's routes a second time.
+        :param request_id_header: Header to read the request ID from.
+        :param profile_threshold: Sample the stack of requests that take longer than this many
+            seconds. The most sampled frames are included in their log as `hotspots`, and the
+            request is always logged.
+        :param admission: Admission control tracking the requests in flight and deciding which
+            requests to shed.
         """
-        super().__init__(app, dispatch)
+        self.app = app
         self.logger = logger
         self.log_level = log_level
         self.include_request_in_failed_requests = include_request_in_failed_requests
+        self.max_logged_request_size = max_logged_request_size
+        self.metrics = metrics
         self.ignored_status_codes = ignored_status_codes or set()
+        self.sample_rate = sample_rate
+        self.endpoint_sample_rates = endpoint_sample_rates or {}
+        self.slow_request_threshold = slow_request_threshold
+        self.error_log_limiter = (
+            TokenBucket(error_log_rate, error_log_burst) if error_log_rate is not None else None
+        )
+        self.suppressed_logs = {"sampled": 0, "rate_limited": 0}
+        self.bind_context = bind_context
+        self.bind_route = bind_context and bind_route
+        self.request_id_header = request_id_header.lower()
+        self.profiler = (
+            SlowCallProfiler(profile_threshold) if profile_threshold is not None else None
+        )
+        self.admission = admission
+        self._route_before_routing = bool(
+            self.bind_route
+            or self.endpoint_sample_rates
+            or (admission is not None and admission.max_route_in_flight)
+        )
 
     def __log(self, msg: str, **kwargs: Any) -> None:
         """Log at the configured level."""
         self.logger.log(self.log_level, msg, **kwargs)
 
-    @staticmethod
-    async def set_body(request: Request) -> None:
-        """
-        Set the body of the request so that it can be read multiple times.
-
-        :param request: The request to set the body of.
-        """
-        receive_ = await request._receive()
+    def _is_sampled(self, scope: Scope, route: Optional[str]) -> bool:
+        """Decide if a request should be logged regardless of its outcome."""
+        sample_rate = self.sample_rate
+        # The route is looked up before routing whenever there are endpoint sample rates.
+        if self.endpoint_sample_rates and route is not None:
+            sample_rate = self.endpoint_sample_rates.get(
+                route, self.endpoint_sample_rates.get(scope["path"], sample_rate)
+            )
+        return sample_rate >= 1 or random.random() < sample_rate
 
-        async def receive() -> Message:
-            return receive_
+    def _stop_profile(self, watch: Optional[ProfileWatch]) -> Dict[str, Any]:
+        """Stop profiling a request, returning the hotspots to log if it was sampled."""
+        if self.profiler is None or watch is None:
+            return {}
+        hotspots = self.profiler.stop(watch)
+        return {"hotspots": hotspots} if hotspots else {}
 
-        request._receive = receive
+    def _allow_error_log(self) -> bool:
+        """Check the rate limit for logging a failed request."""
+        if self.error_log_limiter is None or self.error_log_limiter.consume():
+            return True
+        self.suppressed_logs["rate_limited"] += 1
+        return False
 
-    async def dispatch(
-        self, request: Request, call_next: Callable[[Request], Awaitable[Response]]
-    ) -> Response:
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         """Log information about the request and call the next layer."""
-        method = request.method
-        endpoint = request.url.path
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = route_template(scope) if self._route_before_routing else None
+        if not self.bind_context:
+            await self._admit_request(scope, receive, send, route)
+            return
 
-        await self.set_body(request)
-        request_body = await request.body()
+        context = {
+            "request_id": request_id(scope, self.request_id_header),
+            "method": scope["method"],
+        }
+        if self.bind_route:
+            context["route"] = _resolve_route(scope, route)
+        tokens = bind_contextvars(**context)
+        try:
+            await self._admit_request(scope, receive, send, route)
+        finally:
+            reset_contextvars(**tokens)
+
+    async def _admit_request(
+        self, scope: Scope, receive: Receive, send: Send, route: Optional[str]
+    ) -> None:
+        """Handle an HTTP request if admission control admits it, otherwise shed it."""
+        admission = self.admission
+        if admission is None:
+            await self._log_request(scope, receive, send, route)
+            return
 
-        self.__log("HTTP request start", method=method, endpoint=endpoint)
+        reason = admission.admit(route)
+        if reason is not None:
+            await self._shed_request(scope, send, route, reason)
+            return
+        try:
+            await self._log_request(scope, receive, send, route)
+        finally:
+            admission.release(route)
+
+    async def _shed_request(
+        self, scope: Scope, send: Send, route: Optional[str], reason: str
+    ) -> None:
+        """Respond to a request with a 503 without calling the next layer."""
+        assert self.admission is not None
+        if self.metrics:
+            self.metrics.observe(
+                scope["method"],
+                _resolve_route(scope, route),
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                0.0,
+                0,
+            )
+        if self._allow_error_log():
+            self.__log(
+                "HTTP request shed",
+                method=scope["method"],
+                endpoint=scope["path"],
+                reason=reason,
+                in_flight=self.admission.in_flight,
+                loop_lag=self.admission.loop_lag,
+            )
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status.HTTP_503_SERVICE_UNAVAILABLE,
+                "headers": [
+                    (b"content-type", b"text/plain; charset=utf-8"),
+                    (b"content-length", str(len(SHED_RESPONSE_BODY)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": SHED_RESPONSE_BODY})
+
+    async def _log_request(
+        self, scope: Scope, receive: Receive, send: Send, route: Optional[str]
+    ) -> None:
+        """Log information about an HTTP request and call the next layer."""
+        method = scope["method"]
+        endpoint = scope["path"]
+        status_code: Optional[int] = None
+        response_bytes = 0
+        first_byte_time: Optional[float] = None
+        last_byte_time: Optional[float] = None
+        request_body: Optional[_RequestBodyTee] = None
+        if self.include_request_in_failed_requests:
+            request_body = _RequestBodyTee(receive, self.max_logged_request_size)
+            receive = request_body
+
+        async def send_and_record(message: Message) -> None:
+            nonlocal status_code, response_bytes, first_byte_time, last_byte_time
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                await send(message)
+                first_byte_time = perf_counter()
+                return
+
+            await send(message)
+            if message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+                if not message.get("more_body", False):
+                    last_byte_time = perf_counter()
+
+        sampled = self._is_sampled(scope, route)
+        if sampled:
+            self.__log("HTTP request start", method=method, endpoint=endpoint)
+        watch = self.profiler.start() if self.profiler is not None else None
         start_time = perf_counter()
         try:
-            response = await call_next(request)
+            await self.app(scope, receive, send_and_record)
         except Exception as e:
-            self.__log("Exception Occurred", exc_info=True)
+            profile = self._stop_profile(watch)
+            if self._allow_error_log():
+                self.__log("Exception Occurred", exc_info=True, **profile)
+            if self.metrics:
+                self.metrics.observe(
+                    method,
+                    _resolve_route(scope, route),
+                    status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    perf_counter() - start_time,
+                )
             raise e
+        except BaseException:
+            self._stop_profile(watch)
+            raise
 
         end_time = perf_counter()
         duration = end_time - start_time
-        status_code = response.status_code
+        profile = self._stop_profile(watch)
+        if self.metrics and status_code is not None:
+            route = _resolve_route(scope, route)
+            self.metrics.observe(method, route, status_code, duration, response_bytes)
 
+        failed = (
+            status_code is not None
+            and status_code >= status.HTTP_400_BAD_REQUEST
+            and status_code not in self.ignored_status_codes
+        )
+        log_error = failed and self._allow_error_log()
+        slow = self.slow_request_threshold is not None and duration >= self.slow_request_threshold
+        if not (sampled or log_error or slow or profile):
+            self.suppressed_logs["sampled"] += 1
+            return
+
+        route = _resolve_route(scope, route)
         self.__log(
             "HTTP request end",
             method=method,
             endpoint=endpoint,
+            route=route,
             status_code=status_code,
             seconds=duration,
+            response_bytes=response_bytes,
+            time_to_first_byte=_elapsed(start_time, first_byte_time),
+            time_to_last_byte=_elapsed(start_time, last_byte_time),
+            **profile,
         )
-        if (
-            status_code >= status.HTTP_400_BAD_REQUEST
-            and status_code not in self.ignored_status_codes
-        ):
-            if self.include_request_in_failed_requests:
+        if log_error:
+            if request_body is not None:
+                request: Dict[str, Any] = {}
+                if request_body.size or request_body.complete:
+                    request["request"] = Deferred(request_body.body)
+                if request_body.truncated:
+                    request["request_truncated"] = True
+                if not request_body.complete:
+                    # The application responded without reading the whole body.
+                    request["request_unread"] = True
                 self.__log(
                     "HTTP request error",
                     method=method,
                     endpoint=endpoint,
                     status_code=status_code,
-                    request=request_body,
+                    **request,
                 )
             else:
                 self.__log(
                     "HTTP request error", method=method, endpoint=endpoint, status_code=status_code
                 )
-        return response
@@ -0,0 +1,70 @@
+"""Structlog processors that skip work for events that do not need it."""
+from typing import Callable, Sequence, Tuple
+
+import structlog
+from structlog.types import EventDict, WrappedLogger
+
+from servicetools.deferred import Deferred
+
+EventDictProcessor = Callable[[WrappedLogger, str, EventDict], EventDict]
+
+
+class ConditionalProcessors:
+    """
+    Run processors only for events that contain the key each of them acts on.
+
+    Processors such as `format_exc_info` or `PositionalArgumentsFormatter` do nothing for most
+    events, but still cost a call each. Grouping them behind a key check turns them into a
+    dictionary lookup for events that do not need them:
+
+        ConditionalProcessors([("exc_info", structlog.processors.format_exc_info)])
+    """
+
+    __slots__ = ("stages",)
+
+    def __init__(self, stages: Sequence[Tuple[str, EventDictProcessor]]) -> None:
+        """
+        Create conditional processors.
+
+        :param stages: Key and processor to run when the key is in the event, in order.
+        """
+        self.stages = tuple(stages)
+
+    def __call__(self, logger: WrappedLogger, method_name: str, event_dict: EventDict) -> EventDict:
+        """Run the processors whose key is in the event."""
+        for key, processor in self.stages:
+            if key in event_dict:
+                event_dict = processor(logger, method_name, event_dict)
+        return event_dict
+
+
+def format_stages() -> ConditionalProcessors:
+    """
+    Get the formatting stages of the default processor chains.
+
+    Positional arguments, stack information and exception information are only formatted for
+    events that have them.
+
+    :return: Processor running the formatting stages.
+    """
+    return ConditionalProcessors(
+        [
+            ("positional_args", structlog.stdlib.PositionalArgumentsFormatter()),
+            ("stack_info", structlog.processors.StackInfoRenderer()),
+            ("exc_info", structlog.processors.format_exc_info),
+        ]
+    )
+
+
+def resolve_deferred(logger: WrappedLogger, method_name: str, event_dict: EventDict) -> EventDict:
+    """
+    Replace `Deferred` values in an event with their value.
+
+    The formatters configured by `default_logging` resolve deferred values when they render
+    them. This processor is for processor chains that render events themselves, such as ones
+    ending with `structlog.processors.JSONRenderer`; it should run just before rendering.
+    """
+    for key, value in event_dict.items():
+        if isinstance(value, Deferred):
+            event_dict[key] = value.resolve()
+    return event_dict
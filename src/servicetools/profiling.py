@@ -0,0 +1,122 @@
+"""Sampling profiler for slow calls."""
+from collections import Counter
+import os
+import sys
+import threading
+from time import monotonic, sleep
+from types import FrameType
+from typing import Any, Dict, List, Optional, Set
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+DEFAULT_TOP_FRAMES = 5
+
+
+class ProfileWatch:
+    """A call being watched by a `SlowCallProfiler`."""
+
+    __slots__ = ("thread_id", "deadline", "samples")
+
+    def __init__(self, thread_id: int, deadline: float) -> None:
+        """
+        Create a watch.
+
+        :param thread_id: Identifier of the thread running the call.
+        :param deadline: Monotonic time after which the call is sampled.
+        """
+        self.thread_id = thread_id
+        self.deadline = deadline
+        self.samples: Counter = Counter()
+
+
+def _frame_name(frame: FrameType) -> str:
+    """Describe a frame compactly, for example `middleware.py:210 __call__`."""
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}"
+
+
+class SlowCallProfiler:
+    """
+    Profile calls that run past a threshold.
+
+    Calls are watched with `start` and `stop`. Nothing is sampled while a call is faster than
+    the threshold, so watching costs little more than adding it to a set. Once a call is past
+    the threshold, a background thread samples the stack of the thread running it every
+    `interval` seconds, and `stop` returns the frames that were running most often:
+
+        watch = profiler.start()
+        handle_request()
+        hotspots = profiler.stop(watch)
+
+    The sampling thread only runs while calls are being watched. Calls are sampled through the
+    thread running them, so for asyncio code the samples include whatever the event loop was
+    running at the time, which may be another task.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        interval: float = DEFAULT_SAMPLE_INTERVAL,
+        top: int = DEFAULT_TOP_FRAMES,
+    ) -> None:
+        """
+        Create a slow call profiler.
+
+        :param threshold: Seconds a call can run before it is sampled.
+        :param interval: Seconds between samples.
+        :param top: Number of frames to report.
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.top = top
+        self._watches: Set[ProfileWatch] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> ProfileWatch:
+        """
+        Start watching a call running on the current thread.
+
+        :return: Watch to pass to `stop` when the call finishes.
+        """
+        watch = ProfileWatch(threading.get_ident(), monotonic() + self.threshold)
+        with self._lock:
+            self._watches.add(watch)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._sample, name="servicetools-profiler", daemon=True
+                )
+                self._thread.start()
+        return watch
+
+    def stop(self, watch: ProfileWatch) -> List[Dict[str, Any]]:
+        """
+        Stop watching a call.
+
+        :param watch: Watch returned by `start`.
+        :return: Most sampled frames with their number of samples, empty if the call was not
+            sampled.
+        """
+        with self._lock:
+            self._watches.discard(watch)
+            samples = watch.samples
+        return [
+            {"frame": frame, "samples": count} for frame, count in samples.most_common(self.top)
+        ]
+
+    def _sample(self) -> None:
+        """Sample the calls that are past the threshold until there is nothing to watch."""
+        while True:
+            sleep(self.interval)
+            now = monotonic()
+            with self._lock:
+                if not self._watches:
+                    self._thread = None
+                    return
+                due = [watch for watch in self._watches if watch.deadline <= now]
+                if not due:
+                    continue
+                frames = sys._current_frames()
+                for watch in due:
+                    frame = frames.get(watch.thread_id)
+                    if frame is not None:
+                        watch.samples[_frame_name(frame)] += 1
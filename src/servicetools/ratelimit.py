@@ -0,0 +1,42 @@
+"""Rate limiting utilities."""
+import threading
+from time import monotonic
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter.
+
+    The bucket holds up to `capacity` tokens and is refilled at `rate` tokens per second. Each
+    allowed action consumes a token, so bursts of up to `capacity` actions are allowed while the
+    long term rate is limited to `rate` actions per second.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        """
+        Create a token bucket, initially full.
+
+        :param rate: Tokens added per second.
+        :param capacity: Maximum number of tokens held.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last_refill = monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, tokens: float = 1.0) -> bool:
+        """
+        Take tokens from the bucket if there are enough.
+
+        :param tokens: Number of tokens to take.
+        :return: True if the tokens were taken.
+        """
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            if self._tokens < tokens:
+                return False
+            self._tokens -= tokens
+            return True
@@ -0,0 +1,404 @@
+"""Drive ASGI applications with generated load, in process and without a network."""
+import asyncio
+from itertools import count
+import logging
+import random
+from time import perf_counter
+import tracemalloc
+from typing import IO, Any, Dict, List, Optional, Sequence, Tuple
+
+from servicetools.histogram import DEFAULT_PERCENTILES, LatencyHistogram
+
+ERROR_HEADER = "x-loadgen-error"
+BODY_CHUNK_SIZE = 64 * 1024
+
+
+class RequestSpec:
+    """
+    Description of one kind of request in a load mix.
+
+    Requests are picked from the mix in proportion to their `weight`. A fraction `error_rate` of
+    them are sent with the `x-loadgen-error` header, which makes `simulated_app` fail them; other
+    applications can use the header to inject failures of their own.
+    """
+
+    __slots__ = ("method", "path", "body", "headers", "weight", "error_rate")
+
+    def __init__(
+        self,
+        method: str = "GET",
+        path: str = "/",
+        body_size: int = 0,
+        weight: float = 1.0,
+        error_rate: float = 0.0,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """
+        Create a request description.
+
+        :param method: HTTP method of the request.
+        :param path: Path of the request, optionally with a query string.
+        :param body_size: Number of bytes in the request body.
+        :param weight: Relative frequency of the request in the mix.
+        :param error_rate: Fraction of the requests to send with the error header.
+        :param headers: Additional headers to send.
+        """
+        self.method = method
+        self.path = path
+        self.body = b"x" * body_size
+        self.weight = weight
+        self.error_rate = error_rate
+        self.headers = [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in (headers or {}).items()
+        ]
+
+    def scope(self, error: bool) -> Dict[str, Any]:
+        """
+        Build the ASGI scope of a request.
+
+        :param error: Send the error header.
+        :return: ASGI scope.
+        """
+        path, _, query_string = self.path.partition("?")
+        headers = self.headers + [(b"content-length", str(len(self.body)).encode())]
+        if error:
+            headers.append((ERROR_HEADER.encode(), b"1"))
+        return {
+            "type": "http",
+            "asgi": {"version": "3.0", "spec_version": "2.1"},
+            "http_version": "1.1",
+            "scheme": "http",
+            "method": self.method,
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query_string.encode(),
+            "root_path": "",
+            "headers": headers,
+            "server": ("loadgen", 80),
+            "client": ("127.0.0.1", 50000),
+        }
+
+
+def simulated_app(
+    status_code: int = 200,
+    response_size: int = 0,
+    latency: float = 0.0,
+    error_status: int = 500,
+    raise_errors: bool = False,
+) -> Any:
+    """
+    Create an ASGI application standing in for a real one.
+
+    The application reads the request body, waits `latency` seconds and responds with
+    `response_size` bytes. Requests with the `x-loadgen-error` header get `error_status`, or raise
+    an exception if `raise_errors` is set.
+
+    :param status_code: Status code of successful responses.
+    :param response_size: Number of bytes in response bodies.
+    :param latency: Seconds to wait before responding, without blocking the event loop.
+    :param error_status: Status code of failed responses.
+    :param raise_errors: Raise an exception for failed requests instead of responding.
+    :return: ASGI application.
+    """
+    response_body = b"x" * response_size
+
+    async def app(scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        more_body = True
+        while more_body:
+            message = await receive()
+            more_body = message.get("more_body", False)
+        if latency:
+            await asyncio.sleep(latency)
+
+        failed = (ERROR_HEADER.encode(), b"1") in scope["headers"]
+        if failed and raise_errors:
+            raise RuntimeError("Simulated error")
+        await send(
+            {
+                "type": "http.response.start",
+                "status": error_status if failed else status_code,
+                "headers": [(b"content-length", str(len(response_body)).encode())],
+            }
+        )
+        await send({"type": "http.response.body", "body": response_body})
+
+    return app
+
+
+class _CountingStream:
+    """Stream counting the bytes written to it, and optionally passing them on."""
+
+    def __init__(self, stream: Optional[IO[str]]) -> None:
+        self.stream = stream
+        self.bytes = 0
+
+    def write(self, text: str) -> int:
+        self.bytes += len(text.encode("utf-8", "replace"))
+        if self.stream is not None:
+            self.stream.write(text)
+        return len(text)
+
+    def flush(self) -> None:
+        if self.stream is not None:
+            self.stream.flush()
+
+
+def _stream_handlers() -> List[logging.StreamHandler]:
+    """Get the stream handlers of every logger."""
+    loggers = [logging.getLogger()] + [
+        logger
+        for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)
+    ]
+    handlers: Dict[int, logging.StreamHandler] = {}
+    for logger in loggers:
+        for handler in logger.handlers:
+            if isinstance(handler, logging.StreamHandler):
+                handlers[id(handler)] = handler
+    return list(handlers.values())
+
+
+def _count_output(
+    handlers: Sequence[logging.StreamHandler], discard: bool
+) -> List[Tuple[logging.StreamHandler, Any, _CountingStream]]:
+    """Replace the streams of handlers with streams counting their output."""
+    counted = []
+    for handler in handlers:
+        stream = _CountingStream(None if discard else handler.stream)
+        try:
+            original_stream = handler.setStream(stream)  # type: ignore
+        except (OSError, ValueError):
+            # The handler's stream is closed, so it cannot write anything anyway.
+            continue
+        counted.append((handler, original_stream, stream))
+    return counted
+
+
+class LoadReport:
+    """Results of a load run."""
+
+    def __init__(
+        self,
+        requests: int,
+        seconds: float,
+        latency: LatencyHistogram,
+        status_codes: Dict[int, int],
+        exceptions: int,
+        log_bytes: int,
+        peak_memory: Optional[int],
+        percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+    ) -> None:
+        """
+        Create a load report.
+
+        :param requests: Number of requests sent.
+        :param seconds: Duration of the run.
+        :param latency: Histogram of the request latencies.
+        :param status_codes: Number of responses with each status code.
+        :param exceptions: Number of requests that raised an exception.
+        :param log_bytes: Number of bytes written by the stream log handlers.
+        :param peak_memory: Peak bytes allocated during the run, if memory was traced.
+        :param percentiles: Latency percentiles to report.
+        """
+        self.requests = requests
+        self.seconds = seconds
+        self.latency = latency
+        self.status_codes = status_codes
+        self.exceptions = exceptions
+        self.log_bytes = log_bytes
+        self.peak_memory = peak_memory
+        self.percentiles = percentiles
+
+    @property
+    def throughput(self) -> float:
+        """Get the number of requests completed per second."""
+        return self.requests / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Summarize the run.
+
+        :return: Dictionary of the results, with the latency count, min, max and percentiles.
+        """
+        return {
+            "requests": self.requests,
+            "seconds": self.seconds,
+            "throughput": self.throughput,
+            "latency": self.latency.summary(self.percentiles),
+            "status_codes": dict(sorted(self.status_codes.items())),
+            "exceptions": self.exceptions,
+            "log_bytes": self.log_bytes,
+            "log_bytes_per_request": self.log_bytes / self.requests if self.requests else 0.0,
+            "peak_memory": self.peak_memory,
+        }
+
+
+class LoadGenerator:
+    """
+    Send a mix of requests to an ASGI application, in process, and measure how it copes.
+
+    Requests are sent by `concurrency` concurrent clients directly to the application, with no
+    server or network involved, so the run measures the application and its middleware. The
+    report includes the throughput, latency percentiles, status codes, the bytes written by the
+    stream log handlers (for example those configured by `default_logging`) and, optionally, the
+    peak memory allocated:
+
+        app = StructlogRequestMiddleware(simulated_app(latency=0.001), sample_rate=0.1)
+        mix = [RequestSpec("GET", "/items"), RequestSpec("POST", "/items", body_size=1024)]
+        report = LoadGenerator(app, mix, concurrency=50, seed=1).run_sync(requests=10000)
+        print(report.summary())
+
+    Log handlers behind a log queue are not attached to any logger, so they are not found and
+    must be given in `log_handlers`. The application's lifespan is not run, so applications
+    relying on startup handlers must be started beforehand.
+    """
+
+    def __init__(
+        self,
+        app: Any,
+        requests: Sequence[RequestSpec],
+        concurrency: int = 10,
+        seed: Optional[int] = None,
+        trace_memory: bool = False,
+        discard_logs: bool = True,
+        log_handlers: Optional[Sequence[logging.StreamHandler]] = None,
+    ) -> None:
+        """
+        Create a load generator.
+
+        :param app: ASGI application to send requests to.
+        :param requests: Mix of requests to send.
+        :param concurrency: Number of requests in flight at once.
+        :param seed: Seed of the random choice of requests, to make runs reproducible.
+        :param trace_memory: Trace memory allocations to report the peak memory. Tracing slows
+            the application down significantly, so throughput and latencies are not comparable
+            with runs without it.
+        :param discard_logs: Discard the output of stream log handlers while running, instead of
+            writing it to their streams. It is counted in either case.
+        :param log_handlers: Stream handlers to count the output of, defaults to the stream
+            handlers of every logger.
+        """
+        self.app = app
+        self.requests = list(requests)
+        self.concurrency = concurrency
+        self.random = random.Random(seed)
+        self.trace_memory = trace_memory
+        self.discard_logs = discard_logs
+        self.log_handlers = list(log_handlers) if log_handlers is not None else None
+        self._weights = [request.weight for request in self.requests]
+
+    def _next_request(self) -> Tuple[RequestSpec, Dict[str, Any]]:
+        """Pick the next request to send and build its scope."""
+        request = self.random.choices(self.requests, self._weights)[0]
+        error = request.error_rate > 0 and self.random.random() < request.error_rate
+        return request, request.scope(error)
+
+    async def _send(self, request: RequestSpec, scope: Dict[str, Any]) -> Optional[int]:
+        """Send a request to the application and get the status code of its response."""
+        body = request.body
+        offsets = iter(range(0, max(len(body), 1), BODY_CHUNK_SIZE))
+        finished = asyncio.Event()
+        status_code: Optional[int] = None
+
+        async def receive() -> Dict[str, Any]:
+            offset = next(offsets, None)
+            if offset is None:
+                # The request has been read, report a disconnect once the response is sent.
+                await finished.wait()
+                return {"type": "http.disconnect"}
+            end = offset + BODY_CHUNK_SIZE
+            return {"type": "http.request", "body": body[offset:end], "more_body": end < len(body)}
+
+        async def send(message: Dict[str, Any]) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                finished.set()
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            finished.set()
+        return status_code
+
+    async def run(
+        self, requests: Optional[int] = None, duration: Optional[float] = None
+    ) -> LoadReport:
+        """
+        Send requests until `requests` have been sent or `duration` seconds have passed.
+
+        :param requests: Number of requests to send.
+        :param duration: Seconds to send requests for.
+        :return: Report of the run.
+        """
+        if requests is None and duration is None:
+            raise ValueError("Either requests or duration must be given")
+
+        latency = LatencyHistogram()
+        status_codes: Dict[int, int] = {}
+        exceptions = 0
+        sent = count()
+        deadline: Optional[float] = None
+
+        def should_send() -> bool:
+            if deadline is not None and perf_counter() >= deadline:
+                return False
+            return requests is None or next(sent) < requests
+
+        async def client() -> None:
+            nonlocal exceptions
+            while should_send():
+                request, scope = self._next_request()
+                request_start = perf_counter()
+                try:
+                    status_code = await self._send(request, scope)
+                except Exception:
+                    exceptions += 1
+                else:
+                    if status_code is not None:
+                        status_codes[status_code] = status_codes.get(status_code, 0) + 1
+                latency.record(perf_counter() - request_start)
+
+        handlers = self.log_handlers if self.log_handlers is not None else _stream_handlers()
+        counted = _count_output(handlers, self.discard_logs)
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        elif self.trace_memory and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        try:
+            start_time = perf_counter()
+            if duration is not None:
+                deadline = start_time + duration
+            await asyncio.gather(*(client() for _ in range(self.concurrency)))
+            seconds = perf_counter() - start_time
+            peak_memory = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+        finally:
+            if tracing:
+                tracemalloc.stop()
+            for handler, original_stream, _ in counted:
+                handler.setStream(original_stream)
+
+        return LoadReport(
+            requests=latency.count,
+            seconds=seconds,
+            latency=latency,
+            status_codes=status_codes,
+            exceptions=exceptions,
+            log_bytes=sum(stream.bytes for _, _, stream in counted),
+            peak_memory=peak_memory,
+        )
+
+    def run_sync(
+        self, requests: Optional[int] = None, duration: Optional[float] = None
+    ) -> LoadReport:
+        """
+        Send requests from a new event loop, see `run`.
+
+        :param requests: Number of requests to send.
+        :param duration: Seconds to send requests for.
+        :return: Report of the run.
+        """
+        return asyncio.run(self.run(requests, duration))
@@ -1,37 +1,296 @@
 """Utilities to get timing information."""
+from functools import wraps
+import inspect
+from itertools import count
 import logging
+import random
+import threading
 from time import perf_counter
-from typing import Callable, Any
+from types import TracebackType
+from typing import Callable, Any, Dict, List, Optional, Type
 
 import structlog
 
+from servicetools.deferred import deferred_repr
+from servicetools.histogram import LatencyHistogram
+from servicetools.profiling import ProfileWatch, SlowCallProfiler
+
 LOGGER = structlog.get_logger(__name__)
+DEFAULT_SUMMARY_INTERVAL = 60.0
+
+_histograms: Dict[str, LatencyHistogram] = {}
+_histograms_lock = threading.Lock()
+
+
+def _is_enabled(logger: Any, level: int) -> bool:
+    """
+    Check if the given logger will write logs at the given level.
+
+    Loggers that cannot tell are assumed to be enabled.
+
+    :param logger: structlog or standard library logger.
+    :param level: logging level to check.
+    :return: True if logs at the given level will be written.
+    """
+    is_enabled_for = getattr(logger, "isEnabledFor", None) or getattr(
+        logger, "is_enabled_for", None
+    )
+    return is_enabled_for is None or bool(is_enabled_for(level))
+
+
+def _sampler(sample_every: int, sample_rate: float) -> Optional[Callable[[], bool]]:
+    """
+    Build a function that decides if a call should be sampled.
+
+    :param sample_every: Sample 1 in every `sample_every` calls.
+    :param sample_rate: Probability of sampling a call.
+    :return: Function returning True for calls to sample, or None if every call is sampled.
+    """
+    calls = count()
+    if sample_every > 1 and sample_rate < 1:
+        return lambda: next(calls) % sample_every == 0 and random.random() < sample_rate
+    if sample_every > 1:
+        return lambda: next(calls) % sample_every == 0
+    if sample_rate < 1:
+        return lambda: random.random() < sample_rate
+    return None
+
+
+def timing_histogram(name: str) -> LatencyHistogram:
+    """
+    Get the histogram that aggregated timings for the given function are recorded in.
+
+    :param name: Qualified name of the function (`module.qualname`).
+    :return: Histogram for the function.
+    """
+    with _histograms_lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = LatencyHistogram()
+        return histogram
+
+
+def timing_summaries() -> Dict[str, Dict[str, Any]]:
+    """
+    Summarize the timings of all functions timed with `aggregate=True`.
+
+    :return: Dictionary of qualified function name to its count, min, max, p50, p90 and p99.
+    """
+    with _histograms_lock:
+        histograms = list(_histograms.items())
+    return {name: histogram.summary() for name, histogram in histograms}
+
+
+class Timing:
+    """
+    Context manager to log how long a block of code took to execute.
+
+    Works with both `with` and `async with`. If the logger is not enabled for the given level
+    when the block is entered, nothing is measured or logged.
 
+        with Timing("load configuration", logger):
+            ...
 
-def timer(logger: Any = LOGGER, details: bool = False, level: int = logging.INFO) -> Callable:
+        async with Timing("fetch results", logger, level=logging.DEBUG):
+            ...
+    """
+
+    __slots__ = ("name", "logger", "level", "fields", "seconds", "_start_time")
+
+    def __init__(
+        self, name: str, logger: Any = LOGGER, level: int = logging.INFO, **fields: Any
+    ) -> None:
+        """
+        Create a timing context manager.
+
+        :param name: Name of the block being timed.
+        :param logger: structlog logger to write to.
+        :param level: logging level to log at.
+        :param fields: Additional fields to include in the log.
+        """
+        self.name = name
+        self.logger = logger
+        self.level = level
+        self.fields = fields
+        self.seconds: Optional[float] = None
+        self._start_time: Optional[float] = None
+
+    def __enter__(self) -> "Timing":
+        """Start timing the block."""
+        if _is_enabled(self.logger, self.level):
+            self._start_time = perf_counter()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        trace: Optional[TracebackType],
+    ) -> None:
+        """Log how long the block took."""
+        if self._start_time is None:
+            return
+        self.seconds = perf_counter() - self._start_time
+        self.logger.log(
+            self.level, "timing information", block=self.name, seconds=self.seconds, **self.fields
+        )
+
+    async def __aenter__(self) -> "Timing":
+        """Start timing the block."""
+        return self.__enter__()
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        trace: Optional[TracebackType],
+    ) -> None:
+        """Log how long the block took."""
+        self.__exit__(exc_type, exc_value, trace)
+
+
+def timer(
+    logger: Any = LOGGER,
+    details: bool = False,
+    level: int = logging.INFO,
+    aggregate: bool = False,
+    summary_interval: float = DEFAULT_SUMMARY_INTERVAL,
+    sample_every: int = 1,
+    sample_rate: float = 1.0,
+    profile_threshold: Optional[float] = None,
+) -> Callable:
     """
     Decorate a function to log how log the function took to execute.
 
+    Coroutine functions are timed until the coroutine completes, and generators and async
+    generators are timed from their first iteration until they are exhausted.
+
+    When the logger is not enabled for the level, calls are not measured at all. For very hot
+    functions, only a sample of calls can be measured.
+
     :param logger: structlog logger to write to.
-    :param details: include function parameters in log.
+    :param details: include function parameters in log. They are logged as truncated
+        representations, only computed when the log is rendered.
     :param level: logging level to log at.
+    :param aggregate: record timings in a histogram instead of logging every call. A summary of
+        the histogram is logged at most once every `summary_interval` seconds. Timings are
+        recorded whatever the log level, so they are always available from `timing_summaries`.
+    :param summary_interval: seconds between summaries when aggregating.
+    :param sample_every: only measure 1 in every `sample_every` calls.
+    :param sample_rate: probability of measuring a call, between 0 and 1.
+    :param profile_threshold: sample the stack of calls that run for longer than this many
+        seconds, and include the most sampled frames in their log as `hotspots`.
     """
+    sampler = _sampler(sample_every, sample_rate)
+    profiler = SlowCallProfiler(profile_threshold) if profile_threshold is not None else None
 
     def decorator(fn: Callable) -> Callable:
-        def measure_time(*args: Any, **kwargs: Any) -> Any:
-            start_time = perf_counter()
-            result = fn(*args, **kwargs)
-            end_time = perf_counter()
+        histogram = timing_histogram(f"{fn.__module__}.{fn.__qualname__}") if aggregate else None
+        next_summary = perf_counter() + summary_interval
+
+        def should_measure() -> bool:
+            if sampler is not None and not sampler():
+                return False
+            return histogram is not None or _is_enabled(logger, level)
 
-            seconds = end_time - start_time
-            detailed_args = {}
+        def start_profile() -> Optional[ProfileWatch]:
+            return profiler.start() if profiler is not None else None
+
+        def stop_profile(watch: Optional[ProfileWatch]) -> List[Dict[str, Any]]:
+            return profiler.stop(watch) if profiler is not None and watch is not None else []
+
+        def record(seconds: float, args: Any, kwargs: Any, hotspots: List[Dict[str, Any]]) -> None:
+            nonlocal next_summary
+            if histogram is not None:
+                histogram.record(seconds)
+                now = perf_counter()
+                if now >= next_summary:
+                    next_summary = now + summary_interval
+                    logger.log(level, "timing summary", function=fn.__name__, **histogram.summary())
+                if hotspots:
+                    logger.log(
+                        level, "slow call", function=fn.__name__, seconds=seconds, hotspots=hotspots
+                    )
+                return
+
+            detailed_args: Dict[str, Any] = {}
             if details:
-                detailed_args["fn_args"] = args
-                detailed_args["fn_kwargs"] = kwargs  # type: ignore
+                detailed_args["fn_args"] = deferred_repr(args)
+                detailed_args["fn_kwargs"] = deferred_repr(kwargs)
+            if hotspots:
+                detailed_args["hotspots"] = hotspots
             logger.log(
                 level, "timing information", function=fn.__name__, seconds=seconds, **detailed_args
             )
 
+        if inspect.iscoroutinefunction(fn):
+
+            @wraps(fn)
+            async def measure_coroutine(*args: Any, **kwargs: Any) -> Any:
+                if not should_measure():
+                    return await fn(*args, **kwargs)
+                watch = start_profile()
+                try:
+                    start_time = perf_counter()
+                    result = await fn(*args, **kwargs)
+                    seconds = perf_counter() - start_time
+                finally:
+                    hotspots = stop_profile(watch)
+                record(seconds, args, kwargs, hotspots)
+                return result
+
+            return measure_coroutine
+
+        if inspect.isasyncgenfunction(fn):
+
+            @wraps(fn)
+            async def measure_async_generator(*args: Any, **kwargs: Any) -> Any:
+                if not should_measure():
+                    async for item in fn(*args, **kwargs):
+                        yield item
+                    return
+                watch = start_profile()
+                try:
+                    start_time = perf_counter()
+                    async for item in fn(*args, **kwargs):
+                        yield item
+                    seconds = perf_counter() - start_time
+                finally:
+                    hotspots = stop_profile(watch)
+                record(seconds, args, kwargs, hotspots)
+
+            return measure_async_generator
+
+        if inspect.isgeneratorfunction(fn):
+
+            @wraps(fn)
+            def measure_generator(*args: Any, **kwargs: Any) -> Any:
+                if not should_measure():
+                    return (yield from fn(*args, **kwargs))
+                watch = start_profile()
+                try:
+                    start_time = perf_counter()
+                    result = yield from fn(*args, **kwargs)
+                    seconds = perf_counter() - start_time
+                finally:
+                    hotspots = stop_profile(watch)
+                record(seconds, args, kwargs, hotspots)
+                return result
+
+            return measure_generator
+
+        @wraps(fn)
+        def measure_time(*args: Any, **kwargs: Any) -> Any:
+            if not should_measure():
+                return fn(*args, **kwargs)
+            watch = start_profile()
+            try:
+                start_time = perf_counter()
+                result = fn(*args, **kwargs)
+                seconds = perf_counter() - start_time
+            finally:
+                hotspots = stop_profile(watch)
+            record(seconds, args, kwargs, hotspots)
             return result
 
         return measure_time
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+
+class NullLogger:
+    """Logger that discards everything, so benchmarks only measure the code under test."""
+
+    def log(self, *args, **kwargs):
+        pass
+
+
+def build_receive(body: bytes = b"", chunk_size: int = 64 * 1024):
+    chunks = [body[i : i + chunk_size] for i in range(0, len(body), chunk_size)] or [b""]
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        return {"type": "http.disconnect"}
+
+    return receive
+
+
+async def send_request(app, method: str = "GET", path: str = "/", body: bytes = b""):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, build_receive(body), send)
+    return sent
+
+
+@pytest.fixture
+def run_async():
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture
+def latency_benchmark(benchmark):
+    """Run a benchmark and record tail latency percentiles alongside the standard stats."""
+
+    def run(fn, *args, **kwargs):
+        result = benchmark(fn, *args, **kwargs)
+        if benchmark.stats:
+            data = sorted(benchmark.stats.stats.data)
+            for percentile in (50, 90, 99):
+                index = min(len(data) - 1, int(len(data) * percentile / 100))
+                benchmark.extra_info[f"p{percentile}"] = data[index]
+        return result
+
+    return run
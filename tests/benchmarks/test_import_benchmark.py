@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import servicetools
+
+# Cumulative import time allowed for the modules command line tools use, in microseconds. Most
+# of it is structlog; the integrations must not be imported at all.
+IMPORT_TIME_BUDGET = 300_000
+OPTIONAL_DEPENDENCIES = {"starlette", "anyio", "dramatiq", "pika", "pythonjsonlogger"}
+
+
+def import_times(statement: str) -> dict:
+    """Import modules in a fresh interpreter and get the cumulative import time of each."""
+    env = dict(os.environ, PYTHONPATH=str(Path(servicetools.__file__).parent.parent))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(cumulative), name.startswith("  "))
+    return times
+
+
+@pytest.mark.parametrize(
+    "statement",
+    [
+        "import servicetools",
+        "import servicetools.timer, servicetools.logging_config",
+        "from servicetools import Timing, default_logging",
+    ],
+)
+def test_cli_imports_are_light(statement):
+    times = import_times(statement)
+
+    imported = {name.split(".")[0] for name in times}
+    assert not imported & OPTIONAL_DEPENDENCIES
+    total = sum(
+        cumulative
+        for name, (cumulative, nested) in times.items()
+        if name.startswith("servicetools") and not nested
+    )
+    assert total < IMPORT_TIME_BUDGET
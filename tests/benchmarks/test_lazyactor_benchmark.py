@@ -0,0 +1,110 @@
+import time
+from unittest.mock import patch
+
+import dramatiq
+import pytest
+from dramatiq.brokers.rabbitmq import RabbitmqBroker
+from dramatiq.brokers.stub import StubBroker
+
+import servicetools.lazyactor as under_test
+
+ACTOR_COUNT = 200
+QUEUE_COUNT = 20
+ROUND_TRIP = 0.001
+
+ACTORS = [
+    dramatiq.actor(
+        lambda: None,
+        actor_class=under_test.LazyActor,
+        actor_name=f"cold_start_{i}",
+        queue_name=f"cold_start_{i % QUEUE_COUNT}",
+    )
+    for i in range(ACTOR_COUNT)
+]
+
+SEND_COUNT = 1000
+
+
+@dramatiq.actor(actor_class=under_test.LazyActor, queue_name="send_rate")
+def send_rate(value: int) -> None:
+    pass
+
+
+def round_trip(self, queue_name):
+    """Stand in for a queue declaration on the server."""
+    time.sleep(ROUND_TRIP)
+
+
+@pytest.fixture
+def simulated_server():
+    with patch.multiple(
+        RabbitmqBroker,
+        _declare_queue=round_trip,
+        _declare_dq_queue=round_trip,
+        _declare_xq_queue=round_trip,
+    ):
+        yield
+
+
+def new_broker():
+    return (RabbitmqBroker(),), {}
+
+
+def init_each(broker):
+    for actor in ACTORS:
+        actor.init_actor(broker)
+        broker.declare_queue(actor.queue_name, ensure=True)
+
+
+@pytest.fixture
+def stub_broker():
+    broker = StubBroker()
+    send_rate.init_actor(broker)
+    yield broker
+    broker.close()
+
+
+@pytest.mark.benchmark(group="worker-cold-start")
+@pytest.mark.usefixtures("simulated_server")
+def test_init_actor_each(benchmark):
+    benchmark.pedantic(init_each, setup=new_broker, rounds=5)
+
+
+@pytest.mark.benchmark(group="worker-cold-start")
+@pytest.mark.usefixtures("simulated_server")
+def test_init_all_lazy_queues(benchmark):
+    benchmark.pedantic(
+        lambda broker: under_test.init_all(broker, ACTORS), setup=new_broker, rounds=5
+    )
+
+
+@pytest.mark.benchmark(group="worker-cold-start")
+@pytest.mark.parametrize("concurrency", [1, 8])
+@pytest.mark.usefixtures("simulated_server")
+def test_init_all_declare_queues(benchmark, concurrency):
+    benchmark.pedantic(
+        lambda broker: under_test.init_all(
+            broker, ACTORS, declare_queues=True, concurrency=concurrency
+        ),
+        setup=new_broker,
+        rounds=5,
+    )
+
+
+def send_each(count):
+    for i in range(count):
+        send_rate.send(i)
+
+
+def send_batched(count):
+    send_rate.send_many((i,) for i in range(count))
+
+
+@pytest.mark.benchmark(group="actor-send")
+@pytest.mark.parametrize("send", [send_each, send_batched], ids=["send", "send_many"])
+def test_send_rate(benchmark, stub_broker, send):
+    queue = stub_broker.queues["send_rate"]
+
+    benchmark.pedantic(send, args=(SEND_COUNT,), setup=queue.queue.clear, rounds=10)
+
+    assert queue.qsize() == SEND_COUNT
@@ -0,0 +1,72 @@
+import logging
+import os
+from unittest.mock import patch
+
+import pytest
+import structlog
+
+from servicetools.formatters import JsonFormatter
+
+PRE_CHAIN = [
+    structlog.stdlib.add_logger_name,
+    structlog.stdlib.add_log_level,
+    structlog.stdlib.PositionalArgumentsFormatter(),
+    structlog.processors.StackInfoRenderer(),
+    structlog.processors.format_exc_info,
+    structlog.processors.UnicodeDecoder(),
+]
+
+
+@pytest.fixture
+def devnull():
+    with open(os.devnull, "w") as stream:
+        yield stream
+
+
+def build_logger(name, formatter, final_processor, stream):
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(formatter)
+    stdlib_logger = logging.getLogger(name)
+    stdlib_logger.handlers = [handler]
+    stdlib_logger.setLevel(logging.INFO)
+    stdlib_logger.propagate = False
+    return structlog.wrap_logger(
+        stdlib_logger,
+        processors=PRE_CHAIN + [final_processor],
+        wrapper_class=structlog.stdlib.BoundLogger,
+    ).bind()
+
+
+def log_lines(logger):
+    logger.info("request handled", method="GET", endpoint="/items", status_code=200, seconds=0.01)
+
+
+@pytest.mark.benchmark(group="json-rendering")
+def test_python_json_logger(benchmark, devnull):
+    jsonlogger = pytest.importorskip("pythonjsonlogger.jsonlogger")
+    logger = build_logger(
+        "benchmark.legacy",
+        jsonlogger.JsonFormatter("%(message)s"),
+        structlog.stdlib.render_to_log_kwargs,
+        devnull,
+    )
+
+    benchmark(log_lines, logger)
+
+
+@pytest.mark.benchmark(group="json-rendering")
+@pytest.mark.parametrize("encoder", ["orjson", "stdlib"])
+def test_json_formatter(benchmark, devnull, encoder):
+    logger = build_logger(
+        f"benchmark.{encoder}",
+        JsonFormatter(),
+        structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
+        devnull,
+    )
+
+    if encoder == "orjson":
+        pytest.importorskip("orjson")
+        benchmark(log_lines, logger)
+    else:
+        with patch("servicetools.formatters.orjson", None):
+            benchmark(log_lines, logger)
@@ -0,0 +1,84 @@
+import itertools
+import logging
+import os
+
+import pytest
+import structlog
+
+from servicetools.logging_config import LogFormat, Verbosity, default_logging, processor_chain
+
+# The chain default_logging used before it was built once per format.
+GENERIC_JSON_CHAIN = [
+    structlog.contextvars.merge_contextvars,
+    structlog.stdlib.filter_by_level,
+    structlog.stdlib.add_logger_name,
+    structlog.stdlib.add_log_level,
+    structlog.stdlib.PositionalArgumentsFormatter(),
+    structlog.processors.StackInfoRenderer(),
+    structlog.processors.format_exc_info,
+    structlog.processors.UnicodeDecoder(),
+    structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
+]
+
+# dictConfig disables loggers that already exist, so each configuration gets a new logger.
+LOGGER_NAMES = (f"benchmark.logging_config.{i}" for i in itertools.count())
+
+
+@pytest.fixture
+def configure_logging():
+    """Configure logging with default_logging, writing to /dev/null, and restore it after."""
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    devnull = open(os.devnull, "w")
+
+    def configure(verbosity, log_format, **kwargs):
+        root.handlers = []
+        default_logging(verbosity, log_format, **kwargs)
+        for handler in root.handlers:
+            handler.setStream(devnull)
+        return structlog.get_logger(next(LOGGER_NAMES)).bind()
+
+    yield configure
+
+    root.handlers, root.level = handlers, level
+    devnull.close()
+    structlog.reset_defaults()
+
+
+def log_event(logger):
+    logger.info("request handled", method="GET", endpoint="/items", status_code=200)
+    logger.info("request %s handled", "fake-request", status_code=200)
+
+
+@pytest.mark.benchmark(group="events-per-second")
+@pytest.mark.parametrize("log_format", list(LogFormat), ids=lambda f: f.name)
+@pytest.mark.parametrize(
+    "verbosity", [Verbosity.WARNING, Verbosity.INFO, Verbosity.DEBUG], ids=lambda v: v.name
+)
+def test_events_per_second(benchmark, configure_logging, log_format, verbosity):
+    logger = configure_logging(verbosity, log_format)
+
+    benchmark(log_event, logger)
+
+
+@pytest.mark.benchmark(group="processor-chain")
+@pytest.mark.parametrize("chain", ["generic", "fast-path"])
+@pytest.mark.parametrize("verbosity", [Verbosity.WARNING, Verbosity.INFO], ids=lambda v: v.name)
+def test_json_processor_chain(benchmark, configure_logging, chain, verbosity):
+    logger = configure_logging(verbosity, LogFormat.JSON)
+    processors = GENERIC_JSON_CHAIN if chain == "generic" else list(processor_chain(LogFormat.JSON))
+    structlog.configure(processors=processors)
+
+    benchmark(log_event, logger.new())
+
+
+@pytest.mark.benchmark(group="filtered-debug")
+@pytest.mark.parametrize("cache_levels", [False, True], ids=["filter_by_level", "cached-levels"])
+def test_filtered_debug(benchmark, configure_logging, cache_levels):
+    logger = configure_logging(Verbosity.INFO, LogFormat.JSON, cache_levels=cache_levels)
+
+    def log_debug():
+        for _ in range(100):
+            logger.debug("cache lookup", key="items", hit=True)
+
+    benchmark(log_debug)
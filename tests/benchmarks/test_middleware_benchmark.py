@@ -0,0 +1,157 @@
+import logging
+from time import perf_counter
+
+import pytest
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+import servicetools.middleware as under_test
+from tests.benchmarks.conftest import NullLogger, send_request
+
+
+class LegacyStructlogRequestMiddleware(BaseHTTPMiddleware):
+    # The BaseHTTPMiddleware implementation this package shipped before 0.6.0, kept here as the
+    # reference point for the pure ASGI implementation.
+    def __init__(self, app, logger, log_level=logging.INFO, ignored_status_codes=None):
+        super().__init__(app)
+        self.logger = logger
+        self.log_level = log_level
+        self.ignored_status_codes = ignored_status_codes or set()
+
+    async def dispatch(self, request, call_next):
+        method = request.method
+        endpoint = request.url.path
+        receive_ = await request._receive()
+
+        async def receive():
+            return receive_
+
+        request._receive = receive
+        await request.body()
+
+        self.logger.log(self.log_level, "HTTP request start", method=method, endpoint=endpoint)
+        start_time = perf_counter()
+        response = await call_next(request)
+        self.logger.log(
+            self.log_level,
+            "HTTP request end",
+            method=method,
+            endpoint=endpoint,
+            status_code=response.status_code,
+            seconds=perf_counter() - start_time,
+        )
+        return response
+
+
+async def hello(request):
+    return PlainTextResponse("hello")
+
+
+async def stream(request):
+    async def chunks():
+        for _ in range(10):
+            yield b"x" * 1024
+
+    return StreamingResponse(chunks())
+
+
+async def echo_length(request):
+    return PlainTextResponse(str(len(await request.body())))
+
+
+def build_app(middleware_class, **options):
+    middleware = (
+        [Middleware(middleware_class, logger=NullLogger(), **options)] if middleware_class else []
+    )
+    return Starlette(
+        routes=[
+            Route("/", hello, methods=["GET", "POST"]),
+            Route("/stream", stream),
+            Route("/echo", echo_length, methods=["POST"]),
+        ],
+        middleware=middleware,
+    )
+
+
+MIDDLEWARE_CLASSES = {
+    "none": None,
+    "legacy": LegacyStructlogRequestMiddleware,
+    "asgi": under_test.StructlogRequestMiddleware,
+}
+
+
+@pytest.mark.benchmark(group="middleware-request")
+@pytest.mark.parametrize("implementation", MIDDLEWARE_CLASSES.keys())
+def test_request_throughput(latency_benchmark, run_async, implementation):
+    app = build_app(MIDDLEWARE_CLASSES[implementation])
+
+    sent = latency_benchmark(lambda: run_async(send_request(app)))
+
+    assert sent[0]["status"] == 200
+
+
+# The legacy implementation replays the first request message forever, which breaks streaming
+# responses, so it is left out of this comparison.
+@pytest.mark.benchmark(group="middleware-streaming")
+@pytest.mark.parametrize("implementation", ["none", "asgi"])
+def test_streaming_throughput(latency_benchmark, run_async, implementation):
+    app = build_app(MIDDLEWARE_CLASSES[implementation])
+
+    sent = latency_benchmark(lambda: run_async(send_request(app, path="/stream")))
+
+    assert sum(len(message.get("body", b"")) for message in sent) == 10 * 1024
+
+
+BODY_SIZES = {"small": 100, "large": 1024 * 1024}
+
+
+@pytest.mark.benchmark(group="middleware-body")
+@pytest.mark.parametrize("body_size", BODY_SIZES.keys())
+@pytest.mark.parametrize(
+    "implementation,options",
+    [
+        ("none", {}),
+        ("asgi", {}),
+        ("asgi", {"include_request_in_failed_requests": True}),
+    ],
+    ids=["none", "asgi", "asgi-request-capture"],
+)
+def test_body_throughput(latency_benchmark, run_async, implementation, options, body_size):
+    app = build_app(MIDDLEWARE_CLASSES[implementation], **options)
+    body = b"x" * BODY_SIZES[body_size]
+
+    sent = latency_benchmark(lambda: run_async(send_request(app, "POST", "/echo", body)))
+
+    assert sent[1]["body"] == str(len(body)).encode()
+
+
+ROUTE_COUNT = 50
+
+
+def build_routed_app(**options):
+    # Requests go to the last route, so routing matches the path against every route.
+    routes = [Route(f"/resources{i}/{{item_id}}", hello) for i in range(ROUTE_COUNT)]
+    return Starlette(
+        routes=routes,
+        middleware=[
+            Middleware(under_test.StructlogRequestMiddleware, logger=NullLogger(), **options)
+        ],
+    )
+
+
+@pytest.mark.benchmark(group="middleware-routes")
+@pytest.mark.parametrize(
+    "options",
+    [{"bind_context": False}, {}, {"bind_route": True}],
+    ids=["unbound", "default", "bind-route"],
+)
+def test_many_routes_throughput(latency_benchmark, run_async, options):
+    app = build_routed_app(**options)
+    path = f"/resources{ROUTE_COUNT - 1}/1"
+
+    sent = latency_benchmark(lambda: run_async(send_request(app, path=path)))
+
+    assert sent[0]["status"] == 200
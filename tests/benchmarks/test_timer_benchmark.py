@@ -0,0 +1,57 @@
+import logging
+
+import pytest
+import structlog
+
+import servicetools.timer as under_test
+
+
+@pytest.fixture
+def logger():
+    stdlib_logger = logging.getLogger("benchmark.timer")
+    stdlib_logger.handlers = [logging.NullHandler()]
+    stdlib_logger.propagate = False
+    stdlib_logger.setLevel(logging.INFO)
+    return structlog.wrap_logger(
+        stdlib_logger,
+        processors=[structlog.stdlib.filter_by_level, structlog.stdlib.render_to_log_kwargs],
+        wrapper_class=structlog.stdlib.BoundLogger,
+    ).bind()
+
+
+def add(a, b):
+    return a + b
+
+
+@pytest.mark.benchmark(group="timer-overhead")
+def test_undecorated(benchmark):
+    assert benchmark(add, 1, 2) == 3
+
+
+@pytest.mark.benchmark(group="timer-overhead")
+@pytest.mark.parametrize("level", [logging.INFO, logging.DEBUG], ids=["enabled", "disabled"])
+def test_timer(benchmark, logger, level):
+    timed_add = under_test.timer(logger, level=level)(add)
+
+    assert benchmark(timed_add, 1, 2) == 3
+
+
+@pytest.mark.benchmark(group="timer-overhead")
+def test_timer_with_details(benchmark, logger):
+    timed_add = under_test.timer(logger, details=True)(add)
+
+    assert benchmark(timed_add, 1, 2) == 3
+
+
+@pytest.mark.benchmark(group="timer-overhead")
+def test_sampled_timer(benchmark, logger):
+    timed_add = under_test.timer(logger, sample_every=100)(add)
+
+    assert benchmark(timed_add, 1, 2) == 3
+
+
+@pytest.mark.benchmark(group="timer-overhead")
+def test_aggregated_timer(benchmark, logger):
+    timed_add = under_test.timer(logger, aggregate=True)(add)
+
+    assert benchmark(timed_add, 1, 2) == 3
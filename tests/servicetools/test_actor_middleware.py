@@ -0,0 +1,151 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import dramatiq
+import pytest
+from dramatiq.brokers.stub import StubBroker
+from dramatiq.common import current_millis
+from dramatiq.message import Message
+from dramatiq.worker import Worker
+from structlog.contextvars import bind_contextvars, clear_contextvars, get_contextvars
+
+import servicetools.actor_middleware as under_test
+
+
+def create_message(**options) -> Message:
+    return Message(
+        queue_name="default", actor_name="fake_actor", args=(), kwargs={}, options=options
+    )
+
+
+class TestLogContextMiddleware:
+    def test_context_is_bound_while_processing(self):
+        clear_contextvars()
+        middleware = under_test.LogContextMiddleware()
+        message = create_message(log_context={"request_id": "fake-request-id"})
+
+        middleware.before_process_message(MagicMock(), message)
+        assert get_contextvars() == {"request_id": "fake-request-id"}
+
+        middleware.after_process_message(MagicMock(), message)
+        assert get_contextvars() == {}
+
+    def test_messages_without_context(self):
+        clear_contextvars()
+        middleware = under_test.LogContextMiddleware()
+
+        middleware.before_process_message(MagicMock(), create_message())
+
+        assert get_contextvars() == {}
+
+    def test_context_is_cleared_for_skipped_messages(self):
+        bind_contextvars(request_id="fake-request-id")
+        middleware = under_test.LogContextMiddleware()
+
+        middleware.after_skip_message(MagicMock(), create_message())
+
+        assert get_contextvars() == {}
+
+
+class TestActorMetrics:
+    def test_messages_are_timed_by_actor(self):
+        metrics = under_test.ActorMetrics()
+        message = create_message().copy(message_timestamp=current_millis() - 2000)
+
+        metrics.before_process_message(MagicMock(), message)
+        metrics.after_process_message(MagicMock(), message, result=None)
+
+        summary = metrics.summaries()["fake_actor"]
+        assert summary["messages"] == 1
+        assert summary["errors"] == 0
+        assert summary["queue_latency"]["count"] == 1
+        assert 2 <= summary["queue_latency"]["max"] < 3
+        assert summary["duration"]["count"] == 1
+
+    def test_queue_latency_starts_after_delays(self):
+        metrics = under_test.ActorMetrics()
+        message = create_message(eta=current_millis() + 60000).copy(
+            message_timestamp=current_millis() - 120000
+        )
+
+        metrics.before_process_message(MagicMock(), message)
+        metrics.after_process_message(MagicMock(), message)
+
+        assert metrics.summaries()["fake_actor"]["queue_latency"]["max"] == 0
+
+    def test_errors_and_retries_are_counted(self):
+        metrics = under_test.ActorMetrics()
+        message = create_message(retries=1)
+
+        metrics.before_process_message(MagicMock(), message)
+        metrics.after_process_message(MagicMock(), message, exception=ValueError("error"))
+
+        summary = metrics.summaries()["fake_actor"]
+        assert summary["errors"] == 1
+        assert summary["retries"] == 1
+
+    def test_skipped_messages_are_not_counted(self):
+        metrics = under_test.ActorMetrics()
+        message = create_message()
+
+        metrics.before_process_message(MagicMock(), message)
+        metrics.after_skip_message(MagicMock(), message)
+
+        assert metrics.summaries() == {}
+        assert metrics._start_times == {}
+
+    def test_summaries_are_logged(self):
+        logger = MagicMock()
+        metrics = under_test.ActorMetrics(logger=logger, summary_interval=0)
+        message = create_message()
+
+        metrics.before_process_message(MagicMock(), message)
+        metrics.after_process_message(MagicMock(), message)
+
+        logger.log.assert_called_once()
+        assert logger.log.call_args[0][1] == "actor summary"
+        assert logger.log.call_args[1]["actor_name"] == "fake_actor"
+
+    def test_summaries_are_not_logged_by_default(self):
+        logger = MagicMock()
+        metrics = under_test.ActorMetrics(logger=logger)
+        message = create_message()
+
+        metrics.before_process_message(MagicMock(), message)
+        metrics.after_process_message(MagicMock(), message)
+
+        logger.log.assert_not_called()
+
+    def test_metrics_are_recorded_by_a_worker(self):
+        broker = StubBroker()
+        metrics = under_test.ActorMetrics()
+        broker.add_middleware(metrics)
+
+        @dramatiq.actor(broker=broker, max_retries=0)
+        def fake_actor(fail):
+            if fail:
+                raise ValueError("error")
+
+        worker = Worker(broker, worker_timeout=100)
+        worker.start()
+        try:
+            fake_actor.send(False)
+            fake_actor.send(True)
+            broker.join(fake_actor.queue_name, fail_fast=False)
+            worker.join()
+        finally:
+            worker.stop()
+
+        lines = metrics.render().splitlines()
+        assert 'dramatiq_messages_total{actor_name="fake_actor"} 2' in lines
+        assert 'dramatiq_message_errors_total{actor_name="fake_actor"} 1' in lines
+        assert "# TYPE dramatiq_message_queue_latency_seconds summary" in lines
+        assert 'dramatiq_message_duration_seconds_count{actor_name="fake_actor"} 2' in lines
+
+    @pytest.mark.asyncio
+    async def test_metrics_are_served(self):
+        metrics = under_test.ActorMetrics()
+        send = AsyncMock()
+
+        await metrics({"type": "http"}, None, send)
+
+        assert send.call_args_list[1][0][0]["body"] == metrics.render().encode()
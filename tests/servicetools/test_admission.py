@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+
+import servicetools.admission as under_test
+
+
+class TestEventLoopLagMonitor:
+    @pytest.mark.asyncio
+    async def test_blocked_loop_is_measured(self):
+        monitor = under_test.EventLoopLagMonitor(interval=0.01)
+        monitor.start()
+        await asyncio.sleep(0)
+
+        time.sleep(0.1)
+        for _ in range(3):
+            await asyncio.sleep(0)
+        monitor.stop()
+
+        assert monitor.lag >= 0.05
+
+    @pytest.mark.asyncio
+    async def test_monitor_is_started_once(self):
+        monitor = under_test.EventLoopLagMonitor()
+
+        monitor.start()
+        task = monitor._task
+        monitor.start()
+
+        assert monitor._task is task
+        monitor.stop()
+        await asyncio.sleep(0)
+        assert task.cancelled()
+
+
+class TestAdmissionControl:
+    def test_requests_over_the_limit_are_shed(self):
+        admission = under_test.AdmissionControl(max_in_flight=2)
+
+        assert admission.admit("/a") is None
+        assert admission.admit("/b") is None
+        assert admission.admit("/a") == under_test.SHED_IN_FLIGHT
+        admission.release("/a")
+
+        assert admission.admit("/a") is None
+        assert admission.in_flight == 2
+        assert admission.route_in_flight == {"/a": 1, "/b": 1}
+        assert admission.shed[under_test.SHED_IN_FLIGHT] == 1
+
+    def test_routes_over_their_limit_are_shed(self):
+        admission = under_test.AdmissionControl(max_route_in_flight={"/slow": 1})
+
+        assert admission.admit("/slow") is None
+        assert admission.admit("/slow") == under_test.SHED_ROUTE_IN_FLIGHT
+        assert admission.admit("/fast") is None
+
+    @pytest.mark.asyncio
+    async def test_requests_are_shed_while_the_loop_lags(self):
+        admission = under_test.AdmissionControl(max_loop_lag=0.5)
+
+        assert admission.admit("/") is None
+        admission.lag_monitor.lag = 1.0
+
+        assert admission.admit("/") == under_test.SHED_LOOP_LAG
+        assert admission.loop_lag == 1.0
+        admission.lag_monitor.stop()
+
+    def test_loop_lag_is_not_measured_by_default(self):
+        admission = under_test.AdmissionControl()
+
+        assert admission.lag_monitor is None
+        assert admission.loop_lag is None
+
+    @pytest.mark.asyncio
+    async def test_metrics_are_served(self):
+        admission = under_test.AdmissionControl(max_in_flight=1, monitor_loop_lag=True)
+        admission.admit("/users/{user_id}")
+        admission.admit("/users/{user_id}")
+        admission.lag_monitor.stop()
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await admission({"type": "http"}, None, send)
+
+        lines = sent[1]["body"].decode().splitlines()
+        assert "# TYPE http_requests_in_flight gauge" in lines
+        assert 'http_requests_in_flight{route="/users/{user_id}"} 1' in lines
+        assert "http_requests_in_flight_global 1" in lines
+        assert 'http_requests_shed_total{reason="in_flight"} 1' in lines
+        assert "http_event_loop_lag_seconds 0.0" in lines
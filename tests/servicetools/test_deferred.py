@@ -0,0 +1,49 @@
+from unittest.mock import MagicMock
+
+import servicetools.deferred as under_test
+
+
+class TestDeferred:
+    def test_value_is_computed_once(self):
+        fn = MagicMock(return_value=[1, 2])
+        deferred = under_test.Deferred(fn, "arg")
+
+        assert deferred.resolve() == [1, 2]
+        assert str(deferred) == "[1, 2]"
+        assert repr(deferred) == "[1, 2]"
+        fn.assert_called_once_with("arg")
+
+    def test_value_is_not_computed_until_needed(self):
+        fn = MagicMock()
+
+        under_test.Deferred(fn)
+
+        fn.assert_not_called()
+
+    def test_representations_are_not_quoted(self):
+        deferred = under_test.deferred_repr((1, "two"))
+
+        assert repr({"args": deferred}) == "{'args': (1, 'two')}"
+
+
+class TestTruncatedRepr:
+    def test_small_values_are_unchanged(self):
+        assert under_test.truncated_repr({"a": [1, 2]}) == "{'a': [1, 2]}"
+
+    def test_long_strings_are_truncated(self):
+        representation = under_test.truncated_repr("a" * 100000, limit=20)
+
+        assert len(representation) <= 20
+        assert "..." in representation
+
+    def test_long_bytes_are_truncated(self):
+        representation = under_test.truncated_repr(b"a" * 100000, limit=20)
+
+        assert len(representation) <= 20
+        assert representation.startswith("b'a")
+
+    def test_large_containers_are_truncated(self):
+        representation = under_test.truncated_repr([list(range(1000))] * 1000, limit=100)
+
+        assert len(representation) <= 100
+        assert representation.endswith("...")
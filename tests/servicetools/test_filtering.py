@@ -0,0 +1,65 @@
+import logging
+
+import pytest
+from structlog.testing import LogCapture
+
+import servicetools.filtering as under_test
+
+
+@pytest.fixture
+def stdlib_logger():
+    logger = logging.getLogger("test_filtering")
+    logger.setLevel(logging.INFO)
+    under_test.reset_level_cache()
+    yield logger
+    logger.setLevel(logging.NOTSET)
+    under_test.reset_level_cache()
+
+
+def create_logger(stdlib_logger, log_capture):
+    return under_test.LevelFilteringBoundLogger(stdlib_logger, [log_capture], {})
+
+
+class TestLevelFilteringBoundLogger:
+    def test_disabled_levels_are_dropped(self, stdlib_logger):
+        log_capture = LogCapture()
+        logger = create_logger(stdlib_logger, log_capture)
+
+        logger.debug("dropped")
+        logger.info("kept", value=1)
+
+        assert log_capture.entries == [{"event": "kept", "value": 1, "log_level": "info"}]
+
+    def test_bound_loggers_are_filtered(self, stdlib_logger):
+        log_capture = LogCapture()
+        logger = create_logger(stdlib_logger, log_capture).bind(value=1)
+
+        logger.debug("dropped")
+
+        assert "debug" in logger.__dict__
+        assert log_capture.entries == []
+
+    def test_levels_are_looked_up_again_after_a_reset(self, stdlib_logger):
+        log_capture = LogCapture()
+        logger = create_logger(stdlib_logger, log_capture)
+        logger.debug("dropped")
+
+        stdlib_logger.setLevel(logging.DEBUG)
+        under_test.reset_level_cache()
+        logger.debug("kept")
+
+        assert log_capture.entries == [{"event": "kept", "log_level": "debug"}]
+        assert "debug" not in logger.__dict__
+
+    def test_levels_are_cached_per_logger_name(self, stdlib_logger):
+        assert under_test.disabled_methods(stdlib_logger) == ("debug",)
+
+        stdlib_logger.setLevel(logging.ERROR)
+
+        assert under_test.disabled_methods(stdlib_logger) == ("debug",)
+
+    def test_other_loggers_are_not_filtered(self):
+        log_capture = LogCapture()
+        logger = under_test.LevelFilteringBoundLogger(None, [log_capture], {})
+
+        assert "debug" not in logger.__dict__
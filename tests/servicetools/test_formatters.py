@@ -0,0 +1,107 @@
+from datetime import datetime
+import json
+import logging
+import sys
+from unittest.mock import patch
+
+import pytest
+
+import servicetools.formatters as under_test
+from servicetools.deferred import Deferred
+
+
+def create_record(msg, args=(), exc_info=None, **extra) -> logging.LogRecord:
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, msg, args, exc_info)
+    record.__dict__.update(extra)
+    return record
+
+
+class TestJsonDumps:
+    def test_orjson_is_used_when_installed(self):
+        assert under_test.json_dumps({"a": 1, 2: "b"}) == '{"a":1,"2":"b"}'
+
+    @patch("servicetools.formatters.orjson", None)
+    def test_stdlib_is_used_without_orjson(self):
+        assert under_test.json_dumps({"a": 1, 2: "b"}) == '{"a": 1, "2": "b"}'
+
+    def test_falls_back_to_stdlib_for_unsupported_values(self):
+        assert json.loads(under_test.json_dumps({"a": 2**70})) == {"a": 2**70}
+
+    @patch("servicetools.formatters.orjson", None)
+    def test_unknown_objects_are_serialized(self):
+        value = {"when": datetime(2020, 1, 2, 3, 4, 5), "what": b"bytes", "set": {1}}
+
+        assert json.loads(under_test.json_dumps(value)) == {
+            "when": "2020-01-02T03:04:05",
+            "what": "b'bytes'",
+            "set": "{1}",
+        }
+
+    @patch("servicetools.formatters.orjson", None)
+    def test_tracebacks_are_serialized(self):
+        try:
+            raise ValueError("error")
+        except ValueError:
+            trace = sys.exc_info()[2]
+
+        assert "raise ValueError" in json.loads(under_test.json_dumps({"trace": trace}))["trace"]
+
+    @pytest.mark.parametrize("encoder", ["orjson", "stdlib"])
+    def test_deferred_values_are_resolved(self, encoder):
+        value = {"deferred": Deferred(lambda: {"nested": b"bytes"})}
+
+        if encoder == "orjson":
+            serialized = under_test.json_dumps(value)
+        else:
+            with patch("servicetools.formatters.orjson", None):
+                serialized = under_test.json_dumps(value)
+
+        assert json.loads(serialized) == {"deferred": {"nested": "b'bytes'"}}
+
+
+class TestJsonFormatter:
+    def test_structlog_event_dicts(self):
+        event_dict = {"event": "hello", "a": 1, "logger": "test", "level": "info"}
+        record = create_record(event_dict, _logger=None, _name="info")
+
+        formatted = under_test.JsonFormatter().format(record)
+
+        assert list(json.loads(formatted).items()) == [
+            ("message", "hello"),
+            ("a", 1),
+            ("logger", "test"),
+            ("level", "info"),
+        ]
+        assert event_dict["event"] == "hello"
+
+    def test_structlog_exceptions_are_written_as_exc_info(self):
+        event_dict = {"event": "failed", "level": "error", "exception": "Traceback"}
+        record = create_record(event_dict, _logger=None, _name="error")
+
+        formatted = under_test.JsonFormatter().format(record)
+
+        assert list(json.loads(formatted).items()) == [
+            ("message", "failed"),
+            ("exc_info", "Traceback"),
+            ("level", "error"),
+            ("exception", "Traceback"),
+        ]
+
+    def test_stdlib_records(self):
+        record = create_record("hello %s", ("world",), some_extra="extra")
+
+        formatted = under_test.JsonFormatter().format(record)
+
+        assert json.loads(formatted) == {"message": "hello world", "some_extra": "extra"}
+
+    def test_stdlib_records_with_exceptions(self):
+        try:
+            raise ValueError("error")
+        except ValueError:
+            record = create_record("failed", exc_info=sys.exc_info())
+        record.stack_info = "Stack (most recent call last):"
+
+        formatted = json.loads(under_test.JsonFormatter().format(record))
+
+        assert "ValueError: error" in formatted["exc_info"]
+        assert formatted["stack_info"] == "Stack (most recent call last):"
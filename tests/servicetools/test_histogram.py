@@ -0,0 +1,71 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import servicetools.histogram as under_test
+
+
+class TestLatencyHistogram:
+    def test_empty_histogram(self):
+        histogram = under_test.LatencyHistogram()
+
+        assert histogram.percentiles() == {}
+        assert histogram.summary() == {"count": 0, "min": None, "max": None}
+
+    def test_percentiles_are_accurate(self):
+        histogram = under_test.LatencyHistogram()
+        durations = [random.uniform(0, 2) for _ in range(10000)]
+        for duration in durations:
+            histogram.record(duration)
+        durations.sort()
+
+        percentiles = histogram.percentiles((50, 90, 99))
+
+        for percentile, value in percentiles.items():
+            expected = durations[int(len(durations) * percentile / 100) - 1]
+            assert abs(value - expected) / expected < 0.02
+
+    def test_summary(self):
+        histogram = under_test.LatencyHistogram()
+        for duration in (0.001, 0.002, 0.003, 0.004):
+            histogram.record(duration)
+
+        summary = histogram.summary()
+
+        assert summary["count"] == 4
+        assert summary["min"] == 0.001
+        assert summary["max"] == 0.004
+        assert abs(summary["p50"] - 0.002) / 0.002 < 0.01
+        assert summary["p99"] == 0.004
+        assert abs(histogram.total - 0.01) < 1e-9
+
+    def test_memory_is_bounded(self):
+        histogram = under_test.LatencyHistogram()
+
+        for microseconds in range(0, 3_600_000_000, 99_991):
+            histogram.record(microseconds / 1_000_000)
+
+        assert len(histogram._counts) < 2000
+
+    def test_buckets_cover_their_bounds(self):
+        histogram = under_test.LatencyHistogram()
+
+        for bucket in range(2000):
+            low, high = histogram._bucket_bounds(bucket)
+            assert histogram._bucket(low) == bucket
+            assert histogram._bucket(high) == bucket
+
+    def test_concurrent_records(self):
+        histogram = under_test.LatencyHistogram()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(histogram.record, [0.001] * 10000))
+
+        assert histogram.count == 10000
+
+    def test_reset(self):
+        histogram = under_test.LatencyHistogram()
+        histogram.record(1)
+
+        histogram.reset()
+
+        assert histogram.summary() == {"count": 0, "min": None, "max": None}
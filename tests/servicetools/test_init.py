@@ -0,0 +1,39 @@
+import sys
+from unittest.mock import patch
+
+import pytest
+
+import servicetools as under_test
+from servicetools.middleware import StructlogRequestMiddleware
+
+
+class TestLazyAttributes:
+    def test_attributes_are_imported_when_used(self):
+        assert under_test.StructlogRequestMiddleware is StructlogRequestMiddleware
+
+    def test_unknown_attributes(self):
+        with pytest.raises(AttributeError):
+            under_test.not_an_attribute
+
+    def test_missing_extras_are_reported(self):
+        under_test.__dict__.pop("LazyActor", None)
+        dramatiq = {name: None for name in sys.modules if name.split(".")[0] == "dramatiq"}
+
+        with patch.dict(sys.modules, {**dramatiq, "dramatiq": None}):
+            sys.modules.pop("servicetools.lazyactor", None)
+            with pytest.raises(ImportError, match="python-service-tools\\[dramatiq\\]"):
+                under_test.LazyActor
+
+    def test_missing_internal_modules_are_raised(self):
+        under_test.__dict__.pop("LazyActor", None)
+
+        with patch.dict(sys.modules, {"servicetools.lazyactor": None}):
+            with pytest.raises(ModuleNotFoundError, match="servicetools.lazyactor"):
+                under_test.LazyActor
+
+    def test_missing_modules_without_extras_are_raised(self):
+        under_test.__dict__.pop("Timing", None)
+
+        with patch.dict(sys.modules, {"servicetools.timer": None}):
+            with pytest.raises(ModuleNotFoundError):
+                under_test.Timing
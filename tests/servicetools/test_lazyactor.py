@@ -1,7 +1,16 @@
 from unittest.mock import MagicMock
 
 import dramatiq
+import pika
+import pytest
+from dramatiq.brokers.rabbitmq import RabbitmqBroker
+from dramatiq.brokers.stub import StubBroker
+from dramatiq.errors import ConnectionClosed
+from dramatiq.worker import Worker
+from structlog.contextvars import bound_contextvars, clear_contextvars
+
 import servicetools.lazyactor as under_test
+from servicetools.memoize import MemoryStore
 
 
 @dramatiq.actor(actor_class=under_test.LazyActor)
@@ -9,6 +18,41 @@ def test_func(fake: str) -> None:
     pass
 
 
+@dramatiq.actor(actor_class=under_test.LazyActor, queue_name="batched")
+def batched_func(value: int) -> None:
+    pass
+
+
+memoized_calls = []
+
+
+@under_test.memoized(dedup_window=60, result_ttl=60, store=MemoryStore())
+@dramatiq.actor(actor_class=under_test.LazyActor, queue_name="memoized")
+def memoized_func(value: int) -> int:
+    memoized_calls.append(value)
+    return value * 2
+
+
+@pytest.fixture
+def stub_broker():
+    broker = StubBroker()
+    broker.emit_after("process_boot")
+    batched_func.init_actor(broker)
+    memoized_func.init_actor(broker)
+    memoized_func.memoize(dedup_window=60, result_ttl=60, store=MemoryStore())
+    yield broker
+    broker.close()
+
+
+@pytest.fixture
+def rabbitmq_broker():
+    broker = MagicMock(spec=RabbitmqBroker, actors={}, connection=MagicMock())
+    channel = broker.connection.channel.return_value
+    channel.is_open = True
+    batched_func.init_actor(broker)
+    return broker
+
+
 class TestLazyActors:
     def test_broker_is_not_set(self):
         assert not getattr(test_func, "broker", None)
@@ -17,3 +61,231 @@ class TestLazyActors:
         mock_broker = MagicMock()
         test_func.init_actor(mock_broker)
         assert test_func.broker
+
+    def test_send_many(self, stub_broker):
+        messages = batched_func.send_many([(i,) for i in range(25)], batch_size=10)
+
+        assert len(messages) == 25
+        assert stub_broker.queues["batched"].qsize() == 25
+        assert [message.args for message in messages] == [(i,) for i in range(25)]
+
+    def test_log_context_is_added_to_messages(self, stub_broker):
+        clear_contextvars()
+        with bound_contextvars(request_id="fake-request-id"):
+            message = batched_func.send(1)
+
+        assert message.options["log_context"] == {"request_id": "fake-request-id"}
+
+    def test_log_context_is_not_added_when_empty(self, stub_broker):
+        clear_contextvars()
+
+        message = batched_func.send(1)
+
+        assert "log_context" not in message.options
+
+    def test_explicit_log_context_is_kept(self, stub_broker):
+        with bound_contextvars(request_id="fake-request-id"):
+            message = batched_func.send_with_options(args=(1,), log_context={"job": "fake-job"})
+
+        assert message.options["log_context"] == {"job": "fake-job"}
+
+
+class TestMemoizedActors:
+    def test_duplicate_messages_are_not_sent(self, stub_broker):
+        first = memoized_func.send(1)
+        duplicate = memoized_func.send_with_options(args=(1,))
+        other = memoized_func.send(2)
+
+        assert duplicate == first
+        assert other != first
+        assert stub_broker.queues["memoized"].qsize() == 2
+
+    def test_duplicate_messages_are_not_batched(self, stub_broker):
+        with memoized_func.batch() as batch:
+            first = batch.send(1)
+            duplicate = batch.send(1)
+
+        assert duplicate == first
+        assert batch.messages == [first]
+        assert stub_broker.queues["memoized"].qsize() == 1
+
+    def test_messages_that_failed_to_enqueue_are_sent_again(self, stub_broker):
+        enqueue = stub_broker.enqueue
+        stub_broker.enqueue = MagicMock(side_effect=ConnectionClosed(None))
+
+        with pytest.raises(ConnectionClosed):
+            memoized_func.send(1)
+        stub_broker.enqueue = enqueue
+        memoized_func.send(1)
+
+        assert stub_broker.queues["memoized"].qsize() == 1
+
+    def test_batched_messages_that_failed_to_publish_are_sent_again(self, stub_broker):
+        enqueue = stub_broker.enqueue
+        stub_broker.enqueue = MagicMock(side_effect=ConnectionClosed(None))
+
+        with pytest.raises(ConnectionClosed):
+            with memoized_func.batch() as batch:
+                batch.send(1)
+        stub_broker.enqueue = enqueue
+        with memoized_func.batch() as batch:
+            batch.send(1)
+
+        assert stub_broker.queues["memoized"].qsize() == 1
+
+    def test_rabbitmq_batches_that_failed_to_publish_are_sent_again(self, rabbitmq_broker):
+        channel = rabbitmq_broker.connection.channel.return_value
+        channel.tx_commit.side_effect = pika.exceptions.AMQPConnectionError()
+        memoized_func.init_actor(rabbitmq_broker)
+        memoized_func.memoize(dedup_window=60, store=MemoryStore())
+
+        with pytest.raises(ConnectionClosed):
+            with memoized_func.batch() as batch:
+                batch.send(1)
+
+        assert memoized_func.sent_duplicate(batch.messages[0]) is None
+
+    def test_duplicates_are_sent_after_the_window(self, stub_broker):
+        memoized_func.memoize(dedup_window=0)
+
+        memoized_func.send(1)
+        memoized_func.send(1)
+
+        assert stub_broker.queues["memoized"].qsize() == 2
+
+    def test_results_are_memoized(self, stub_broker):
+        memoized_calls.clear()
+
+        assert memoized_func(3) == 6
+        assert memoized_func(value=3) != memoized_func(4)
+        assert memoized_func(3) == 6
+
+        assert memoized_calls == [3, 3, 4]
+
+    def test_processed_duplicates_use_the_memoized_result(self, stub_broker):
+        memoized_calls.clear()
+        memoized_func.memoize(dedup_window=0, result_ttl=60)
+        memoized_func.send(5)
+        memoized_func.send(5)
+
+        worker = Worker(stub_broker, worker_timeout=100)
+        worker.start()
+        try:
+            stub_broker.join("memoized")
+            worker.join()
+        finally:
+            worker.stop()
+
+        assert memoized_calls == [5]
+
+    def test_actors_are_not_memoized_by_default(self, stub_broker):
+        batched_func.send(1)
+        batched_func.send(1)
+
+        assert stub_broker.queues["batched"].qsize() == 2
+
+
+class TestInitAll:
+    def test_actors_are_registered(self):
+        assert test_func in under_test.registered_actors()
+        assert batched_func in under_test.registered_actors()
+
+    def test_all_actors_are_initialized(self):
+        broker = StubBroker()
+
+        under_test.init_all(broker)
+
+        assert test_func.broker is broker
+        assert batched_func.broker is broker
+        assert {"default", "batched"} <= broker.get_declared_queues()
+
+    def test_initialized_actors_are_skipped(self):
+        broker = StubBroker()
+        under_test.init_all(broker, actors=[test_func])
+
+        under_test.init_all(broker, actors=[test_func])
+
+        assert broker.actors["test_func"] is test_func
+
+    @pytest.mark.parametrize("concurrency", [1, 4])
+    def test_queues_are_declared_once(self, rabbitmq_broker, concurrency):
+        actors = [test_func, batched_func]
+        for i in range(3):
+            actors.append(
+                dramatiq.actor(
+                    lambda: None,
+                    actor_class=under_test.LazyActor,
+                    actor_name=f"init_all_{i}",
+                    queue_name="batched",
+                )
+            )
+
+        under_test.init_all(
+            rabbitmq_broker, actors=actors, declare_queues=True, concurrency=concurrency
+        )
+
+        assert all(actor.broker is rabbitmq_broker for actor in actors)
+        assert sorted(call.args[0] for call in rabbitmq_broker.declare_queue.call_args_list) == [
+            "batched",
+            "default",
+        ]
+
+
+class TestMessageBatch:
+    def test_messages_are_held_until_batch_is_full(self, stub_broker):
+        with batched_func.batch(batch_size=3) as batch:
+            batch.send(1)
+            batch.send(2)
+            assert stub_broker.queues["batched"].qsize() == 0
+
+            batch.send(3)
+            assert stub_broker.queues["batched"].qsize() == 3
+
+            batch.send(4)
+
+        assert stub_broker.queues["batched"].qsize() == 4
+
+    def test_messages_are_flushed_after_interval(self, stub_broker):
+        with batched_func.batch(flush_interval=0) as batch:
+            batch.send(1)
+            assert stub_broker.queues["batched"].qsize() == 1
+
+    def test_delayed_messages(self, stub_broker):
+        with batched_func.batch() as batch:
+            batch.send_with_options(args=(1,), delay=10_000)
+
+        assert stub_broker.queues["batched"].qsize() == 0
+        assert stub_broker.queues["batched.DQ"].qsize() == 1
+
+    def test_rabbitmq_batches_are_published_in_transactions(self, rabbitmq_broker):
+        channel = rabbitmq_broker.connection.channel.return_value
+
+        batched_func.send_many([(i,) for i in range(5)], batch_size=2)
+
+        rabbitmq_broker.connection.channel.assert_called_once()
+        channel.tx_select.assert_called_once()
+        assert channel.basic_publish.call_count == 5
+        assert channel.tx_commit.call_count == 3
+        assert rabbitmq_broker.emit_after.call_count == 5
+        rabbitmq_broker.declare_queue.assert_called_with("batched", ensure=True)
+        channel.close.assert_called_once()
+
+    def test_rabbitmq_delayed_messages(self, rabbitmq_broker):
+        channel = rabbitmq_broker.connection.channel.return_value
+
+        with batched_func.batch() as batch:
+            batch.send_with_options(args=(1,), delay=10_000)
+
+        assert channel.basic_publish.call_args[1]["routing_key"] == "batched.DQ"
+        message = rabbitmq_broker.emit_after.call_args[0][1]
+        assert "eta" in message.options
+
+    def test_rabbitmq_connection_errors(self, rabbitmq_broker):
+        channel = rabbitmq_broker.connection.channel.return_value
+        channel.tx_commit.side_effect = pika.exceptions.AMQPConnectionError()
+
+        with pytest.raises(ConnectionClosed):
+            with batched_func.batch() as batch:
+                batch.send(1)
+
+        rabbitmq_broker.emit_after.assert_not_called()
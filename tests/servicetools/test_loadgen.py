@@ -0,0 +1,197 @@
+import asyncio
+import io
+import logging
+
+import pytest
+import structlog
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from servicetools.middleware import StructlogRequestMiddleware
+import servicetools.testing.loadgen as under_test
+
+
+@pytest.fixture
+def log_handler():
+    logger = logging.getLogger("test_loadgen")
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    yield handler
+    logger.removeHandler(handler)
+    logger.setLevel(logging.NOTSET)
+
+
+def create_app():
+    logger = structlog.wrap_logger(
+        logging.getLogger("test_loadgen"),
+        wrapper_class=structlog.stdlib.BoundLogger,
+        processors=[structlog.processors.KeyValueRenderer()],
+    )
+    return StructlogRequestMiddleware(under_test.simulated_app(), logger=logger)
+
+
+class TestRequestSpec:
+    def test_scope(self):
+        request = under_test.RequestSpec(
+            "POST", "/items?limit=1", body_size=10, headers={"X-Tenant": "a"}
+        )
+
+        scope = request.scope(error=False)
+
+        assert scope["method"] == "POST"
+        assert scope["path"] == "/items"
+        assert scope["query_string"] == b"limit=1"
+        assert scope["headers"] == [(b"x-tenant", b"a"), (b"content-length", b"10")]
+
+    def test_error_header(self):
+        scope = under_test.RequestSpec().scope(error=True)
+
+        assert (b"x-loadgen-error", b"1") in scope["headers"]
+
+
+class TestLoadGenerator:
+    def test_requests_are_sent(self):
+        mix = [
+            under_test.RequestSpec("GET", "/ok"),
+            under_test.RequestSpec("GET", "/failing", error_rate=1.0),
+        ]
+        generator = under_test.LoadGenerator(under_test.simulated_app(), mix, seed=1)
+
+        report = generator.run_sync(requests=100)
+
+        assert report.requests == 100
+        assert report.status_codes[200] + report.status_codes[500] == 100
+        assert report.status_codes[500] > 0
+        assert report.throughput > 0
+        assert report.summary()["latency"]["count"] == 100
+
+    def test_runs_are_reproducible(self):
+        mix = [under_test.RequestSpec("GET", "/", error_rate=0.5)]
+
+        def run():
+            generator = under_test.LoadGenerator(under_test.simulated_app(), mix, seed=1)
+            return generator.run_sync(requests=50).status_codes
+
+        assert run() == run()
+
+    def test_concurrency_is_limited(self):
+        in_flight = []
+        app = under_test.simulated_app(latency=0.001)
+
+        async def counting_app(scope, receive, send):
+            in_flight.append(1)
+            await app(scope, receive, send)
+            in_flight.pop()
+            concurrency.append(len(in_flight))
+
+        concurrency = []
+        generator = under_test.LoadGenerator(
+            counting_app, [under_test.RequestSpec()], concurrency=5
+        )
+
+        generator.run_sync(requests=50)
+
+        assert max(concurrency) == 4
+
+    def test_large_bodies_are_sent_in_chunks(self):
+        bodies = []
+
+        async def app(scope, receive, send):
+            chunks = []
+            more_body = True
+            while more_body:
+                message = await receive()
+                chunks.append(message["body"])
+                more_body = message["more_body"]
+            bodies.append(chunks)
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        request = under_test.RequestSpec("POST", body_size=under_test.BODY_CHUNK_SIZE + 1)
+        under_test.LoadGenerator(app, [request]).run_sync(requests=1)
+
+        assert [len(chunk) for chunk in bodies[0]] == [under_test.BODY_CHUNK_SIZE, 1]
+
+    def test_exceptions_are_counted(self):
+        mix = [under_test.RequestSpec(error_rate=1.0)]
+        app = under_test.simulated_app(raise_errors=True)
+
+        report = under_test.LoadGenerator(app, mix).run_sync(requests=10)
+
+        assert report.exceptions == 10
+        assert report.status_codes == {}
+
+    def test_requests_are_sent_for_a_duration(self):
+        app = under_test.simulated_app(latency=0.001)
+
+        report = under_test.LoadGenerator(app, [under_test.RequestSpec()]).run_sync(duration=0.05)
+
+        assert report.requests > 0
+        assert report.seconds >= 0.05
+
+    def test_requests_or_duration_is_required(self):
+        generator = under_test.LoadGenerator(under_test.simulated_app(), [under_test.RequestSpec()])
+
+        with pytest.raises(ValueError):
+            generator.run_sync()
+
+    def test_log_bytes_are_counted(self, log_handler):
+        app = create_app()
+        original_stream = log_handler.stream
+
+        report = under_test.LoadGenerator(app, [under_test.RequestSpec()]).run_sync(requests=10)
+
+        assert report.log_bytes > 0
+        assert report.summary()["log_bytes_per_request"] == report.log_bytes / 10
+        assert log_handler.stream is original_stream
+        assert original_stream.getvalue() == ""
+
+    def test_logs_can_be_kept(self, log_handler):
+        app = create_app()
+        generator = under_test.LoadGenerator(
+            app, [under_test.RequestSpec()], discard_logs=False, log_handlers=[log_handler]
+        )
+
+        report = generator.run_sync(requests=1)
+
+        assert report.log_bytes > 0
+        assert len(log_handler.stream.getvalue().encode()) == report.log_bytes
+
+    def test_peak_memory_is_traced(self):
+        generator = under_test.LoadGenerator(
+            under_test.simulated_app(response_size=1024),
+            [under_test.RequestSpec()],
+            trace_memory=True,
+        )
+
+        report = generator.run_sync(requests=10)
+
+        assert report.peak_memory > 0
+        assert (
+            under_test.LoadGenerator(under_test.simulated_app(), [under_test.RequestSpec()])
+            .run_sync(requests=1)
+            .peak_memory
+            is None
+        )
+
+    def test_starlette_applications_are_driven(self):
+        async def items(request):
+            return PlainTextResponse("items")
+
+        async def stream(request):
+            async def chunks():
+                for chunk in ("a", "b"):
+                    await asyncio.sleep(0)
+                    yield chunk
+
+            return StreamingResponse(chunks())
+
+        app = Starlette(routes=[Route("/items", items), Route("/stream", stream)])
+        mix = [under_test.RequestSpec("GET", "/items"), under_test.RequestSpec("GET", "/stream")]
+
+        report = under_test.LoadGenerator(app, mix, seed=1).run_sync(requests=20)
+
+        assert report.status_codes == {200: 20}
@@ -0,0 +1,120 @@
+import io
+import logging
+import multiprocessing
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+import servicetools.log_aggregator as under_test
+
+
+def create_record(msg: str) -> logging.LogRecord:
+    return logging.LogRecord("test", logging.INFO, __file__, 1, msg, None, None)
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / "logs.sock")
+
+
+def log_from_child(handler: under_test.AggregatorHandler, count: int) -> None:
+    for i in range(count):
+        handler.handle(create_record(f"message {i} " + "x" * 1000))
+    handler.close()
+
+
+class TestLogAggregator:
+    def test_records_are_written_whole(self, socket_path):
+        stream = io.StringIO()
+        handler = under_test.AggregatorHandler(socket_path)
+
+        with under_test.LogAggregator(socket_path, stream) as aggregator:
+            handler.handle(create_record("first"))
+            handler.handle(create_record("multi\nline"))
+            handler.close()
+
+        assert stream.getvalue() == "first\nmulti\nline\n"
+        assert list(aggregator.metrics().values()) == [{"records": 2, "dropped": 0}]
+
+    def test_records_from_several_processes(self, socket_path):
+        stream = io.StringIO()
+        handler = under_test.AggregatorHandler(socket_path)
+        context = multiprocessing.get_context("fork")
+
+        with under_test.LogAggregator(socket_path, stream) as aggregator:
+            processes = [
+                context.Process(target=log_from_child, args=(handler, 100)) for _ in range(3)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+
+        lines = stream.getvalue().splitlines()
+        assert len(lines) == 300
+        assert all(line.endswith("x" * 1000) for line in lines)
+        metrics = aggregator.metrics()
+        assert sorted(metrics) == sorted(process.pid for process in processes)
+        assert all(metric == {"records": 100, "dropped": 0} for metric in metrics.values())
+
+    def test_dropped_records_are_reported(self, socket_path):
+        stream = io.StringIO()
+        handler = under_test.AggregatorHandler(socket_path)
+
+        handler.handle(create_record("dropped"))
+        assert handler.dropped == 1
+
+        with under_test.LogAggregator(socket_path, stream) as aggregator:
+            handler.handle(create_record("sent"))
+            handler.close()
+
+        assert stream.getvalue() == "sent\n"
+        assert list(aggregator.metrics().values()) == [{"records": 1, "dropped": 1}]
+
+    def test_records_dropped_before_a_fork_are_reported_by_the_parent(self, socket_path):
+        stream = io.StringIO()
+        handler = under_test.AggregatorHandler(socket_path)
+        context = multiprocessing.get_context("fork")
+
+        handler.handle(create_record("dropped"))
+        with under_test.LogAggregator(socket_path, stream) as aggregator:
+            process = context.Process(target=log_from_child, args=(handler, 1))
+            process.start()
+            process.join()
+            handler.handle(create_record("sent"))
+            handler.close()
+
+        metrics = aggregator.metrics()
+        assert metrics[process.pid] == {"records": 1, "dropped": 0}
+        assert metrics[os.getpid()] == {"records": 1, "dropped": 1}
+
+    def test_partial_frames_are_kept_until_complete(self):
+        aggregator = under_test.LogAggregator("unused")
+        frame = under_test.FRAME_HEADER.pack(123, 0, 5) + b"line\n"
+        buffer = bytearray(frame + frame[:7])
+        records = []
+
+        aggregator._read_frames(buffer, records)
+        assert records == [b"line\n"]
+        assert buffer == frame[:7]
+
+        buffer += frame[7:]
+        aggregator._read_frames(buffer, records)
+        assert records == [b"line\n", b"line\n"]
+        assert buffer == b""
+        assert aggregator.metrics() == {123: {"records": 2, "dropped": 0}}
+
+    def test_broken_streams_are_ignored(self, socket_path):
+        stream = MagicMock()
+        stream.write.side_effect = ValueError("I/O operation on closed file")
+        handler = under_test.AggregatorHandler(socket_path)
+
+        with under_test.LogAggregator(socket_path, stream) as aggregator:
+            handler.handle(create_record("message"))
+            handler.close()
+
+        assert list(aggregator.metrics().values()) == [{"records": 1, "dropped": 0}]
+
+    def test_stop_without_start(self):
+        under_test.LogAggregator("unused").stop()
@@ -0,0 +1,172 @@
+import io
+import logging
+from time import monotonic, sleep
+from unittest.mock import MagicMock
+
+import servicetools.log_handlers as under_test
+
+
+def create_record(msg: str, level: int = logging.INFO) -> logging.LogRecord:
+    return logging.LogRecord("test", level, __file__, 1, msg, None, None)
+
+
+class TestBoundedQueueHandler:
+    def test_records_are_queued_without_formatting(self):
+        handler = under_test.BoundedQueueHandler(maxsize=2)
+        record = create_record("message")
+
+        handler.handle(record)
+
+        assert handler.queue.get_nowait() is record
+
+    def test_drop_newest_keeps_queued_records(self):
+        handler = under_test.BoundedQueueHandler(
+            maxsize=1, overflow_policy=under_test.OverflowPolicy.DROP_NEWEST
+        )
+
+        for i in range(3):
+            handler.handle(create_record(f"message {i}"))
+
+        assert handler.queue.get_nowait().msg == "message 0"
+        assert handler.dropped == 2
+
+    def test_drop_oldest_keeps_newest_records(self):
+        handler = under_test.BoundedQueueHandler(
+            maxsize=1, overflow_policy=under_test.OverflowPolicy.DROP_OLDEST
+        )
+
+        for i in range(3):
+            handler.handle(create_record(f"message {i}"))
+
+        assert handler.queue.get_nowait().msg == "message 2"
+        assert handler.dropped == 2
+
+    def test_metrics(self):
+        handler = under_test.BoundedQueueHandler(
+            maxsize=1, overflow_policy=under_test.OverflowPolicy.DROP_NEWEST
+        )
+        handler.handle(create_record("message 0"))
+        handler.handle(create_record("message 1"))
+
+        assert handler.metrics() == {"queued": 1, "capacity": 1, "dropped": 1}
+
+
+class TestLogQueue:
+    def test_records_are_flushed_to_original_handlers_on_stop(self):
+        logger = logging.getLogger("test_log_queue")
+        original_handler = MagicMock(level=logging.NOTSET)
+        logger.handlers = [original_handler]
+        log_queue = under_test.LogQueue(maxsize=10)
+
+        log_queue.start([logger])
+        assert logger.handlers == [log_queue.handler]
+        for i in range(5):
+            logger.warning("message %d", i)
+        log_queue.stop()
+
+        assert logger.handlers == [original_handler]
+        assert original_handler.handle.call_count == 5
+        assert log_queue.metrics()["dropped"] == 0
+
+    def test_shared_handlers_are_only_called_once(self):
+        loggers = [logging.getLogger(f"test_log_queue_{i}") for i in range(2)]
+        shared_handler = MagicMock(level=logging.NOTSET)
+        for logger in loggers:
+            logger.handlers = [shared_handler]
+            logger.propagate = False
+        log_queue = under_test.LogQueue()
+
+        log_queue.start(loggers)
+        loggers[0].warning("message")
+        log_queue.stop()
+
+        shared_handler.handle.assert_called_once()
+
+
+class TestBufferedStreamHandler:
+    def test_records_are_written_when_the_buffer_is_full(self):
+        stream = io.StringIO()
+        handler = under_test.BufferedStreamHandler(stream, buffer_size=20, flush_interval=60)
+
+        handler.handle(create_record("message 0"))
+        assert stream.getvalue() == ""
+        handler.handle(create_record("message 1"))
+
+        assert stream.getvalue() == "message 0\nmessage 1\n"
+
+    def test_errors_are_written_immediately(self):
+        stream = io.StringIO()
+        handler = under_test.BufferedStreamHandler(stream, flush_interval=60)
+
+        handler.handle(create_record("message"))
+        handler.handle(create_record("error", logging.ERROR))
+
+        assert stream.getvalue() == "message\nerror\n"
+
+    def test_records_are_written_after_the_flush_interval(self):
+        stream = io.StringIO()
+        handler = under_test.BufferedStreamHandler(stream, flush_interval=0)
+
+        handler.handle(create_record("message"))
+
+        assert stream.getvalue() == "message\n"
+
+    def test_close_writes_buffered_records(self):
+        stream = io.StringIO()
+        handler = under_test.BufferedStreamHandler(stream, flush_interval=60)
+
+        handler.handle(create_record("message"))
+        handler.close()
+
+        assert stream.getvalue() == "message\n"
+
+    def test_background_writes(self):
+        stream = io.StringIO()
+        handler = under_test.BufferedStreamHandler(stream, flush_interval=60, background=True)
+
+        handler.handle(create_record("message"))
+        handler.handle(create_record("error", logging.ERROR))
+        writer = handler._writer
+        handler.close()
+
+        assert stream.getvalue() == "message\nerror\n"
+        assert not writer.is_alive()
+
+    def test_background_drops_records_when_the_buffer_is_full(self):
+        stream = io.StringIO()
+        handler = under_test.BufferedStreamHandler(
+            stream, flush_interval=60, background=True, max_buffer_size=8
+        )
+
+        for i in range(3):
+            handler.handle(create_record(f"message {i}"))
+        handler.close()
+
+        assert stream.getvalue() == "message 0\n"
+        assert handler.dropped == 2
+
+    def test_background_writer_survives_write_errors(self):
+        stream = MagicMock()
+        stream.write.side_effect = [ValueError("I/O operation on closed file"), None]
+        handler = under_test.BufferedStreamHandler(stream, flush_interval=60, background=True)
+
+        handler.handle(create_record("error", logging.ERROR))
+        deadline = monotonic() + 5
+        while not stream.write.called and monotonic() < deadline:
+            sleep(0.01)
+        writer = handler._writer
+        handler.handle(create_record("error", logging.ERROR))
+        handler.close()
+
+        assert stream.write.call_count == 2
+        assert not writer.is_alive()
+
+    def test_shutdown_does_not_deadlock_with_the_writer(self):
+        stream = io.StringIO()
+        handler = under_test.BufferedStreamHandler(stream, flush_interval=0, background=True)
+
+        for i in range(100):
+            handler.handle(create_record(f"message {i}"))
+        logging.shutdown([lambda: handler])
+
+        assert stream.getvalue().count("\n") == 100
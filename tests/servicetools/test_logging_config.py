@@ -1,9 +1,15 @@
+import json
 import logging
 import sys
+from unittest.mock import MagicMock
 
+import structlog
 from structlog.testing import capture_logs
 
 import servicetools.logging_config as under_test
+from servicetools.deferred import Deferred
+from servicetools.filtering import LevelFilteringBoundLogger
+from servicetools.log_handlers import BoundedQueueHandler, BufferedStreamHandler
 from servicetools.testing import relative_patch_maker
 
 patch = relative_patch_maker(under_test.__name__)
@@ -42,6 +48,26 @@ class TestDefaultConfiguration:
         mock_dict_config.assert_called_once()
         mock_configure.assert_called_once()
 
+    @patch("structlog.configure")
+    @patch("logging.config.dictConfig")
+    def test_json_logging_merges_context_variables(self, mock_dict_config, mock_configure):
+        under_test.default_logging(
+            under_test.Verbosity.WARNING, log_format=under_test.LogFormat.JSON
+        )
+
+        configuration = mock_configure.call_args[1]
+        assert "context_class" not in configuration
+        assert structlog.contextvars.merge_contextvars in configuration["processors"]
+
+    @patch("structlog.configure")
+    @patch("logging.config.dictConfig")
+    def test_cached_levels(self, mock_dict_config, mock_configure):
+        under_test.default_logging(
+            under_test.Verbosity.WARNING, log_format=under_test.LogFormat.JSON, cache_levels=True
+        )
+
+        assert mock_configure.call_args[1]["wrapper_class"] is LevelFilteringBoundLogger
+
     @patch("logging.getLogger")
     def test_external_logs(self, mock_get_logger):
         under_test.default_logging(
@@ -53,6 +79,155 @@ class TestDefaultConfiguration:
         mock_get_logger.return_value.setLevel.assert_called_with(logging.WARNING)
 
 
+class TestProcessorChain:
+    def test_chains_are_built_once(self):
+        assert under_test.processor_chain(under_test.LogFormat.JSON) is under_test.processor_chain(
+            under_test.LogFormat.JSON
+        )
+
+    def test_json_chain_adds_logger_name_and_level(self):
+        chain = under_test.processor_chain(under_test.LogFormat.JSON)
+
+        assert structlog.stdlib.add_logger_name in chain
+        assert structlog.stdlib.add_log_level in chain
+
+    def test_events_are_filtered_first(self):
+        for log_format in under_test.LogFormat:
+            chain = under_test.processor_chain(log_format)
+
+            assert chain[0] is structlog.stdlib.filter_by_level
+
+    def test_text_chain(self):
+        chain = under_test.processor_chain(under_test.LogFormat.TEXT)
+
+        assert chain[-1] is structlog.stdlib.ProcessorFormatter.wrap_for_formatter
+        assert structlog.stdlib.add_logger_name not in chain
+
+
+class TestDeferredValues:
+    def test_deferred_values_are_only_resolved_when_rendered(self, capsys):
+        under_test.default_logging(
+            under_test.Verbosity.WARNING,
+            log_format=under_test.LogFormat.JSON,
+            loggers_to_configure=["deferred_logger"],
+        )
+        logger = structlog.get_logger("deferred_logger")
+        fn = MagicMock(return_value={"computed": True})
+
+        logger.info("dropped", value=Deferred(fn))
+        fn.assert_not_called()
+        logger.warning("rendered", value=Deferred(fn))
+
+        rendered = json.loads(capsys.readouterr().err.splitlines()[0])
+        assert rendered["message"] == "rendered"
+        assert rendered["value"] == {"computed": True}
+
+
+class TestQueuedLogging:
+    def test_root_handlers_are_queued(self):
+        under_test.default_logging(
+            under_test.Verbosity.WARNING, log_format=under_test.LogFormat.TEXT, queue_logs=True
+        )
+        root_handlers = logging.getLogger().handlers
+
+        assert len(root_handlers) == 1
+        assert isinstance(root_handlers[0], BoundedQueueHandler)
+        assert under_test.log_queue_metrics()["capacity"] == under_test.DEFAULT_LOG_QUEUE_SIZE
+
+        under_test.default_logging(
+            under_test.Verbosity.WARNING, log_format=under_test.LogFormat.TEXT
+        )
+
+        assert under_test.log_queue_metrics() == {}
+        assert logging.getLogger().handlers != root_handlers
+
+    def test_configured_loggers_are_queued(self):
+        under_test.default_logging(
+            under_test.Verbosity.WARNING,
+            log_format=under_test.LogFormat.JSON,
+            loggers_to_configure=["queued_logger"],
+            queue_logs=True,
+            log_queue_size=5,
+            overflow_policy=under_test.OverflowPolicy.DROP_NEWEST,
+        )
+        queue_handler = logging.getLogger().handlers[0]
+
+        assert logging.getLogger("queued_logger").handlers == [queue_handler]
+        assert under_test.log_queue_metrics()["capacity"] == 5
+
+        under_test._stop_log_queue()
+
+
+class TestBufferedOutput:
+    def test_text_output_is_buffered(self):
+        root_logger = logging.getLogger()
+        original_handlers = root_logger.handlers
+        root_logger.handlers = []
+        try:
+            under_test.default_logging(
+                under_test.Verbosity.WARNING,
+                log_format=under_test.LogFormat.TEXT,
+                background_output=True,
+            )
+            handler = root_logger.handlers[0]
+
+            assert isinstance(handler, BufferedStreamHandler)
+            assert handler.background
+        finally:
+            for handler in root_logger.handlers:
+                handler.close()
+            root_logger.handlers = original_handlers
+
+    def test_unused_text_handler_is_closed(self):
+        with patch("BufferedStreamHandler") as mock_handler:
+            under_test.default_logging(
+                under_test.Verbosity.WARNING,
+                log_format=under_test.LogFormat.TEXT,
+                buffer_output=True,
+            )
+
+        mock_handler.return_value.close.assert_called_once()
+
+    @patch("structlog.configure")
+    @patch("logging.config.dictConfig")
+    def test_json_output_is_buffered(self, mock_dict_config, mock_configure):
+        under_test.default_logging(
+            under_test.Verbosity.WARNING,
+            log_format=under_test.LogFormat.JSON,
+            buffer_output=True,
+        )
+
+        handler_config = mock_dict_config.call_args[0][0]["handlers"]["json"]
+        assert handler_config["class"] == "servicetools.log_handlers.BufferedStreamHandler"
+        assert not handler_config["background"]
+
+
+class TestAggregatedOutput:
+    def test_text_logs_are_sent_to_the_aggregator(self):
+        with patch("AggregatorHandler") as mock_handler:
+            under_test.default_logging(
+                under_test.Verbosity.WARNING,
+                log_format=under_test.LogFormat.TEXT,
+                log_socket="/tmp/logs.sock",
+            )
+
+        mock_handler.assert_called_once_with("/tmp/logs.sock")
+
+    @patch("structlog.configure")
+    @patch("logging.config.dictConfig")
+    def test_json_logs_are_sent_to_the_aggregator(self, mock_dict_config, mock_configure):
+        under_test.default_logging(
+            under_test.Verbosity.WARNING,
+            log_format=under_test.LogFormat.JSON,
+            log_socket="/tmp/logs.sock",
+            buffer_output=True,
+        )
+
+        handler_config = mock_dict_config.call_args[0][0]["handlers"]["json"]
+        assert handler_config["class"] == "servicetools.log_aggregator.AggregatorHandler"
+        assert handler_config["path"] == "/tmp/logs.sock"
+
+
 class TestBuildLoggersDictionary:
     def test_no_loggers_should_include_default(self):
         logger_config = {"config": "my config"}
@@ -84,3 +259,15 @@ class TestExceptionLogging:
             assert captured[0]["event"] == "Uncaught exception"
             assert captured[0]["log_level"] == "critical"
             assert captured[0]["exc_info"][1].args[0] == "This is an exception"
+
+    def test_handlers_are_flushed_after_uncaught_exceptions(self):
+        handler = MagicMock(level=logging.NOTSET)
+        root_logger = logging.getLogger()
+        root_logger.addHandler(handler)
+        try:
+            with capture_logs():
+                under_test._log_uncaught_exceptions(Exception, Exception("exception"), ())
+        finally:
+            root_logger.removeHandler(handler)
+
+        handler.flush.assert_called_once()
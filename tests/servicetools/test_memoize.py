@@ -0,0 +1,85 @@
+import servicetools.memoize as under_test
+from servicetools.testing import relative_patch_maker
+
+patch = relative_patch_maker(under_test.__name__)
+
+
+class TestCallKey:
+    def test_keyword_argument_order_is_ignored(self):
+        assert under_test.call_key("actor", (1,), {"a": 1, "b": 2}) == under_test.call_key(
+            "actor", [1], {"b": 2, "a": 1}
+        )
+
+    def test_different_arguments(self):
+        assert under_test.call_key("actor", (1,), {}) != under_test.call_key("actor", (2,), {})
+
+    def test_different_names(self):
+        assert under_test.call_key("actor", (1,), {}) != under_test.call_key("other", (1,), {})
+
+    def test_values_without_json_representation(self):
+        key = under_test.call_key("actor", (object,), {})
+
+        assert key.startswith("actor:")
+
+
+class TestMemoryStore:
+    def test_get_and_set(self):
+        store = under_test.MemoryStore()
+
+        store.set("key", "value")
+
+        assert store.get("key") == "value"
+        assert store.get("missing", "default") == "default"
+
+    def test_add_only_stores_missing_keys(self):
+        store = under_test.MemoryStore()
+
+        assert store.add("key", "first")
+        assert not store.add("key", "second")
+        assert store.get("key") == "first"
+
+    @patch("monotonic")
+    def test_values_expire(self, mock_monotonic):
+        store = under_test.MemoryStore()
+        mock_monotonic.return_value = 100.0
+        store.set("key", "value", ttl=10)
+
+        mock_monotonic.return_value = 109.0
+        assert store.get("key") == "value"
+
+        mock_monotonic.return_value = 110.0
+        assert store.get("key") is None
+        assert store.add("key", "new value", ttl=10)
+
+    def test_least_recently_used_values_are_evicted(self):
+        store = under_test.MemoryStore(max_size=2)
+        store.set("a", 1)
+        store.set("b", 2)
+        store.get("a")
+
+        store.set("c", 3)
+
+        assert len(store) == 2
+        assert store.get("a") == 1
+        assert store.get("b") is None
+
+    def test_delete(self):
+        store = under_test.MemoryStore()
+        store.set("key", "value")
+
+        store.delete("key")
+        store.delete("missing")
+
+        assert store.get("key") is None
+
+
+class TestDefaultStore:
+    def test_default_store_can_be_replaced(self):
+        original = under_test.default_store()
+        store = under_test.MemoryStore()
+        try:
+            under_test.set_default_store(store)
+
+            assert under_test.default_store() is store
+        finally:
+            under_test.set_default_store(original)
@@ -0,0 +1,86 @@
+import pytest
+
+import servicetools.metrics as under_test
+
+
+class TestFormatLabels:
+    def test_no_labels(self):
+        assert under_test.format_labels(()) == ""
+
+    def test_labels_are_escaped(self):
+        labels = (("route", '/a"b\\c\nd'), ("method", "GET"))
+
+        assert under_test.format_labels(labels) == '{route="/a\\"b\\\\c\\nd",method="GET"}'
+
+
+class TestPrometheusGauge:
+    def test_gauge_is_rendered(self):
+        lines = under_test.prometheus_gauge("queue_size", "Size.", {(("queue", "a"),): 3})
+
+        assert lines == [
+            "# HELP queue_size Size.",
+            "# TYPE queue_size gauge",
+            'queue_size{queue="a"} 3',
+        ]
+
+
+class TestRequestMetrics:
+    def test_requests_are_counted_by_route_and_status(self):
+        metrics = under_test.RequestMetrics()
+
+        metrics.observe("GET", "/users/{user_id}", 200, 0.1)
+        metrics.observe("GET", "/users/{user_id}", 200, 0.3)
+        metrics.observe("GET", "/users/{user_id}", 404, 0.2)
+
+        lines = metrics.render().splitlines()
+        assert "# TYPE http_requests_total counter" in lines
+        assert (
+            'http_requests_total{method="GET",route="/users/{user_id}",status_code="200"} 2'
+            in lines
+        )
+        assert (
+            'http_requests_total{method="GET",route="/users/{user_id}",status_code="404"} 1'
+            in lines
+        )
+        assert "# TYPE http_request_duration_seconds summary" in lines
+        assert (
+            'http_request_duration_seconds_count{method="GET",route="/users/{user_id}"} 3' in lines
+        )
+        assert any(
+            line.startswith(
+                'http_request_duration_seconds{method="GET",route="/users/{user_id}",quantile="0.99"}'
+            )
+            for line in lines
+        )
+
+    def test_response_bytes_are_counted_by_route(self):
+        metrics = under_test.RequestMetrics()
+
+        metrics.observe("GET", "/files/{name}", 200, 0.1, response_bytes=1000)
+        metrics.observe("GET", "/files/{name}", 206, 0.1, response_bytes=500)
+
+        lines = metrics.render().splitlines()
+        assert "# TYPE http_response_bytes_total counter" in lines
+        assert 'http_response_bytes_total{method="GET",route="/files/{name}"} 1500' in lines
+
+    def test_prefix(self):
+        metrics = under_test.RequestMetrics(prefix="api")
+
+        metrics.observe("GET", "/", 200, 0.1)
+
+        assert 'api_requests_total{method="GET",route="/",status_code="200"} 1' in metrics.render()
+
+    @pytest.mark.asyncio
+    async def test_metrics_are_served(self):
+        metrics = under_test.RequestMetrics()
+        metrics.observe("GET", "/", 200, 0.1)
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await metrics({"type": "http"}, None, send)
+
+        assert sent[0]["status"] == 200
+        assert (b"content-type", under_test.PROMETHEUS_CONTENT_TYPE) in sent[0]["headers"]
+        assert sent[1]["body"] == metrics.render().encode()
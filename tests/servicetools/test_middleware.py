@@ -1,99 +1,817 @@
-from asyncio import Future
-from unittest.mock import MagicMock
+import asyncio
+from time import perf_counter
+from unittest.mock import AsyncMock, MagicMock
 
 import pytest
+from structlog.contextvars import clear_contextvars, get_contextvars
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import PlainTextResponse
+from starlette.routing import Host, Mount, Route
 
 import servicetools.middleware as under_test
+from servicetools.admission import AdmissionControl
+from servicetools.metrics import RequestMetrics
 
 
-def create_mock_request() -> MagicMock:
-    url = MagicMock(path="fake-path")
-    request = MagicMock(method="POST", url=url)
-    request_wrapper = Future()
-    request_body = "fake-body"
-    request_wrapper.set_result(request_body)
-    request.body.return_value = request_wrapper
-    request._receive.return_value = request_wrapper
-    return request
+def create_scope(method: str = "POST", path: str = "fake-path") -> dict:
+    return {"type": "http", "method": method, "path": path, "headers": []}
 
 
-def create_mock_response_wrapper(status_code: int) -> MagicMock:
-    response = MagicMock(status_code=status_code)
-    response_wrapper = Future()
-    response_wrapper.set_result(response)
-    return response_wrapper
+def create_receive(*chunks: bytes):
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks or (b"",))
+    ]
+
+    async def receive():
+        return messages.pop(0)
+
+    return receive
+
+
+def create_app(status_code: int):
+    async def app(scope, receive, send):
+        more_body = True
+        while more_body:
+            message = await receive()
+            more_body = message.get("more_body", False)
+        await send({"type": "http.response.start", "status": status_code, "headers": []})
+        await send({"type": "http.response.body", "body": b"response"})
+
+    return app
+
+
+async def call_middleware(middleware, *chunks: bytes) -> list:
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await middleware(create_scope(), create_receive(*chunks), send)
+    return sent
 
 
 class TestStructlogRequestMiddleWare:
     @pytest.mark.asyncio
     async def test_start_and_end_requests_logged(self):
-        request = create_mock_request()
-
-        response_wrapper = create_mock_response_wrapper(200)
         logger = MagicMock()
 
-        middleware = under_test.StructlogRequestMiddleware(MagicMock(), logger=logger)
+        middleware = under_test.StructlogRequestMiddleware(create_app(200), logger=logger)
 
-        await middleware.dispatch(request, lambda _: response_wrapper)
+        sent = await call_middleware(middleware, b"fake-body")
 
         assert logger.log.call_count == 2
+        assert logger.log.mock_calls[1][2]["status_code"] == 200
+        assert [message["type"] for message in sent] == [
+            "http.response.start",
+            "http.response.body",
+        ]
 
     @pytest.mark.asyncio
-    async def test_exception_logging(self):
-        request = create_mock_request()
+    async def test_streamed_responses_are_timed(self):
+        logger = MagicMock()
+
+        async def stream(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            for chunk in (b"first", b"second"):
+                await asyncio.sleep(0.01)
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+
+        middleware = under_test.StructlogRequestMiddleware(stream, logger=logger)
+
+        await call_middleware(middleware)
+
+        end_log = logger.log.mock_calls[1][2]
+        assert end_log["response_bytes"] == len(b"firstsecond")
+        assert end_log["time_to_first_byte"] < end_log["time_to_last_byte"]
+        assert 0.02 <= end_log["time_to_last_byte"] <= end_log["seconds"]
+
+    @pytest.mark.asyncio
+    async def test_unfinished_responses_have_no_time_to_last_byte(self):
+        logger = MagicMock()
 
+        async def no_response(scope, receive, send):
+            pass
+
+        middleware = under_test.StructlogRequestMiddleware(no_response, logger=logger)
+
+        await call_middleware(middleware)
+
+        end_log = logger.log.mock_calls[1][2]
+        assert end_log["response_bytes"] == 0
+        assert end_log["time_to_first_byte"] is None
+        assert end_log["time_to_last_byte"] is None
+
+    @pytest.mark.asyncio
+    async def test_exception_logging(self):
         logger = MagicMock()
 
-        def throw_error(_):
+        async def throw_error(scope, receive, send):
             raise ValueError("Throwing an error")
 
-        middleware = under_test.StructlogRequestMiddleware(MagicMock(), logger=logger)
+        middleware = under_test.StructlogRequestMiddleware(throw_error, logger=logger)
 
         with pytest.raises(ValueError):
-            await middleware.dispatch(request, throw_error)
+            await call_middleware(middleware)
 
         assert logger.log.call_count == 2
 
     @pytest.mark.asyncio
     async def test_error_logging(self):
-        request = create_mock_request()
-
-        response_wrapper = create_mock_response_wrapper(404)
         logger = MagicMock()
 
-        middleware = under_test.StructlogRequestMiddleware(MagicMock(), logger=logger)
+        middleware = under_test.StructlogRequestMiddleware(create_app(404), logger=logger)
 
-        await middleware.dispatch(request, lambda _: response_wrapper)
+        await call_middleware(middleware, b"fake-body")
 
         assert logger.log.call_count == 3
+        assert "request" not in logger.log.mock_calls[2][2]
 
     @pytest.mark.asyncio
     async def test_error_logging_include_request(self):
-        request = create_mock_request()
-
-        response_wrapper = create_mock_response_wrapper(400)
         logger = MagicMock()
 
         middleware = under_test.StructlogRequestMiddleware(
-            MagicMock(), logger=logger, include_request_in_failed_requests=True
+            create_app(400), logger=logger, include_request_in_failed_requests=True
         )
 
-        await middleware.dispatch(request, lambda _: response_wrapper)
+        await call_middleware(middleware, b"fake-", b"body")
 
         assert logger.log.call_count == 3
-        assert logger.log.mock_calls[2][2]["request"] == "fake-body"
+        assert logger.log.mock_calls[2][2]["request"].resolve() == b"fake-body"
+        assert "request_unread" not in logger.log.mock_calls[2][2]
+
+    @pytest.mark.asyncio
+    async def test_error_logging_flags_unread_requests(self):
+        logger = MagicMock()
+
+        async def reject(scope, receive, send):
+            await send({"type": "http.response.start", "status": 404, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        middleware = under_test.StructlogRequestMiddleware(
+            reject, logger=logger, include_request_in_failed_requests=True
+        )
+
+        await call_middleware(middleware, b"abc")
+
+        error_log = logger.log.mock_calls[2][2]
+        assert error_log["request_unread"]
+        assert "request" not in error_log
+
+    @pytest.mark.asyncio
+    async def test_error_logging_flags_partly_read_requests(self):
+        logger = MagicMock()
+
+        async def read_once(scope, receive, send):
+            await receive()
+            await send({"type": "http.response.start", "status": 413, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        middleware = under_test.StructlogRequestMiddleware(
+            read_once, logger=logger, include_request_in_failed_requests=True
+        )
+
+        await call_middleware(middleware, b"fake-", b"body")
+
+        error_log = logger.log.mock_calls[2][2]
+        assert error_log["request"].resolve() == b"fake-"
+        assert error_log["request_unread"]
+
+    @pytest.mark.asyncio
+    async def test_error_logging_truncates_large_requests(self):
+        logger = MagicMock()
+        received = []
+
+        async def app(scope, receive, send):
+            more_body = True
+            while more_body:
+                message = await receive()
+                received.append(message["body"])
+                more_body = message["more_body"]
+            await send({"type": "http.response.start", "status": 500, "headers": []})
+
+        middleware = under_test.StructlogRequestMiddleware(
+            app,
+            logger=logger,
+            include_request_in_failed_requests=True,
+            max_logged_request_size=6,
+        )
+
+        await call_middleware(middleware, b"fake-", b"body", b"more")
+
+        assert received == [b"fake-", b"body", b"more"]
+        assert logger.log.mock_calls[2][2]["request"].resolve() == b"fake-b"
+        assert logger.log.mock_calls[2][2]["request_truncated"]
 
     @pytest.mark.asyncio
     async def test_ignored_error_logging(self):
-        request = create_mock_request()
+        logger = MagicMock()
+
+        middleware = under_test.StructlogRequestMiddleware(
+            create_app(404), logger=logger, ignored_status_codes={404}
+        )
+
+        await call_middleware(middleware, b"fake-body")
+
+        assert logger.log.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_non_http_scopes_are_passed_through(self):
+        logger = MagicMock()
+        app = MagicMock()
+
+        async def call_app(scope, receive, send):
+            app(scope, receive, send)
+
+        middleware = under_test.StructlogRequestMiddleware(call_app, logger=logger)
+        scope = {"type": "lifespan"}
+
+        await middleware(scope, None, None)
+
+        app.assert_called_once_with(scope, None, None)
+        logger.log.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_metrics_are_recorded_by_route(self):
+        metrics = RequestMetrics()
+
+        async def user(request):
+            return PlainTextResponse(request.path_params["user_id"])
+
+        app = Starlette(
+            routes=[Route("/users/{user_id}", user)],
+            middleware=[
+                Middleware(
+                    under_test.StructlogRequestMiddleware, logger=MagicMock(), metrics=metrics
+                )
+            ],
+        )
+
+        for user_id in ("1", "2"):
+            await app(create_scope("GET", f"/users/{user_id}"), create_receive(), AsyncMock())
+        await app(create_scope("GET", "/missing"), create_receive(), AsyncMock())
+
+        rendered = metrics.render()
+        assert 'route="/users/{user_id}",status_code="200"} 2' in rendered
+        assert 'route="<unmatched>",status_code="404"} 1' in rendered
+        assert 'http_response_bytes_total{method="GET",route="/users/{user_id}"} 2' in rendered
+
+    @pytest.mark.asyncio
+    async def test_metrics_are_recorded_for_exceptions(self):
+        metrics = RequestMetrics()
 
-        response_wrapper = create_mock_response_wrapper(404)
+        async def throw_error(scope, receive, send):
+            raise ValueError("Throwing an error")
+
+        middleware = under_test.StructlogRequestMiddleware(
+            throw_error, logger=MagicMock(), metrics=metrics
+        )
+
+        with pytest.raises(ValueError):
+            await call_middleware(middleware)
+
+        assert 'route="<unmatched>",status_code="500"} 1' in metrics.render()
+
+    @pytest.mark.asyncio
+    async def test_unsampled_successful_requests_are_not_logged(self):
+        logger = MagicMock()
+
+        middleware = under_test.StructlogRequestMiddleware(
+            create_app(200), logger=logger, sample_rate=0.0
+        )
+
+        await call_middleware(middleware)
+
+        logger.log.assert_not_called()
+        assert middleware.suppressed_logs == {"sampled": 1, "rate_limited": 0}
+
+    @pytest.mark.asyncio
+    async def test_unsampled_failed_requests_are_logged(self):
+        logger = MagicMock()
+
+        middleware = under_test.StructlogRequestMiddleware(
+            create_app(500), logger=logger, sample_rate=0.0
+        )
+
+        await call_middleware(middleware)
+
+        assert [call[1][1] for call in logger.log.mock_calls] == [
+            "HTTP request end",
+            "HTTP request error",
+        ]
+
+    @pytest.mark.asyncio
+    async def test_unsampled_slow_requests_are_logged(self):
         logger = MagicMock()
 
         middleware = under_test.StructlogRequestMiddleware(
-            MagicMock(), logger=logger, ignored_status_codes={404}
+            create_app(200), logger=logger, sample_rate=0.0, slow_request_threshold=0.0
         )
 
-        await middleware.dispatch(request, lambda _: response_wrapper)
+        await call_middleware(middleware)
+
+        assert logger.log.mock_calls[0][1][1] == "HTTP request end"
+
+    @pytest.mark.asyncio
+    async def test_endpoint_sample_rates_override_sample_rate(self):
+        logger = MagicMock()
+
+        middleware = under_test.StructlogRequestMiddleware(
+            create_app(200),
+            logger=logger,
+            sample_rate=0.0,
+            endpoint_sample_rates={"fake-path": 1.0},
+        )
+
+        await call_middleware(middleware)
 
         assert logger.log.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_endpoint_sample_rates_use_route_template(self):
+        logger = MagicMock()
+        app = Starlette(
+            routes=[Route("/health", PlainTextResponse("ok"))],
+            middleware=[
+                Middleware(
+                    under_test.StructlogRequestMiddleware,
+                    logger=logger,
+                    endpoint_sample_rates={"/health": 0.0},
+                )
+            ],
+        )
+
+        await app(create_scope("GET", "/health"), create_receive(), AsyncMock())
+
+        logger.log.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_endpoint_sample_rates_use_mounted_route_template(self):
+        logger = MagicMock()
+        api = Starlette(routes=[Route("/users/{user_id}", PlainTextResponse("user"))])
+        app = Starlette(
+            routes=[Mount("/api", api)],
+            middleware=[
+                Middleware(
+                    under_test.StructlogRequestMiddleware,
+                    logger=logger,
+                    endpoint_sample_rates={"/api/users/{user_id}": 0.0},
+                )
+            ],
+        )
+
+        await app(create_scope("GET", "/api/users/1"), create_receive(), AsyncMock())
+
+        logger.log.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_error_logs_are_rate_limited(self):
+        logger = MagicMock()
+
+        middleware = under_test.StructlogRequestMiddleware(
+            create_app(500),
+            logger=logger,
+            sample_rate=0.0,
+            error_log_rate=0.001,
+            error_log_burst=1,
+        )
+
+        await call_middleware(middleware)
+        await call_middleware(middleware)
+
+        assert logger.log.call_count == 2
+        assert middleware.suppressed_logs == {"sampled": 1, "rate_limited": 1}
+
+    @pytest.mark.asyncio
+    async def test_exception_logs_are_rate_limited(self):
+        logger = MagicMock()
+
+        async def throw_error(scope, receive, send):
+            raise ValueError("Throwing an error")
+
+        middleware = under_test.StructlogRequestMiddleware(
+            throw_error, logger=logger, sample_rate=0.0, error_log_rate=0.001, error_log_burst=0
+        )
+
+        with pytest.raises(ValueError):
+            await call_middleware(middleware)
+
+        logger.log.assert_not_called()
+        assert middleware.suppressed_logs["rate_limited"] == 1
+
+    @pytest.mark.asyncio
+    async def test_slow_requests_are_profiled(self):
+        logger = MagicMock()
+
+        async def slow_app(scope, receive, send):
+            end = perf_counter() + 0.05
+            while perf_counter() < end:
+                pass
+            await create_app(200)(scope, receive, send)
+
+        middleware = under_test.StructlogRequestMiddleware(
+            slow_app, logger=logger, sample_rate=0.0, profile_threshold=0.0
+        )
+
+        await call_middleware(middleware)
+
+        end_log = logger.log.mock_calls[0]
+        assert end_log[1][1] == "HTTP request end"
+        assert any("slow_app" in hotspot["frame"] for hotspot in end_log[2]["hotspots"])
+
+    @pytest.mark.asyncio
+    async def test_fast_requests_are_not_profiled(self):
+        logger = MagicMock()
+
+        middleware = under_test.StructlogRequestMiddleware(
+            create_app(200), logger=logger, profile_threshold=10.0
+        )
+
+        await call_middleware(middleware)
+
+        assert "hotspots" not in logger.log.mock_calls[1][2]
+
+    @pytest.mark.asyncio
+    async def test_profiling_stops_for_failed_requests(self):
+        logger = MagicMock()
+
+        async def throw_error(scope, receive, send):
+            raise ValueError("Throwing an error")
+
+        middleware = under_test.StructlogRequestMiddleware(
+            throw_error, logger=logger, profile_threshold=10.0
+        )
+
+        with pytest.raises(ValueError):
+            await call_middleware(middleware)
+
+        assert not middleware.profiler._watches
+
+    @pytest.mark.asyncio
+    async def test_profiling_stops_for_cancelled_requests(self):
+        async def cancelled(scope, receive, send):
+            raise asyncio.CancelledError()
+
+        middleware = under_test.StructlogRequestMiddleware(
+            cancelled, logger=MagicMock(), profile_threshold=10.0
+        )
+
+        with pytest.raises(asyncio.CancelledError):
+            await call_middleware(middleware)
+
+        assert not middleware.profiler._watches
+
+
+class TestAdmissionControl:
+    @pytest.mark.asyncio
+    async def test_requests_in_flight_are_tracked(self):
+        admission = AdmissionControl()
+        in_flight = []
+
+        async def app(scope, receive, send):
+            in_flight.append((admission.in_flight, dict(admission.route_in_flight)))
+            await create_app(200)(scope, receive, send)
+
+        middleware = under_test.StructlogRequestMiddleware(
+            app, logger=MagicMock(), admission=admission
+        )
+
+        await call_middleware(middleware)
+
+        assert in_flight == [(1, {})]
+        assert admission.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_requests_are_released_after_exceptions(self):
+        admission = AdmissionControl(max_in_flight=1)
+
+        async def throw_error(scope, receive, send):
+            raise ValueError("Throwing an error")
+
+        middleware = under_test.StructlogRequestMiddleware(
+            throw_error, logger=MagicMock(), admission=admission
+        )
+
+        with pytest.raises(ValueError):
+            await call_middleware(middleware)
+
+        assert admission.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_requests_over_the_limit_are_shed(self):
+        logger = MagicMock()
+        metrics = RequestMetrics()
+        admission = AdmissionControl(max_in_flight=1)
+        release = asyncio.Event()
+
+        async def app(scope, receive, send):
+            await release.wait()
+            await create_app(200)(scope, receive, send)
+
+        middleware = under_test.StructlogRequestMiddleware(
+            app, logger=logger, metrics=metrics, admission=admission
+        )
+
+        first = asyncio.ensure_future(call_middleware(middleware))
+        await asyncio.sleep(0)
+        shed = await call_middleware(middleware)
+        release.set()
+        admitted = await first
+
+        assert shed[0]["status"] == 503
+        assert shed[1]["body"] == under_test.SHED_RESPONSE_BODY
+        assert admitted[0]["status"] == 200
+        assert admission.shed["in_flight"] == 1
+        assert 'route="<unmatched>",status_code="503"} 1' in metrics.render()
+        shed_logs = [call for call in logger.log.mock_calls if call[1][1] == "HTTP request shed"]
+        assert shed_logs[0][2]["reason"] == "in_flight"
+        assert shed_logs[0][2]["in_flight"] == 1
+
+    @pytest.mark.asyncio
+    async def test_route_limits_apply_to_mounted_routes(self):
+        admission = AdmissionControl(max_route_in_flight={"/api/users/{user_id}": 0})
+        metrics = RequestMetrics()
+        api = Starlette(routes=[Route("/users/{user_id}", PlainTextResponse)])
+        app = Starlette(
+            routes=[Mount("/api", api)],
+            middleware=[
+                Middleware(
+                    under_test.StructlogRequestMiddleware,
+                    logger=MagicMock(),
+                    metrics=metrics,
+                    admission=admission,
+                )
+            ],
+        )
+        send = AsyncMock()
+
+        await app(create_scope("GET", "/api/users/1"), create_receive(), send)
+
+        assert send.call_args_list[0][0][0]["status"] == 503
+        assert admission.shed["route_in_flight"] == 1
+        assert 'route="/api/users/{user_id}",status_code="503"} 1' in metrics.render()
+
+    @pytest.mark.asyncio
+    async def test_shed_logs_are_rate_limited(self):
+        logger = MagicMock()
+        admission = AdmissionControl(max_in_flight=0)
+
+        middleware = under_test.StructlogRequestMiddleware(
+            create_app(200),
+            logger=logger,
+            admission=admission,
+            error_log_rate=0.001,
+            error_log_burst=1,
+        )
+
+        await call_middleware(middleware)
+        await call_middleware(middleware)
+
+        assert logger.log.call_count == 1
+        assert middleware.suppressed_logs["rate_limited"] == 1
+
+
+class TestRequestContext:
+    @staticmethod
+    def create_recording_app(contexts: list):
+        async def app(scope, receive, send):
+            contexts.append(get_contextvars())
+            await create_app(200)(scope, receive, send)
+
+        return app
+
+    @pytest.mark.asyncio
+    async def test_request_context_is_bound(self):
+        clear_contextvars()
+        contexts = []
+        scope = create_scope()
+        scope["headers"] = [(b"x-request-id", b"fake-request-id")]
+
+        middleware = under_test.StructlogRequestMiddleware(
+            self.create_recording_app(contexts), logger=MagicMock()
+        )
+        await middleware(scope, create_receive(), AsyncMock())
+
+        assert contexts == [{"request_id": "fake-request-id", "method": "POST"}]
+        assert get_contextvars() == {}
+
+    @pytest.mark.asyncio
+    async def test_route_is_bound(self):
+        clear_contextvars()
+        contexts = []
+
+        middleware = under_test.StructlogRequestMiddleware(
+            self.create_recording_app(contexts), logger=MagicMock(), bind_route=True
+        )
+        await call_middleware(middleware)
+
+        assert contexts[0]["route"] == under_test.UNMATCHED_ROUTE
+
+    @pytest.mark.asyncio
+    async def test_request_id_is_generated(self):
+        contexts = []
+
+        middleware = under_test.StructlogRequestMiddleware(
+            self.create_recording_app(contexts), logger=MagicMock()
+        )
+        await call_middleware(middleware)
+        await call_middleware(middleware)
+
+        assert len(contexts[0]["request_id"]) == 32
+        assert contexts[0]["request_id"] != contexts[1]["request_id"]
+
+    @pytest.mark.asyncio
+    async def test_request_context_is_not_bound(self):
+        clear_contextvars()
+        contexts = []
+
+        middleware = under_test.StructlogRequestMiddleware(
+            self.create_recording_app(contexts), logger=MagicMock(), bind_context=False
+        )
+        await call_middleware(middleware)
+
+        assert contexts == [{}]
+
+    @pytest.mark.asyncio
+    async def test_route_of_mounted_and_disallowed_routes_is_bound(self):
+        clear_contextvars()
+        contexts = []
+
+        async def user(request):
+            contexts.append(get_contextvars())
+            return PlainTextResponse("user")
+
+        api = Starlette(routes=[Route("/users/{user_id}", user)])
+        app = Starlette(
+            routes=[Mount("/api", api)],
+            middleware=[
+                Middleware(
+                    under_test.StructlogRequestMiddleware,
+                    logger=MagicMock(),
+                    bind_route=True,
+                )
+            ],
+        )
+
+        await app(create_scope("GET", "/api/users/1"), create_receive(), AsyncMock())
+
+        assert contexts[0]["route"] == "/api/users/{user_id}"
+
+    @pytest.mark.asyncio
+    async def test_route_is_looked_up_once(self, monkeypatch):
+        lookups = []
+        monkeypatch.setattr(
+            under_test, "route_template", lambda scope: lookups.append(scope) or "/fake"
+        )
+        metrics = RequestMetrics()
+
+        middleware = under_test.StructlogRequestMiddleware(
+            create_app(200),
+            logger=MagicMock(),
+            metrics=metrics,
+            admission=AdmissionControl(),
+            endpoint_sample_rates={"/fake": 1.0},
+        )
+        await call_middleware(middleware)
+
+        assert len(lookups) == 1
+        assert 'route="/fake",status_code="200"} 1' in metrics.render()
+
+    @pytest.mark.asyncio
+    async def test_route_is_not_looked_up_before_routing_by_default(self, monkeypatch):
+        lookups = []
+        lookups_before_routing = []
+        monkeypatch.setattr(
+            under_test, "route_template", lambda scope: lookups.append(scope) or "/fake"
+        )
+
+        async def app(scope, receive, send):
+            lookups_before_routing.append(len(lookups))
+            await create_app(200)(scope, receive, send)
+
+        middleware = under_test.StructlogRequestMiddleware(
+            app, logger=MagicMock(), metrics=RequestMetrics(), admission=AdmissionControl()
+        )
+        await call_middleware(middleware)
+
+        assert lookups_before_routing == [0]
+        assert len(lookups) == 1
+
+    @pytest.mark.asyncio
+    async def test_route_is_read_after_routing(self):
+        logger = MagicMock()
+        metrics = RequestMetrics()
+        api = Starlette(routes=[Route("/users/{user_id}", PlainTextResponse("user"))])
+        app = Starlette(
+            routes=[Mount("/api", api)],
+            middleware=[
+                Middleware(under_test.StructlogRequestMiddleware, logger=logger, metrics=metrics)
+            ],
+        )
+
+        await app(create_scope("GET", "/api/users/1"), create_receive(), AsyncMock())
+
+        assert logger.log.mock_calls[1][2]["route"] == "/api/users/{user_id}"
+        assert 'route="/api/users/{user_id}",status_code="200"} 1' in metrics.render()
+
+    @pytest.mark.asyncio
+    async def test_request_context_is_reset_after_exceptions(self):
+        clear_contextvars()
+
+        async def throw_error(scope, receive, send):
+            raise ValueError("Throwing an error")
+
+        middleware = under_test.StructlogRequestMiddleware(throw_error, logger=MagicMock())
+        with pytest.raises(ValueError):
+            await call_middleware(middleware)
+
+        assert get_contextvars() == {}
+
+
+class TestRouteTemplate:
+    def test_matched_route_is_used(self):
+        scope = {"route": Route("/users/{user_id}", PlainTextResponse)}
+
+        assert under_test.route_template(scope) == "/users/{user_id}"
+
+    def test_mount_path_is_included(self):
+        scope = {
+            "route": Route("/users/{user_id}", PlainTextResponse),
+            "root_path": "/root/api",
+            "app_root_path": "/root",
+        }
+
+        assert under_test.route_template(scope) == "/api/users/{user_id}"
+
+    def test_mount_path_is_not_repeated_for_mounted_applications(self):
+        scope = {
+            "route": Mount("/static", PlainTextResponse),
+            "root_path": "/root/static",
+            "app_root_path": "/root",
+        }
+
+        assert under_test.route_template(scope) == "/static"
+
+    def test_mounted_applications_are_matched_when_not_recorded(self):
+        app = Starlette(routes=[Route("/", PlainTextResponse), Mount("/static", PlainTextResponse)])
+        scope = {**create_scope("GET", "/static/style.css"), "app": app}
+
+        assert under_test.route_template(scope) == "/static"
+
+    @pytest.mark.asyncio
+    async def test_mounted_metrics_are_recorded_by_mount_path(self):
+        metrics = RequestMetrics()
+        app = Starlette(
+            routes=[Mount("/metrics", metrics)],
+            middleware=[
+                Middleware(
+                    under_test.StructlogRequestMiddleware, logger=MagicMock(), metrics=metrics
+                )
+            ],
+        )
+
+        await app(create_scope("GET", "/metrics/"), create_receive(), AsyncMock())
+
+        assert 'route="/metrics",status_code="200"} 1' in metrics.render()
+
+    def test_routes_are_matched_when_not_recorded(self):
+        app = Starlette(
+            routes=[
+                Route("/", PlainTextResponse),
+                Route("/users/{user_id}", PlainTextResponse),
+                Mount("/static", PlainTextResponse),
+            ]
+        )
+        scope = {**create_scope("GET", "/users/1"), "app": app}
+
+        assert under_test.route_template(scope) == "/users/{user_id}"
+
+    def test_mounted_routes_are_matched_when_not_recorded(self):
+        api = Starlette(routes=[Route("/users/{user_id}", PlainTextResponse)])
+        app = Starlette(routes=[Route("/", PlainTextResponse), Mount("/api", api)])
+        scope = {**create_scope("GET", "/api/users/1"), "app": app}
+
+        assert under_test.route_template(scope) == "/api/users/{user_id}"
+
+    def test_host_routes_are_matched_when_not_recorded(self):
+        api = Starlette(routes=[Route("/users/{user_id}", PlainTextResponse)])
+        app = Starlette(routes=[Host("api.example.com", api)])
+        scope = {
+            **create_scope("GET", "/users/1"),
+            "headers": [(b"host", b"api.example.com")],
+            "app": app,
+        }
+
+        assert under_test.route_template(scope) == "/users/{user_id}"
+
+    def test_routes_not_allowing_the_method_are_matched(self):
+        app = Starlette(routes=[Route("/users/{user_id}", PlainTextResponse, methods=["GET"])])
+        scope = {**create_scope("DELETE", "/users/1"), "app": app}
+
+        assert under_test.route_template(scope) == "/users/{user_id}"
+
+    def test_unmatched_routes(self):
+        assert under_test.route_template(create_scope()) == under_test.UNMATCHED_ROUTE
@@ -0,0 +1,58 @@
+from unittest.mock import MagicMock
+
+import servicetools.processors as under_test
+from servicetools.deferred import Deferred
+
+
+class TestConditionalProcessors:
+    def test_processors_run_for_events_with_their_key(self):
+        processor = MagicMock(return_value={"event": "processed"})
+        processors = under_test.ConditionalProcessors([("exc_info", processor)])
+
+        result = processors(None, "info", {"event": "fake", "exc_info": True})
+
+        assert result == {"event": "processed"}
+        processor.assert_called_once_with(None, "info", {"event": "fake", "exc_info": True})
+
+    def test_processors_are_skipped_for_events_without_their_key(self):
+        processor = MagicMock()
+        processors = under_test.ConditionalProcessors([("exc_info", processor)])
+
+        result = processors(None, "info", {"event": "fake"})
+
+        assert result == {"event": "fake"}
+        processor.assert_not_called()
+
+
+class TestFormatStages:
+    def test_positional_arguments_are_formatted(self):
+        event_dict = {"event": "hello %s", "positional_args": ("world",)}
+
+        assert under_test.format_stages()(None, "info", event_dict) == {"event": "hello world"}
+
+    def test_exceptions_are_formatted(self):
+        try:
+            raise ValueError("fake error")
+        except ValueError as e:
+            event_dict = under_test.format_stages()(None, "error", {"event": "x", "exc_info": e})
+
+        assert "ValueError: fake error" in event_dict["exception"]
+        assert "exc_info" not in event_dict
+
+    def test_stack_information_is_rendered(self):
+        event_dict = under_test.format_stages()(None, "info", {"event": "x", "stack_info": True})
+
+        assert "stack" in event_dict
+
+    def test_plain_events_are_unchanged(self):
+        assert under_test.format_stages()(None, "info", {"event": "x"}) == {"event": "x"}
+
+
+class TestResolveDeferred:
+    def test_deferred_values_are_resolved(self):
+        event_dict = {"event": "event", "value": Deferred(lambda: [1, 2])}
+
+        assert under_test.resolve_deferred(None, "info", event_dict) == {
+            "event": "event",
+            "value": [1, 2],
+        }
@@ -0,0 +1,63 @@
+import threading
+from time import perf_counter
+
+import servicetools.profiling as under_test
+
+
+def busy_wait(seconds: float) -> None:
+    end = perf_counter() + seconds
+    while perf_counter() < end:
+        pass
+
+
+class TestSlowCallProfiler:
+    def test_slow_calls_are_sampled(self):
+        profiler = under_test.SlowCallProfiler(threshold=0.0, interval=0.001)
+
+        watch = profiler.start()
+        busy_wait(0.05)
+        hotspots = profiler.stop(watch)
+
+        assert hotspots
+        assert any("busy_wait" in hotspot["frame"] for hotspot in hotspots)
+        assert all(hotspot["samples"] > 0 for hotspot in hotspots)
+
+    def test_fast_calls_are_not_sampled(self):
+        profiler = under_test.SlowCallProfiler(threshold=10.0, interval=0.001)
+
+        watch = profiler.start()
+        busy_wait(0.01)
+
+        assert profiler.stop(watch) == []
+
+    def test_number_of_frames_is_limited(self):
+        profiler = under_test.SlowCallProfiler(threshold=0.0, interval=0.001, top=1)
+
+        watch = profiler.start()
+        busy_wait(0.02)
+        busy_wait(0.02)
+
+        assert len(profiler.stop(watch)) <= 1
+
+    def test_sampling_thread_stops_when_idle(self):
+        profiler = under_test.SlowCallProfiler(threshold=0.0, interval=0.001)
+        profiler.stop(profiler.start())
+
+        busy_wait(0.01)
+
+        assert profiler._thread is None
+
+    def test_calls_on_other_threads(self):
+        profiler = under_test.SlowCallProfiler(threshold=0.0, interval=0.001)
+        hotspots = []
+
+        def profile_call():
+            watch = profiler.start()
+            busy_wait(0.05)
+            hotspots.extend(profiler.stop(watch))
+
+        thread = threading.Thread(target=profile_call)
+        thread.start()
+        thread.join()
+
+        assert any("busy_wait" in hotspot["frame"] for hotspot in hotspots)
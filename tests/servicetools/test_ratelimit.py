@@ -0,0 +1,37 @@
+from unittest.mock import MagicMock
+
+import servicetools.ratelimit as under_test
+from servicetools.testing import relative_patch_maker
+
+patch = relative_patch_maker(under_test.__name__)
+
+
+class TestTokenBucket:
+    @patch("monotonic")
+    def test_bursts_are_limited_to_capacity(self, monotonic_mock: MagicMock):
+        monotonic_mock.return_value = 0.0
+        bucket = under_test.TokenBucket(rate=1.0, capacity=3)
+
+        assert [bucket.consume() for _ in range(4)] == [True, True, True, False]
+
+    @patch("monotonic")
+    def test_tokens_are_refilled_over_time(self, monotonic_mock: MagicMock):
+        monotonic_mock.return_value = 0.0
+        bucket = under_test.TokenBucket(rate=2.0, capacity=1)
+        assert bucket.consume()
+        assert not bucket.consume()
+
+        monotonic_mock.return_value = 0.5
+
+        assert bucket.consume()
+        assert not bucket.consume()
+
+    @patch("monotonic")
+    def test_refill_is_capped_at_capacity(self, monotonic_mock: MagicMock):
+        monotonic_mock.return_value = 0.0
+        bucket = under_test.TokenBucket(rate=1.0, capacity=2)
+
+        monotonic_mock.return_value = 100.0
+
+        assert bucket.consume(2)
+        assert not bucket.consume()
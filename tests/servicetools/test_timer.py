@@ -1,6 +1,24 @@
+import asyncio
+import logging
+from time import perf_counter
 from unittest.mock import MagicMock
 
+import pytest
+import structlog
+from structlog.contextvars import bound_contextvars, merge_contextvars
+from structlog.testing import LogCapture
+
 import servicetools.timer as under_test
+from servicetools.deferred import DEFAULT_REPR_LIMIT
+from servicetools.testing import relative_patch_maker
+
+patch = relative_patch_maker(under_test.__name__)
+
+
+def busy_wait(seconds: float) -> None:
+    end = perf_counter() + seconds
+    while perf_counter() < end:
+        pass
 
 
 class TestTimer:
@@ -14,3 +32,283 @@ class TestTimer:
         assert sample_fn()
 
         logger.log.assert_called_once()
+
+    def test_details_are_deferred(self):
+        logger = MagicMock()
+
+        @under_test.timer(logger, details=True)
+        def sample_fn(*args, **kwargs):
+            return True
+
+        sample_fn(1, "x" * 10000, key="value")
+
+        fields = logger.log.call_args[1]
+        assert str(fields["fn_kwargs"]) == "{'key': 'value'}"
+        assert str(fields["fn_args"]).startswith("(1, 'xxx")
+        assert len(str(fields["fn_args"])) <= DEFAULT_REPR_LIMIT
+
+    def test_slow_calls_are_profiled(self):
+        logger = MagicMock()
+
+        @under_test.timer(logger, profile_threshold=0.0)
+        def sample_fn():
+            busy_wait(0.05)
+
+        sample_fn()
+
+        hotspots = logger.log.call_args[1]["hotspots"]
+        assert any("busy_wait" in hotspot["frame"] for hotspot in hotspots)
+
+    def test_fast_calls_are_not_profiled(self):
+        logger = MagicMock()
+
+        @under_test.timer(logger, profile_threshold=10.0)
+        def sample_fn():
+            return True
+
+        sample_fn()
+
+        assert "hotspots" not in logger.log.call_args[1]
+
+    def test_slow_aggregated_calls_are_logged(self):
+        logger = MagicMock()
+
+        @under_test.timer(logger, aggregate=True, profile_threshold=0.0)
+        def sample_fn():
+            busy_wait(0.05)
+
+        sample_fn()
+
+        assert logger.log.call_args[0][1] == "slow call"
+        assert logger.log.call_args[1]["hotspots"]
+
+    def test_profiling_stops_when_calls_fail(self):
+        logger = MagicMock()
+
+        @under_test.timer(logger, profile_threshold=0.0)
+        def sample_fn():
+            raise ValueError("fake error")
+
+        with pytest.raises(ValueError):
+            sample_fn()
+
+        logger.log.assert_not_called()
+
+    def test_timing_includes_context_variables(self):
+        capture = LogCapture()
+        logger = structlog.wrap_logger(
+            None,
+            processors=[merge_contextvars, capture],
+            wrapper_class=structlog.make_filtering_bound_logger(logging.INFO),
+        )
+
+        @under_test.timer(logger)
+        def sample_fn():
+            return True
+
+        with bound_contextvars(request_id="fake-request-id"):
+            sample_fn()
+
+        assert capture.entries[0]["request_id"] == "fake-request-id"
+
+    def test_aggregated_timings_are_not_logged_every_call(self):
+        logger = MagicMock()
+
+        @under_test.timer(logger, aggregate=True, summary_interval=3600)
+        def aggregated_fn(value):
+            return value
+
+        for i in range(10):
+            assert aggregated_fn(i) == i
+
+        logger.log.assert_not_called()
+        summaries = under_test.timing_summaries()
+        summary = summaries[f"{__name__}.{aggregated_fn.__qualname__}"]
+        assert summary["count"] == 10
+
+    def test_aggregated_timings_are_summarized_periodically(self):
+        logger = MagicMock()
+
+        @under_test.timer(logger, aggregate=True, summary_interval=0)
+        def summarized_fn():
+            return True
+
+        assert summarized_fn()
+
+        logger.log.assert_called_once()
+        assert logger.log.call_args[0][1] == "timing summary"
+        assert logger.log.call_args[1]["count"] == 1
+        assert logger.log.call_args[1]["p99"] >= 0
+
+    @pytest.mark.asyncio
+    async def test_coroutines_are_timed_until_complete(self):
+        logger = MagicMock()
+
+        @under_test.timer(logger)
+        async def sample_coroutine():
+            await asyncio.sleep(0.01)
+            return True
+
+        assert await sample_coroutine()
+
+        logger.log.assert_called_once()
+        assert logger.log.call_args[1]["function"] == "sample_coroutine"
+        assert logger.log.call_args[1]["seconds"] >= 0.01
+
+    @pytest.mark.asyncio
+    async def test_async_generators_are_timed_until_exhausted(self):
+        logger = MagicMock()
+
+        @under_test.timer(logger)
+        async def sample_async_generator():
+            for i in range(3):
+                await asyncio.sleep(0.005)
+                yield i
+
+        assert [i async for i in sample_async_generator()] == [0, 1, 2]
+
+        logger.log.assert_called_once()
+        assert logger.log.call_args[1]["seconds"] >= 0.015
+
+    def test_generators_are_timed_until_exhausted(self):
+        logger = MagicMock()
+
+        @under_test.timer(logger)
+        def sample_generator():
+            received = yield 1
+            yield received
+            return "done"
+
+        generator = sample_generator()
+        assert next(generator) == 1
+        logger.log.assert_not_called()
+        assert generator.send(2) == 2
+        with pytest.raises(StopIteration) as stop:
+            next(generator)
+
+        assert stop.value.value == "done"
+        logger.log.assert_called_once()
+
+    def test_nothing_is_measured_when_level_is_disabled(self):
+        logger = MagicMock()
+        logger.isEnabledFor.return_value = False
+
+        @under_test.timer(logger, level=logging.DEBUG)
+        def sample_fn():
+            return True
+
+        assert sample_fn()
+
+        logger.isEnabledFor.assert_called_once_with(logging.DEBUG)
+        logger.log.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_disabled_coroutines_and_generators_still_run(self):
+        logger = MagicMock()
+        logger.isEnabledFor.return_value = False
+
+        @under_test.timer(logger)
+        async def sample_coroutine():
+            return True
+
+        @under_test.timer(logger)
+        async def sample_async_generator():
+            yield 1
+
+        @under_test.timer(logger)
+        def sample_generator():
+            yield 1
+            return "done"
+
+        assert await sample_coroutine()
+        assert [i async for i in sample_async_generator()] == [1]
+        generator = sample_generator()
+        assert next(generator) == 1
+        with pytest.raises(StopIteration) as stop:
+            next(generator)
+        assert stop.value.value == "done"
+        logger.log.assert_not_called()
+
+    def test_sample_every(self):
+        logger = MagicMock()
+
+        @under_test.timer(logger, sample_every=10)
+        def sample_fn():
+            return True
+
+        for _ in range(100):
+            assert sample_fn()
+
+        assert logger.log.call_count == 10
+
+    @patch("random.random")
+    def test_sample_rate(self, mock_random):
+        logger = MagicMock()
+        mock_random.side_effect = [0.05, 0.5] * 10
+
+        @under_test.timer(logger, sample_rate=0.1)
+        def sample_fn():
+            return True
+
+        for _ in range(20):
+            assert sample_fn()
+
+        assert logger.log.call_count == 10
+
+    @patch("random.random")
+    def test_sample_every_and_sample_rate(self, mock_random):
+        logger = MagicMock()
+        mock_random.side_effect = [0.05, 0.5] * 5
+
+        @under_test.timer(logger, sample_every=2, sample_rate=0.1)
+        def sample_fn():
+            return True
+
+        for _ in range(20):
+            assert sample_fn()
+
+        assert logger.log.call_count == 5
+
+
+class TestTiming:
+    def test_blocks_are_timed(self):
+        logger = MagicMock()
+
+        with under_test.Timing("sample block", logger, level=logging.DEBUG, extra="field") as t:
+            pass
+
+        logger.log.assert_called_once_with(
+            logging.DEBUG,
+            "timing information",
+            block="sample block",
+            seconds=t.seconds,
+            extra="field",
+        )
+
+    @pytest.mark.asyncio
+    async def test_async_blocks_are_timed(self):
+        logger = MagicMock()
+
+        async with under_test.Timing("sample block", logger) as t:
+            await asyncio.sleep(0.01)
+
+        assert t.seconds >= 0.01
+        logger.log.assert_called_once()
+
+    def test_nothing_is_measured_when_level_is_disabled(self):
+        logger = MagicMock()
+        logger.isEnabledFor.return_value = False
+
+        with under_test.Timing("sample block", logger) as t:
+            pass
+
+        assert t.seconds is None
+        logger.log.assert_not_called()
+
+    def test_loggers_without_level_checks_are_enabled(self):
+        logger = MagicMock(spec=["log"])
+
+        with under_test.Timing("sample block", logger):
+            pass
+
+        logger.log.assert_called_once()